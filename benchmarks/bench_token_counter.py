@@ -0,0 +1,95 @@
+"""Benchmark the token counting backends.
+
+Measures throughput and peak traced memory of every ``count_*_tokens``
+helper on small, medium and huge inputs, and of the regex fallback against
+the old ``len(_regex_split(text))`` implementation. The script fails if the
+counting-only fallback ever disagrees with the old one.
+
+Run with::
+
+    PYTHONPATH=src python benchmarks/bench_token_counter.py [--quick]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+import tracemalloc
+from typing import Callable, Iterable
+
+import token_tally.token_counter as tc
+
+_WORDS = [
+    "the", "token", "gateway", "meters", "usage", "for", "OpenAI,", "Anthropic",
+    "and", "local", "models;", "invoices", "reconcile", "123", "4.5%", "naïve",
+    "café", "snake_case", "e-mail", "(beta)", "--", "…", "\n", "\t",
+]
+
+
+def make_text(size: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts: list[str] = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)[:size]
+
+
+def _time(func: Callable[[str], int], text: str, repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    result = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _peak(func: Callable[[str], int], text: str) -> int:
+    tracemalloc.start()
+    try:
+        func(text)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes: Iterable[tuple[str, int, int]]) -> None:
+    backends: dict[str, Callable[[str], int]] = {
+        "openai": tc.count_openai_tokens,
+        "anthropic": tc.count_anthropic_tokens,
+        "cohere": tc.count_cohere_tokens,
+        "ollama": tc.count_ollama_tokens,
+        "local": tc.count_local_tokens,
+        "regex_split (old)": lambda t: len(tc._regex_split(t)),
+        "regex_count": tc._regex_count,
+    }
+    print(f"{'input':<8} {'backend':<18} {'tokens':>10} {'MB/s':>9} {'peak KiB':>10}")
+    for label, size, repeat in sizes:
+        text = make_text(size)
+        old = len(tc._regex_split(text))
+        new = tc._regex_count(text)
+        if old != new:
+            raise SystemExit(f"regex_count mismatch on {label}: {new} != {old}")
+        for name, func in backends.items():
+            seconds, tokens = _time(func, text, repeat)
+            mbps = len(text) / seconds / 1e6 if seconds else float("inf")
+            peak = _peak(func, text) // 1024
+            print(f"{label:<8} {name:<18} {tokens:>10} {mbps:>9.1f} {peak:>10}")
+
+
+def main(argv: Iterable[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Token counter benchmark")
+    parser.add_argument("--quick", action="store_true", help="Skip the huge input")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+    sizes = [("small", 200, 2000), ("medium", 100_000, 20)]
+    if not args.quick:
+        sizes.append(("huge", 16_000_000, 2))
+    run(sizes)
+
+
+if __name__ == "__main__":
+    main()
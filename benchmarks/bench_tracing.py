@@ -0,0 +1,125 @@
+"""Benchmark the per-call overhead of the tracing shim.
+
+Times an empty ``with tracer.span(...)`` block with tracing off, head-sampled
+at ``--rate`` and fully on, next to a bare function call and the old
+per-module dummy tracer with its ``try``/``except set_attribute``. Uses the
+OpenTelemetry SDK without exporters when it is installed, otherwise a
+minimal in-process recording backend.
+
+Run with::
+
+    PYTHONPATH=src python benchmarks/bench_tracing.py [--calls N] [--rate R]
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+from token_tally import tracing
+
+
+class _Span:
+    __slots__ = ("attributes",)
+
+    def __init__(self, attributes: dict | None) -> None:
+        self.attributes = dict(attributes or {})
+
+    def set_attribute(self, key: str, value: object) -> None:
+        self.attributes[key] = value
+
+
+class _RecordingBackend:
+    def get_tracer(self, name: str) -> "_RecordingBackend":
+        return self
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: dict | None = None):
+        yield _Span(attributes)
+
+
+def _backend():
+    try:
+        from opentelemetry.sdk.trace import TracerProvider
+
+        return TracerProvider(), "opentelemetry-sdk"
+    except Exception:
+        return _RecordingBackend(), "in-process recorder"
+
+
+class _OldDummySpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        pass
+
+    def set_attribute(self, *args: object, **kwargs: object) -> None:
+        pass
+
+
+class _OldDummyTracer:
+    def start_as_current_span(self, name: str) -> _OldDummySpan:
+        return _OldDummySpan()
+
+
+def _per_call(func: Callable[[], None], calls: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / calls * 1e9
+
+
+def run(calls: int, rate: float) -> None:
+    tracer = tracing.get_tracer(__name__)
+    old = _OldDummyTracer()
+
+    def baseline() -> None:
+        pass
+
+    def old_dummy() -> None:
+        with old.start_as_current_span("op") as span:
+            try:
+                span.set_attribute("event_id", "evt")
+            except Exception:
+                pass
+
+    def shim() -> None:
+        with tracer.span("op", event_id="evt"):
+            pass
+
+    backend, label = _backend()
+    modes = [
+        ("bare call", None, None, baseline),
+        ("old dummy tracer", None, None, old_dummy),
+        ("shim off", None, 1.0, shim),
+        (f"shim sampled {rate:g}", backend, rate, shim),
+        ("shim on", backend, 1.0, shim),
+    ]
+    print(f"backend: {label}, {calls} calls per mode")
+    print(f"{'mode':<22} {'ns/call':>10}")
+    previous = (tracing._config.backend, tracing._config.sample_rate)
+    try:
+        for name, mode_backend, mode_rate, func in modes:
+            if mode_rate is not None:
+                tracing.configure(sample_rate=mode_rate, backend=mode_backend)
+            print(f"{name:<22} {_per_call(func, calls):>10.0f}")
+    finally:
+        tracing.configure(sample_rate=previous[1], backend=previous[0])
+
+
+def main(argv: Iterable[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Tracing overhead benchmark")
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--rate", type=float, default=0.01, help="Sampled mode rate")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+    run(args.calls, args.rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
-from .usage_ledger import UsageEvent, UsageLedger, ClickHouseUsageLedger
+from .usage_ledger import (
+    UsageEvent,
+    UsageLedger,
+    ClickHouseUsageLedger,
+    GroupCommitWriter,
+)
 from .audit import AuditLog
 from .token_counter import (
     count_openai_tokens,
@@ -7,6 +12,11 @@ from .token_counter import (
     count_ollama_tokens,
     count_local_tokens,
     count_tokens,
+    count_tokens_batch,
+    count_tokens_with_prefix,
+    TokenCounterStream,
+    enable_token_cache,
+    disable_token_cache,
 )
 from .gpu_metrics import parse_dcgm_gpu_minutes
 from .gpu_arbitrage import choose_best_gpu_host
@@ -23,6 +33,7 @@ __all__ = [
     "UsageEvent",
     "UsageLedger",
     "ClickHouseUsageLedger",
+    "GroupCommitWriter",
     "AuditLog",
     "count_openai_tokens",
     "count_anthropic_tokens",
@@ -30,6 +41,11 @@ __all__ = [
     "count_ollama_tokens",
     "count_local_tokens",
     "count_tokens",
+    "count_tokens_batch",
+    "count_tokens_with_prefix",
+    "TokenCounterStream",
+    "enable_token_cache",
+    "disable_token_cache",
     "parse_dcgm_gpu_minutes",
     "choose_best_gpu_host",
     "Ledger",
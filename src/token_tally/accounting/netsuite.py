@@ -5,12 +5,26 @@ from __future__ import annotations
 import base64
 import json
 import os
-import urllib.request
+from typing import Optional
+from urllib.parse import quote, urlsplit
 
+from ..http_pool import request_target, shared_pool
 
-def push_invoice(invoice: dict) -> dict:
+
+def is_configured() -> bool:
+    """Return ``True`` if NetSuite credentials are set in the environment."""
+    return all(
+        os.getenv(name)
+        for name in ("NETSUITE_ACCOUNT", "NETSUITE_TOKEN", "NETSUITE_SECRET")
+    )
+
+
+def push_invoice(invoice: dict, external_id: Optional[str] = None) -> dict:
     """Push a single invoice to NetSuite and return the response.
 
+    With ``external_id`` the invoice is upserted with ``PUT .../eid:<id>``,
+    so resending it updates the same record instead of creating another.
+
     The NetSuite API credentials and endpoint are taken from the following
     environment variables:
 
@@ -28,9 +42,16 @@ def push_invoice(invoice: dict) -> dict:
         raise ValueError("Missing NetSuite credentials")
 
     data = json.dumps(invoice).encode()
-    req = urllib.request.Request(url, data=data)
     auth = base64.b64encode(f"{account}:{token}:{secret}".encode()).decode()
-    req.add_header("Authorization", f"Basic {auth}")
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read())
+    headers = {
+        "Authorization": f"Basic {auth}",
+        "Content-Type": "application/json",
+    }
+    if external_id:
+        path = urlsplit(url).path.rstrip("/")
+        target = f"{path}/eid:{quote(external_id)}"
+        resp = shared_pool(url).request("PUT", target, data, headers)
+    else:
+        resp = shared_pool(url).request("POST", request_target(url), data, headers)
+    resp.raise_for_status()
+    return resp.json()
@@ -0,0 +1,237 @@
+"""Deliver queued invoice pushes to accounting systems."""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from hashlib import blake2b
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from ..ledger import Ledger
+from ..metrics import ACCOUNTING_DELIVERY_SECONDS, ACCOUNTING_OUTBOX_DEPTH
+
+Sender = Callable[[dict], Any]
+BatchSender = Callable[[List[dict]], List[Optional[Exception]]]
+
+# One request limit per destination, shared by every drain in the process.
+_LIMITS: Dict[tuple, threading.BoundedSemaphore] = {}
+_LIMITS_LOCK = threading.Lock()
+
+
+def _limit(name: str, concurrency: int) -> threading.BoundedSemaphore:
+    with _LIMITS_LOCK:
+        key = (name, concurrency)
+        if key not in _LIMITS:
+            _LIMITS[key] = threading.BoundedSemaphore(concurrency)
+        return _LIMITS[key]
+
+
+@dataclass
+class Destination:
+    """How to deliver invoice payloads to one accounting system.
+
+    ``send_batch`` is used for groups of up to ``batch_size`` jobs when the
+    system has a bulk endpoint; it returns one error (or ``None``) per
+    payload. At most ``concurrency`` requests run against the system at
+    once across all drains in the process. With ``request_ids`` the senders
+    also get a ``request_id`` keyword that stays the same when the same
+    jobs are resent, for the system to deduplicate on.
+    """
+
+    send: Sender
+    send_batch: Optional[BatchSender] = None
+    batch_size: int = 30
+    concurrency: int = 4
+    request_ids: bool = False
+
+
+def _request_id(jobs: List[Dict[str, Any]]) -> str:
+    """Stable id for sending ``jobs``: their ids plus their payloads.
+
+    A job re-queued with a new payload gets a new id, so the system does not
+    replay the response for the old one.
+    """
+    digest = blake2b(digest_size=16)
+    for job in jobs:
+        digest.update(f"{job['id']}:".encode())
+        digest.update(json.dumps(job["payload"], sort_keys=True).encode())
+    return f"tt-{digest.hexdigest()}"
+
+
+class AccountingOutbox:
+    """Concurrent worker for the ledger's ``accounting_outbox`` table.
+
+    ``destinations`` maps a destination name (``"quickbooks"``,
+    ``"netsuite"``) to a :class:`Destination` or a plain single-payload
+    sender. Failed jobs are retried with exponential backoff and jitter up
+    to ``max_attempts`` times. When the next retry would fall after the
+    drain deadline, the job goes back to pending with ``next_attempt_at``
+    set, and a later drain picks it up once it is due. Jobs for destinations
+    without a sender are left untouched.
+
+    Each batch is claimed (``in_progress`` with a lease of ``lease_seconds``)
+    right before it is sent, and only the jobs this worker claimed are
+    delivered, so overlapping drains in one or more processes never post the
+    same job twice. Leases of crashed workers expire back to pending.
+    """
+
+    def __init__(
+        self,
+        ledger: Ledger,
+        destinations: Dict[str, Union[Destination, Sender]],
+        *,
+        max_attempts: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 300.0,
+        lease_seconds: float = 300.0,
+    ) -> None:
+        self.ledger = ledger
+        self.destinations = {
+            name: dest if isinstance(dest, Destination) else Destination(dest)
+            for name, dest in destinations.items()
+        }
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+
+    @staticmethod
+    def _send(dest: Destination, jobs: List[Dict[str, Any]]) -> List[Optional[Exception]]:
+        if dest.send_batch is not None and len(jobs) > 1:
+            payloads = [job["payload"] for job in jobs]
+            try:
+                if dest.request_ids:
+                    return dest.send_batch(payloads, request_id=_request_id(jobs))
+                return dest.send_batch(payloads)
+            except Exception as exc:
+                return [exc] * len(jobs)
+        errors: List[Optional[Exception]] = []
+        for job in jobs:
+            try:
+                if dest.request_ids:
+                    dest.send(job["payload"], request_id=_request_id([job]))
+                else:
+                    dest.send(job["payload"])
+            except Exception as exc:
+                errors.append(exc)
+            else:
+                errors.append(None)
+        return errors
+
+    def _deliver(
+        self, name: str, jobs: List[Dict[str, Any]], deadline: Optional[float]
+    ) -> Dict[str, int]:
+        dest = self.destinations[name]
+        counts = {"sent": 0, "failed": 0, "deferred": 0}
+        claimed = set(
+            self.ledger.claim_outbox_jobs(
+                [job["id"] for job in jobs], time.time() + self.lease_seconds
+            )
+        )
+        jobs = [job for job in jobs if job["id"] in claimed]
+        delay = self.backoff
+        while jobs:
+            start = time.monotonic()
+            with _limit(name, dest.concurrency):
+                errors = self._send(dest, jobs)
+            ACCOUNTING_DELIVERY_SECONDS.labels(name).observe(time.monotonic() - start)
+            retry = []
+            for job, error in zip(jobs, errors):
+                job["attempts"] += 1
+                if error is None:
+                    self.ledger.update_outbox_job(job["id"], "sent", job["attempts"])
+                    counts["sent"] += 1
+                elif job["attempts"] >= self.max_attempts:
+                    self.ledger.update_outbox_job(
+                        job["id"], "failed", job["attempts"], repr(error)
+                    )
+                    counts["failed"] += 1
+                else:
+                    retry.append((job, error))
+            if not retry:
+                break
+            # Stay well inside the lease renewed below, so no other drain can
+            # reclaim the jobs while this one sleeps.
+            wait_for = min(random.uniform(delay / 2, delay), self.lease_seconds / 4)
+            delay = min(delay * 2, self.max_backoff)
+            due = time.time() + wait_for
+            defer = deadline is not None and time.monotonic() + wait_for > deadline
+            for job, error in retry:
+                if defer:
+                    self.ledger.update_outbox_job(
+                        job["id"], "pending", job["attempts"], repr(error), due
+                    )
+                else:
+                    self.ledger.update_outbox_job(
+                        job["id"],
+                        "in_progress",
+                        job["attempts"],
+                        repr(error),
+                        due,
+                        lease_until=due + self.lease_seconds,
+                    )
+            if defer:
+                counts["deferred"] += len(retry)
+                break
+            time.sleep(wait_for)
+            jobs = [job for job, _ in retry]
+        return counts
+
+    def _update_depth(self) -> None:
+        pending = self.ledger.count_outbox_jobs("pending")
+        for name in self.destinations:
+            ACCOUNTING_OUTBOX_DEPTH.labels(name).set(pending.get(name, 0))
+
+    def drain(
+        self,
+        invoice_ids: Optional[Iterable[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, int]:
+        """Deliver due pending jobs, waiting at most ``timeout`` seconds.
+
+        Returns counts of ``sent``, ``failed``, ``deferred`` (retry scheduled
+        for a later drain) and ``in_progress`` jobs. Batches already sending
+        at the deadline finish in the background and record their own
+        status; batches not yet started are left pending.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.ledger.release_expired_outbox_leases(time.time())
+        by_dest: Dict[str, List[Dict[str, Any]]] = {}
+        for job in self.ledger.get_outbox_jobs(
+            "pending", invoice_ids, due_before=time.time()
+        ):
+            if job["destination"] in self.destinations:
+                by_dest.setdefault(job["destination"], []).append(job)
+        self._update_depth()
+        counts = {"sent": 0, "failed": 0, "deferred": 0, "in_progress": 0}
+        if not by_dest:
+            return counts
+
+        pools = []
+        futures: Dict[Future, int] = {}
+        for name, jobs in by_dest.items():
+            dest = self.destinations[name]
+            size = dest.batch_size if dest.send_batch is not None else 1
+            pool = ThreadPoolExecutor(max_workers=dest.concurrency)
+            pools.append(pool)
+            for i in range(0, len(jobs), size):
+                batch = jobs[i : i + size]
+                futures[pool.submit(self._deliver, name, batch, deadline)] = len(batch)
+        done, not_done = wait(futures, timeout=timeout)
+        for pool in pools:
+            # Batches not started yet are dropped unclaimed, so they stay
+            # pending for the next drain instead of running past the deadline.
+            pool.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            for status, n in future.result().items():
+                counts[status] += n
+        counts["in_progress"] = sum(futures[f] for f in not_done if not f.cancelled())
+        self._update_depth()
+        return counts
+
+
+__all__ = ["AccountingOutbox", "BatchSender", "Destination", "Sender"]
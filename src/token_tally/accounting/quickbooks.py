@@ -3,16 +3,78 @@
 from __future__ import annotations
 
 import json
-import urllib.request
+from typing import List, Optional
+from urllib.parse import quote
+
+from ..http_pool import request_target, shared_pool
 
 QUICKBOOKS_API_URL = "https://quickbooks.api.intuit.com/v3/invoices"
+QUICKBOOKS_BATCH_URL = "https://quickbooks.api.intuit.com/v3/batch"
+# QuickBooks accepts at most 30 operations per batch request.
+QUICKBOOKS_BATCH_SIZE = 30
+
+
+class QuickBooksFault(RuntimeError):
+    """An invoice rejected inside a QuickBooks batch response."""
+
+
+def _post(url: str, payload: dict, token: str, request_id: Optional[str]) -> dict:
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+    }
+    target = request_target(url)
+    if request_id:
+        # QuickBooks replays the original response for a repeated requestid.
+        target += ("&" if "?" in target else "?") + f"requestid={quote(request_id)}"
+    resp = shared_pool(url).request(
+        "POST",
+        target,
+        json.dumps(payload).encode(),
+        headers,
+        retry_stale=request_id is not None,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def send_invoice_to_quickbooks(
+    invoice: dict, token: str, request_id: Optional[str] = None
+) -> dict:
+    """Post ``invoice`` to the QuickBooks API using ``token``.
+
+    Resending with the same ``request_id`` does not create a second invoice.
+    """
+    return _post(QUICKBOOKS_API_URL, invoice, token, request_id)
+
 
+def send_invoices_to_quickbooks(
+    invoices: List[dict], token: str, request_id: Optional[str] = None
+) -> List[Optional[Exception]]:
+    """Create up to :data:`QUICKBOOKS_BATCH_SIZE` invoices in one batch call.
 
-def send_invoice_to_quickbooks(invoice: dict, token: str) -> dict:
-    """Post ``invoice`` to the QuickBooks API using ``token``."""
-    data = json.dumps(invoice).encode()
-    req = urllib.request.Request(QUICKBOOKS_API_URL, data=data)
-    req.add_header("Authorization", f"Bearer {token}")
-    req.add_header("Content-Type", "application/json")
-    with urllib.request.urlopen(req) as resp:
-        return json.loads(resp.read())
+    Returns one entry per invoice: ``None`` if it was created or a
+    :class:`QuickBooksFault` describing why it was rejected. ``request_id``
+    deduplicates a resent batch as for :func:`send_invoice_to_quickbooks`.
+    """
+    if len(invoices) > QUICKBOOKS_BATCH_SIZE:
+        raise ValueError(f"at most {QUICKBOOKS_BATCH_SIZE} invoices per batch")
+    body = _post(
+        QUICKBOOKS_BATCH_URL,
+        {
+            "BatchItemRequest": [
+                {"bId": str(i), "operation": "create", "Invoice": invoice}
+                for i, invoice in enumerate(invoices)
+            ]
+        },
+        token,
+        request_id,
+    )
+    results: List[Optional[Exception]] = [
+        QuickBooksFault("missing from batch response") for _ in invoices
+    ]
+    for item in body.get("BatchItemResponse", []):
+        index = int(item["bId"])
+        fault = item.get("Fault")
+        results[index] = QuickBooksFault(json.dumps(fault)) if fault else None
+    return results
@@ -1,11 +1,24 @@
 from __future__ import annotations
 
-import sqlite3
 from dataclasses import dataclass
 from datetime import datetime, UTC
 from hashlib import sha256
 from typing import List, Optional, Dict, Any
 
+from . import migrations
+from . import sqlite_pool
+
+_MIGRATIONS: list[migrations.Migration] = [
+    # add_event reads the latest hash per customer; verify_chain walks it in order.
+    (
+        1,
+        [
+            "CREATE INDEX IF NOT EXISTS idx_audit_events_customer_ts "
+            "ON audit_events(customer_id, ts)"
+        ],
+    ),
+]
+
 
 @dataclass
 class AuditEvent:
@@ -24,7 +37,7 @@ class AuditLog:
         self._ensure_table()
 
     def _ensure_table(self) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS audit_events (
@@ -38,6 +51,7 @@ class AuditLog:
                 """
             )
             conn.commit()
+            migrations.apply_migrations(conn, "audit", _MIGRATIONS)
 
     def add_event(
         self,
@@ -49,7 +63,7 @@ class AuditLog:
     ) -> None:
         ts = ts or datetime.now(UTC)
         prompt_hash = sha256(prompt.encode("utf-8")).hexdigest()
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             cur = conn.execute(
                 "SELECT prev_hash FROM audit_events WHERE customer_id = ? ORDER BY ts DESC LIMIT 1",
                 (customer_id,),
@@ -81,7 +95,7 @@ class AuditLog:
             query += " WHERE customer_id = ?"
             params = (customer_id,)
         query += " ORDER BY ts"
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             cur = conn.execute(query, params)
             rows = cur.fetchall()
         keys = [
@@ -96,7 +110,7 @@ class AuditLog:
 
     def delete_events(self, customer_id: str) -> None:
         """Remove all audit events for ``customer_id``."""
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
                 "DELETE FROM audit_events WHERE customer_id = ?",
                 (customer_id,),
@@ -106,7 +120,7 @@ class AuditLog:
     def verify_chain(self, customer_id: Optional[str] = None) -> bool:
         """Return ``True`` if the hash chain is intact."""
         customers: List[str]
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             if customer_id:
                 customers = [customer_id]
             else:
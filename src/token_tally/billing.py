@@ -1,30 +1,96 @@
 import base64
+import email.utils
 import json
 import os
+import random
 import time
-import urllib.request
 import urllib.parse
-from typing import Optional, List, Dict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Iterable, Iterator, Optional, List, Dict, Set, Tuple
 
 from .accounting import netsuite
+from .accounting.outbox import AccountingOutbox, Destination
 
-from .fx import convert
+from .fx import convert_many
 from .fx_rates import get_rates
-from .accounting.quickbooks import send_invoice_to_quickbooks
+from .accounting.quickbooks import (
+    QUICKBOOKS_BATCH_SIZE,
+    send_invoice_to_quickbooks,
+    send_invoices_to_quickbooks,
+)
 
+from .http_pool import HTTPConnectionPool
 from .ledger import Ledger
+from .metrics import OPERATION_SECONDS, timed
 
 USAGE_API_URL = "https://api.stripe.com/v1/usage_records"
 
 
+class StripeAPIError(RuntimeError):
+    """Raised when Stripe rejects a request or retries are exhausted."""
+
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"Stripe API returned {status}: {body[:200]!r}")
+        self.status = status
+        self.body = body
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a ``Retry-After`` header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        # ``-0000`` dates parse as naive; HTTP dates are always UTC.
+        when = when.replace(tzinfo=UTC)
+    return max(0.0, (when - datetime.now(UTC)).total_seconds())
+
+
 class StripeUsageClient:
-    """Creates usage records via Stripe Billing API."""
+    """Creates usage records via Stripe Billing API.
+
+    Requests share a keep-alive connection pool, so the client can be used
+    from several threads at once. Rate-limited (429) and server-error
+    responses are retried, honouring ``Retry-After`` when Stripe sends it and
+    backing off exponentially with jitter otherwise.
+    """
 
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        *,
+        url: str = USAGE_API_URL,
+        max_connections: int = 8,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ):
         self.api_key = api_key
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._path = urllib.parse.urlsplit(url).path or "/"
+        self._pool = HTTPConnectionPool(url, max_connections=max_connections)
 
+    @timed(OPERATION_SECONDS, "stripe.create_usage_record")
     def create_usage_record(
-        self, subscription_item: str, quantity: int, timestamp: int
+        self,
+        subscription_item: str,
+        quantity: int,
+        timestamp: int,
+        idempotency_key: Optional[str] = None,
     ) -> Dict:
         data = urllib.parse.urlencode(
             {
@@ -34,89 +100,335 @@ class StripeUsageClient:
                 "action": "increment",
             }
         ).encode()
-        req = urllib.request.Request(USAGE_API_URL, data=data)
         auth_header = base64.b64encode(f"{self.api_key}:".encode()).decode()
-        req.add_header("Authorization", f"Basic {auth_header}")
-        with urllib.request.urlopen(req) as resp:
-            return json.loads(resp.read())
+        headers = {
+            "Authorization": f"Basic {auth_header}",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        delay = self.backoff
+        attempt = 0
+        while True:
+            # Stripe deduplicates keyed requests, so a dropped keep-alive
+            # connection can safely be retried.
+            resp = self._pool.request(
+                "POST", self._path, data, headers, retry_stale=bool(idempotency_key)
+            )
+            if resp.status < 300:
+                return json.loads(resp.body)
+            retryable = resp.status == 429 or resp.status >= 500
+            if not retryable or attempt >= self.max_retries:
+                raise StripeAPIError(resp.status, resp.body)
+            attempt += 1
+            wait_for = _retry_after(resp.header("Retry-After"))
+            if wait_for is None:
+                wait_for = random.uniform(0, delay)
+                delay = min(delay * 2, self.max_backoff)
+            time.sleep(min(wait_for, self.max_backoff))
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+def _event_timestamp(ev: Dict[str, Any]) -> int:
+    if isinstance(ev["ts"], str):
+        return int(time.mktime(time.strptime(ev["ts"], "%Y-%m-%d %H:%M:%S")))
+    return int(ev["ts"])
+
+
+@dataclass
+class UsageRecordGroup:
+    """One Stripe usage record and the ledger events it accounts for.
+
+    ``idempotency_key`` is empty until the sync engine assigns one.
+    """
+
+    subscription_item: str
+    bucket: int
+    timestamp: int = 0
+    quantity: int = 0
+    event_ids: List[str] = field(default_factory=list)
+    idempotency_key: str = ""
+
+
+def aggregate_usage_events(
+    events: Iterable[Dict[str, Any]], bucket_seconds: Optional[int] = 3600
+) -> List[UsageRecordGroup]:
+    """Collapse events by ``(feature, time bucket)`` into usage records.
+
+    Usage records use ``action=increment``, so one record carrying the summed
+    quantity bills the same as one record per event. Each group keeps the
+    ids of its events and takes the latest event time as its timestamp.
+    Events that already carry an ``idempotency_key`` are grouped by it, so a
+    record planned by an earlier run is rebuilt exactly. With
+    ``bucket_seconds=None`` every other event becomes its own group.
+    """
+    groups: Dict[Tuple[Any, ...], UsageRecordGroup] = {}
+    singles: List[UsageRecordGroup] = []
+    for ev in events:
+        ts = _event_timestamp(ev)
+        stored = ev.get("idempotency_key")
+        if stored or bucket_seconds:
+            bucket = ts - ts % bucket_seconds if bucket_seconds else ts
+            key = (stored,) if stored else (ev["feature"], bucket)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = UsageRecordGroup(
+                    ev["feature"], bucket, idempotency_key=stored or ""
+                )
+        else:
+            group = UsageRecordGroup(ev["feature"], ts)
+            singles.append(group)
+        group.timestamp = max(group.timestamp, ts)
+        group.quantity += ev["units"]
+        group.event_ids.append(ev["id"])
+    return singles + list(groups.values())
+
+
+class UsageSyncEngine:
+    """Push pending ledger events to Stripe concurrently.
+
+    Pending rows are read in pages of ``page_size``, and each page is
+    collapsed into one usage record per feature and ``bucket_seconds``
+    window (see :func:`aggregate_usage_events`) before the next is read.
+    Each record gets the idempotency key ``usage-<item>-<bucket>-<run>.<page>``
+    from the run number the ledger hands out, and the key is stored on its
+    events before posting. Events a previous run planned but did not sync
+    are posted again first under their stored key, so a retried or crashed
+    sync cannot double count. Records are posted by ``concurrency`` worker
+    threads. Every contributing event is marked synced with the record id,
+    in batches of ``flush_size``. Events whose record fails stay pending
+    for the next run and are listed in ``failures``.
+    """
+
+    def __init__(
+        self,
+        ledger: Ledger,
+        client: StripeUsageClient,
+        *,
+        concurrency: int = 8,
+        page_size: int = 500,
+        flush_size: int = 200,
+        bucket_seconds: Optional[int] = 3600,
+    ):
+        self.ledger = ledger
+        self.client = client
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.flush_size = flush_size
+        self.bucket_seconds = bucket_seconds
+        self.failures: List[Tuple[str, Exception]] = []
+        self.records_sent = 0
+        self._synced: List[Tuple[str, str]] = []
+        self._count = 0
+
+    def _push(self, group: UsageRecordGroup) -> List[Tuple[str, str]]:
+        resp = self.client.create_usage_record(
+            subscription_item=group.subscription_item,
+            quantity=group.quantity,
+            timestamp=group.timestamp,
+            idempotency_key=group.idempotency_key,
+        )
+        record_id = resp.get("id", "")
+        return [(event_id, record_id) for event_id in group.event_ids]
+
+    def _collect(self, done: Set[Future], groups: Dict[Future, UsageRecordGroup]) -> None:
+        for future in done:
+            group = groups.pop(future)
+            try:
+                self._synced.extend(future.result())
+                self.records_sent += 1
+            except Exception as exc:
+                self.failures.extend((event_id, exc) for event_id in group.event_ids)
+        if len(self._synced) >= self.flush_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._synced:
+            self._count += self.ledger.mark_usage_synced_many(self._synced)
+            self._synced = []
+
+    def _plan(self) -> Iterator[UsageRecordGroup]:
+        """Yield records page by page, storing new keys before they are sent."""
+        keyed = self.ledger.iter_keyed_pending_usage_events(self.page_size)
+        for _, events in groupby(keyed, key=itemgetter("idempotency_key")):
+            yield from aggregate_usage_events(events, self.bucket_seconds)
+        run = self.ledger.start_usage_sync_run()
+        for page_no, page in enumerate(self.ledger.iter_pending_usage_pages(self.page_size)):
+            events = [ev for ev in page if not ev["idempotency_key"]]
+            records = aggregate_usage_events(events, self.bucket_seconds)
+            for group in records:
+                if self.bucket_seconds:
+                    group.idempotency_key = (
+                        f"usage-{group.subscription_item}-{group.bucket}-{run}.{page_no}"
+                    )
+                else:
+                    group.idempotency_key = f"usage-{group.event_ids[0]}"
+            self.ledger.set_usage_idempotency_keys(
+                (event_id, group.idempotency_key)
+                for group in records
+                for event_id in group.event_ids
+            )
+            yield from records
+
+    @timed(OPERATION_SECONDS, "stripe.sync")
+    def run(self) -> int:
+        """Sync every pending event and return how many were marked synced."""
+        self.failures = []
+        self.records_sent = 0
+        self._count = 0
+        groups: Dict[Future, UsageRecordGroup] = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight: Set[Future] = set()
+            for group in self._plan():
+                if len(in_flight) >= self.concurrency * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._collect(done, groups)
+                future = pool.submit(self._push, group)
+                groups[future] = group
+                in_flight.add(future)
+            done, _ = wait(in_flight)
+            self._collect(done, groups)
+        self._flush()
+        return self._count
+
+
+def accounting_destinations(
+    qb_token: Optional[str] = None, netsuite_enabled: bool = False
+) -> Dict[str, Destination]:
+    """Outbox destinations for the configured accounting systems.
+
+    QuickBooks jobs go through its batch endpoint. NetSuite has no bulk
+    invoice endpoint and tight concurrency governance, so it gets one
+    invoice per request and fewer parallel requests. Both get stable
+    request ids (QuickBooks ``requestid``, NetSuite external-id upserts), so
+    a retried push cannot create a duplicate invoice.
+    """
+    destinations: Dict[str, Destination] = {}
+    if qb_token:
+        # Resolved at call time so the integrations can be swapped out.
+        destinations["quickbooks"] = Destination(
+            send=lambda payload, request_id: send_invoice_to_quickbooks(
+                payload, qb_token, request_id
+            ),
+            send_batch=lambda payloads, request_id: send_invoices_to_quickbooks(
+                payloads, qb_token, request_id
+            ),
+            batch_size=QUICKBOOKS_BATCH_SIZE,
+            concurrency=4,
+            request_ids=True,
+        )
+    if netsuite_enabled:
+        destinations["netsuite"] = Destination(
+            send=lambda payload, request_id: netsuite.push_invoice(payload, request_id),
+            concurrency=2,
+            request_ids=True,
+        )
+    return destinations
 
 
 class BillingService:
     """Maps ledger events to Stripe usage records and consolidates invoices."""
 
-    def __init__(self, api_key: str, ledger: Optional[Ledger] = None):
+    def __init__(
+        self, api_key: str, ledger: Optional[Ledger] = None, *, concurrency: int = 8
+    ):
         self.ledger = ledger or Ledger()
-        self.client = StripeUsageClient(api_key)
+        self.client = StripeUsageClient(api_key, max_connections=concurrency)
+        self.concurrency = concurrency
 
     def sync_usage_events(self) -> int:
-        events = self.ledger.get_pending_usage_events()
-        for ev in events:
-            resp = self.client.create_usage_record(
-                subscription_item=ev["feature"],
-                quantity=ev["units"],
-                timestamp=(
-                    int(time.mktime(time.strptime(ev["ts"], "%Y-%m-%d %H:%M:%S")))
-                    if isinstance(ev["ts"], str)
-                    else int(ev["ts"])
-                ),
-            )
-            self.ledger.mark_usage_synced(ev["id"], resp.get("id", ""))
-        return len(events)
-
-    def consolidate_invoices(self, cycle: str, currency: str = "USD") -> List[Dict]:
-        events = self.ledger.get_usage_events_by_cycle(cycle)
-        totals: Dict[str, float] = {}
-        credits: Dict[str, float] = {}
-        for ev in events:
-            amount = ev["units"] * ev["unit_cost"]
-            if ev["units"] >= 0:
-                totals.setdefault(ev["customer_id"], 0.0)
-                totals[ev["customer_id"]] += amount
-            else:
-                credits.setdefault(ev["customer_id"], 0.0)
-                credits[ev["customer_id"]] += -amount
+        """Push pending usage to Stripe; see :class:`UsageSyncEngine`.
+
+        Returns how many events were synced. Records that failed with a
+        retryable error stay pending for the next run; if Stripe rejected
+        any record outright (a 4xx other than 429), the first such
+        :class:`StripeAPIError` is raised once the run has finished.
+        """
+        engine = UsageSyncEngine(self.ledger, self.client, concurrency=self.concurrency)
+        count = engine.run()
+        for _, exc in engine.failures:
+            if isinstance(exc, StripeAPIError) and 400 <= exc.status < 500 and exc.status != 429:
+                raise exc
+        return count
+
+    def consolidate_invoices(
+        self,
+        cycle: str,
+        currency: str = "USD",
+        *,
+        push_timeout: Optional[float] = None,
+    ) -> List[Dict]:
+        """Create one invoice per customer for ``cycle`` and queue ERP pushes.
+
+        Totals and credits are summed in SQL. Invoices, credit notes and the
+        accounting outbox jobs are written in one transaction. Delivery is
+        left to ``billing_cli drain`` so ERP latency stays off the billing
+        run; pass ``push_timeout`` to also deliver inline for at most that
+        many seconds. Undelivered jobs stay in the outbox with their status
+        and last error.
+        """
+        totals = self.ledger.get_invoice_totals(cycle)
+        rates = get_rates() if currency != "USD" and totals else None
+        qb_token = os.getenv("QUICKBOOKS_TOKEN")
+        push_netsuite = netsuite.is_configured()
+
+        amounts = [total for _, total, _ in totals]
+        if currency != "USD" and rates:
+            converted, missing = convert_many(amounts, "USD", currency, rates)
+            if any(missing):
+                raise ValueError("Missing currency rate")
+            amounts = converted.tolist()
+
         invoices = []
-        rates = get_rates()
-        for cust, total in totals.items():
-            amt = total
-            if currency != "USD" and rates:
-                amt = convert(total, "USD", currency, rates)
+        invoice_rows = []
+        credit_rows = []
+        outbox = []
+        for (cust, _, credit_amount), amt in zip(totals, amounts):
             invoice_id = f"{cust}-{cycle}"
-            self.ledger.create_invoice(invoice_id, cust, cycle, amt)
-            credit_amount = credits.get(cust, 0.0)
+            invoice_rows.append((invoice_id, cust, cycle, amt, ""))
             if credit_amount:
-                note_id = f"{invoice_id}-credit"
-                self.ledger.create_credit_note(
-                    note_id, invoice_id, credit_amount, "Usage credit"
+                credit_rows.append(
+                    (f"{invoice_id}-credit", invoice_id, credit_amount, "Usage credit")
                 )
-
-            qb_token = os.getenv("QUICKBOOKS_TOKEN")
             if qb_token:
-                send_invoice_to_quickbooks(
-                    {
-                        "invoice_id": invoice_id,
-                        "customer_id": cust,
-                        "amount": amt,
-                        "cycle": cycle,
-                        "credit": credit_amount,
-                        "currency": currency,
-                    },
-                    qb_token,
+                outbox.append(
+                    (
+                        invoice_id,
+                        "quickbooks",
+                        {
+                            "invoice_id": invoice_id,
+                            "customer_id": cust,
+                            "amount": amt,
+                            "cycle": cycle,
+                            "credit": credit_amount,
+                            "currency": currency,
+                        },
+                    )
+                )
+            if push_netsuite:
+                outbox.append(
+                    (
+                        invoice_id,
+                        "netsuite",
+                        {
+                            "invoice_id": invoice_id,
+                            "customer_id": cust,
+                            "cycle": cycle,
+                            "total": amt,
+                            "credit": credit_amount,
+                        },
+                    )
                 )
-
-            invoice_data = {
-                "invoice_id": invoice_id,
-                "customer_id": cust,
-                "cycle": cycle,
-                "total": amt,
-                "credit": credit_amount,
-            }
-            try:
-                netsuite.push_invoice(invoice_data)
-            except Exception:
-                pass
-
             invoices.append(
                 {"invoice_id": invoice_id, "total": amt, "credit": credit_amount}
             )
+
+        self.ledger.record_invoices(invoice_rows, credit_rows, outbox)
+        if outbox and push_timeout:
+            destinations = accounting_destinations(qb_token, push_netsuite)
+            AccountingOutbox(self.ledger, destinations).drain(
+                [row[0] for row in invoice_rows], timeout=push_timeout
+            )
         return invoices
@@ -1,7 +1,10 @@
 import argparse
+import os
 from typing import Iterable
 
-from .billing import BillingService
+from .accounting import netsuite
+from .accounting.outbox import AccountingOutbox
+from .billing import BillingService, accounting_destinations
 from .ledger import Ledger
 
 
@@ -11,12 +14,26 @@ def main(argv: Iterable[str] | None = None) -> None:
     sync_p = sub.add_parser("sync", help="Sync usage events to Stripe")
     sync_p.add_argument("db_path", help="Path to ledger.db")
     sync_p.add_argument("api_key", help="Stripe API key")
+    drain_p = sub.add_parser(
+        "drain", help="Deliver queued QuickBooks/NetSuite invoice pushes"
+    )
+    drain_p.add_argument("db_path", help="Path to ledger.db")
+    drain_p.add_argument(
+        "--timeout", type=float, default=None, help="Stop waiting after N seconds"
+    )
     args = parser.parse_args(list(argv) if argv is not None else None)
 
     if args.cmd == "sync":
         service = BillingService(args.api_key, Ledger(args.db_path))
         count = service.sync_usage_events()
         print(count)
+    elif args.cmd == "drain":
+        destinations = accounting_destinations(
+            os.getenv("QUICKBOOKS_TOKEN"), netsuite.is_configured()
+        )
+        outbox = AccountingOutbox(Ledger(args.db_path), destinations)
+        counts = outbox.drain(timeout=args.timeout)
+        print(" ".join(f"{status}={n}" for status, n in counts.items()))
 
 
 def cli() -> None:
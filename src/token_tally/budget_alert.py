@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import argparse
 from datetime import datetime, UTC
-from typing import Optional, Dict
+from typing import Optional
 
 from .ledger import Ledger
 from .alerts import send_webhook_message
@@ -13,11 +13,7 @@ def run(db_path: str, webhook_url: str, cycle: Optional[str] = None) -> None:
     ledger = Ledger(db_path)
     cycle = cycle or datetime.now(UTC).strftime("%Y-%m")
 
-    events = ledger.get_usage_events_by_cycle(cycle)
-    spend: Dict[str, float] = {}
-    for ev in events:
-        spend.setdefault(ev["customer_id"], 0.0)
-        spend[ev["customer_id"]] += ev["units"] * ev["unit_cost"]
+    spend = ledger.get_spend_by_customer(cycle)
 
     for cust_id, limit in ledger.list_budgets():
         total = spend.get(cust_id, 0.0)
@@ -8,7 +8,7 @@ import os
 from .gpu_arbitrage import choose_best_gpu_host
 
 from .markup import get_effective_markup
-from .fx_rates import get_rates
+from .fx_rates import get_rate_cache
 from .fx import convert
 from .gpu_arbitrage import choose_best_gpu_host
 
@@ -53,7 +53,9 @@ def route_request(
     ``options`` is an iterable of provider descriptions. Each must include
     ``provider``, ``model`` and ``unit_cost`` fields and may include a
     ``currency`` field (default ``USD``). The returned dict includes a
-    ``final_cost`` key with the computed price in ``target_currency``.
+    ``final_cost`` key with the computed price in ``target_currency``,
+    converted with the FX rates in effect at ``ts``, or the latest stored
+    rates when none are that old.
     """
 
     opts: list[ProviderOption] = []
@@ -79,7 +81,8 @@ def route_request(
         raise ValueError("no provider options")
 
     ts = ts or datetime.now(UTC)
-    rates = get_rates(db_path=fx_db_path)
+    cache = get_rate_cache(fx_db_path)
+    rates = cache.rates(ts) or cache.rates()
 
     best: Optional[ProviderOption] = None
     best_cost = float("inf")
@@ -0,0 +1,30 @@
+"""Usage exporters for data warehouses and CSV files."""
+
+from __future__ import annotations
+
+from typing import List, Sequence
+
+from ..fx import convert_many
+from ..fx_rates import DB_PATH, get_rates
+
+
+def usd_to(
+    amounts: Sequence[float], currency: str, fx_db_path: str = DB_PATH
+) -> List[float]:
+    """Convert ledger amounts (stored in USD) to ``currency`` in one pass.
+
+    Uses the latest rates in ``fx_db_path`` and raises ``ValueError`` when
+    either currency has no rate.
+    """
+    if currency == "USD":
+        return list(amounts)
+    converted, missing = convert_many(
+        amounts, "USD", currency, get_rates(db_path=fx_db_path)
+    )
+    # A single source currency, so either every row is missing or none is.
+    if len(missing) and missing[0]:
+        raise ValueError(f"Missing currency rate for {currency}")
+    return converted.tolist()
+
+
+__all__ = ["usd_to"]
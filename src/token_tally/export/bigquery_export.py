@@ -1,7 +1,9 @@
 import argparse
 from typing import Iterable
 
+from ..fx_rates import DB_PATH as FX_DB_PATH
 from ..ledger import Ledger
+from . import usd_to
 
 try:
     from google.cloud import bigquery
@@ -17,8 +19,14 @@ def export_usage(
     table: str,
     *,
     ledger: Ledger | None = None,
+    currency: str = "USD",
+    fx_db_path: str = FX_DB_PATH,
 ) -> None:
-    """Write usage events between ``start`` and ``end`` to BigQuery."""
+    """Write usage events between ``start`` and ``end`` to BigQuery.
+
+    Unit costs are converted from USD to ``currency`` with the latest stored
+    rates.
+    """
 
     if bigquery is None:
         raise ImportError("google-cloud-bigquery not installed")
@@ -27,14 +35,17 @@ def export_usage(
     client = bigquery.Client(project=project)
     table_ref = client.dataset(dataset).table(table)
     events = ledger.get_usage_events_by_range(start, end)
+    unit_costs = usd_to(
+        [ev.get("unit_cost", 0.0) for ev in events], currency, fx_db_path
+    )
     rows = []
-    for ev in events:
+    for ev, unit_cost in zip(events, unit_costs):
         rows.append(
             {
                 "customer_id": ev.get("customer_id", ""),
                 "feature": ev.get("feature", ""),
                 "units": ev.get("units", 0),
-                "unit_cost": ev.get("unit_cost", 0.0),
+                "unit_cost": unit_cost,
                 "ts": ev.get("ts"),
             }
         )
@@ -50,8 +61,18 @@ def main(argv: Iterable[str] | None = None) -> None:
     parser.add_argument("--project", required=True, help="GCP project ID")
     parser.add_argument("--dataset", required=True, help="BigQuery dataset")
     parser.add_argument("--table", required=True, help="BigQuery table")
+    parser.add_argument("--currency", default="USD", help="Currency for costs")
+    parser.add_argument("--fx-db", default=FX_DB_PATH, help="FX rates database")
     args = parser.parse_args(list(argv) if argv is not None else None)
-    export_usage(args.start, args.end, args.project, args.dataset, args.table)
+    export_usage(
+        args.start,
+        args.end,
+        args.project,
+        args.dataset,
+        args.table,
+        currency=args.currency,
+        fx_db_path=args.fx_db,
+    )
 
 
 if __name__ == "__main__":  # pragma: no cover - manual invocation
@@ -22,7 +22,9 @@ try:
 except ImportError:  # pragma: no cover - snowflake-connector not installed
     sf = None  # type: ignore
 
+from ..fx_rates import DB_PATH as FX_DB_PATH
 from ..ledger import Ledger
+from . import usd_to
 
 
 def export_usage(
@@ -31,11 +33,21 @@ def export_usage(
     *,
     ledger: Ledger | None = None,
     table: str | None = None,
+    currency: str = "USD",
+    fx_db_path: str = FX_DB_PATH,
 ) -> None:
-    """Bulk insert usage events between ``start`` and ``end`` into Snowflake."""
+    """Bulk insert usage events between ``start`` and ``end`` into Snowflake.
+
+    Costs are converted from USD to ``currency`` with the latest stored rates.
+    """
 
     ledger = ledger or Ledger()
     events = ledger.get_usage_events_by_range(start, end)
+    costs = usd_to(
+        [ev.get("units", 0) * ev.get("unit_cost", 0.0) for ev in events],
+        currency,
+        fx_db_path,
+    )
 
     table = table or os.environ.get("SNOWFLAKE_TABLE", "USAGE_EVENTS")
 
@@ -62,9 +74,9 @@ def export_usage(
                     ev.get("provider"),
                     ev.get("model"),
                     ev.get("units", 0),
-                    ev.get("units", 0) * ev.get("unit_cost", 0.0),
+                    cost,
                 )
-                for ev in events
+                for ev, cost in zip(events, costs)
             ],
         )
     finally:
@@ -76,9 +88,17 @@ def main(argv: Iterable[str] | None = None) -> None:
     parser.add_argument("--start", required=True, help="YYYY-MM-DD")
     parser.add_argument("--end", required=True, help="YYYY-MM-DD")
     parser.add_argument("--table", help="Destination table name")
+    parser.add_argument("--currency", default="USD", help="Currency for costs")
+    parser.add_argument("--fx-db", default=FX_DB_PATH, help="FX rates database")
     args = parser.parse_args(list(argv) if argv is not None else None)
 
-    export_usage(args.start, args.end, table=args.table)
+    export_usage(
+        args.start,
+        args.end,
+        table=args.table,
+        currency=args.currency,
+        fx_db_path=args.fx_db,
+    )
 
 
 def cli() -> None:
@@ -2,30 +2,44 @@ import argparse
 import csv
 from typing import Iterable
 
+from .export import usd_to
+from .fx_rates import DB_PATH as FX_DB_PATH
 from .ledger import Ledger
 
 
 def export_usage(
-    start: str, end: str, out_csv: str, ledger: Ledger | None = None
+    start: str,
+    end: str,
+    out_csv: str,
+    ledger: Ledger | None = None,
+    *,
+    currency: str = "USD",
+    fx_db_path: str = FX_DB_PATH,
 ) -> None:
-    """Write usage events between ``start`` and ``end`` to ``out_csv``."""
+    """Write usage events between ``start`` and ``end`` to ``out_csv``.
+
+    Costs are converted from USD to ``currency`` with the latest stored rates.
+    """
     ledger = ledger or Ledger()
     events = ledger.get_usage_events_by_range(start, end)
+    costs = usd_to(
+        [ev.get("units", 0) * ev.get("unit_cost", 0.0) for ev in events],
+        currency,
+        fx_db_path,
+    )
     with open(out_csv, "w", newline="") as fh:
         writer = csv.writer(fh)
         writer.writerow(
             ["customer_id", "feature", "provider", "model", "tokens", "cost"]
         )
-        for ev in events:
-            tokens = ev.get("units", 0)
-            cost = tokens * ev.get("unit_cost", 0.0)
+        for ev, cost in zip(events, costs):
             writer.writerow(
                 [
                     ev.get("customer_id", ""),
                     ev.get("feature", ""),
                     ev.get("provider", ""),
                     ev.get("model", ""),
-                    tokens,
+                    ev.get("units", 0),
                     cost,
                 ]
             )
@@ -35,9 +49,13 @@ def main(argv: Iterable[str] | None = None) -> None:
     parser = argparse.ArgumentParser(description="Export usage records to CSV")
     parser.add_argument("--start", required=True, help="YYYY-MM-DD")
     parser.add_argument("--end", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--currency", default="USD", help="Currency for costs")
+    parser.add_argument("--fx-db", default=FX_DB_PATH, help="FX rates database")
     parser.add_argument("out_csv", help="Output CSV file")
     args = parser.parse_args(list(argv) if argv is not None else None)
-    export_usage(args.start, args.end, args.out_csv)
+    export_usage(
+        args.start, args.end, args.out_csv, currency=args.currency, fx_db_path=args.fx_db
+    )
 
 
 if __name__ == "__main__":
@@ -1,26 +1,89 @@
+import io
 import urllib.request
+from array import array
+from typing import BinaryIO, Iterator, Optional, Sequence, Tuple, Union
 from xml.etree import ElementTree
 
+from .metrics import OPERATION_SECONDS, timed
+
+try:  # Optional; vectorises convert_many when installed
+    import numpy as np
+except Exception:  # pragma: no cover - numpy optional
+    np = None
+
 ECB_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml"
 INTRADAY_URL = "https://example.com/fx/intraday.xml"
+ECB_HISTORY_URL = "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.xml"
+
+_CUBE = "{http://www.ecb.int/vocabulary/2002-08-01/eurofxref}Cube"
+
+
+class FxRates(dict):
+    """EUR-based currency->rate mapping with a precomputed cross-rate matrix.
+
+    ``cross[(from_cur, to_cur)]`` is the factor that converts an amount in
+    ``from_cur`` to ``to_cur``, so :func:`convert` needs a single multiply.
+    The matrix is built once on construction; treat instances as read-only.
+    """
+
+    __slots__ = ("cross",)
+
+    def __init__(self, rates=(), **kwargs: float) -> None:
+        super().__init__(rates, **kwargs)
+        items = self.items()
+        self.cross = {(a, b): rb / ra for a, ra in items for b, rb in items}
+
+
+def iter_ecb_rates(source: Union[str, BinaryIO]) -> Iterator[Tuple[Optional[str], str, float]]:
+    """Stream ``(date, currency, rate)`` tuples from ECB FX XML.
+
+    ``source`` is a file path or binary file object, such as an HTTP
+    response. Each dated ``Cube`` also yields ``(date, "EUR", 1.0)`` first,
+    so every day is a complete EUR-based snapshot. Elements are discarded as
+    soon as they are read, so memory stays flat even for ECB's full history
+    file. The date is ``None`` for cubes without a ``time`` attribute.
+    """
+    parents = []
+    day: Optional[str] = None
+    for event, elem in ElementTree.iterparse(source, events=("start", "end")):
+        if elem.tag != _CUBE:
+            continue
+        if event == "start":
+            parents.append(elem)
+            if "time" in elem.attrib:
+                day = elem.attrib["time"]
+                yield day, "EUR", 1.0
+            continue
+        parents.pop()
+        cur = elem.attrib.get("currency")
+        rate = elem.attrib.get("rate")
+        if cur and rate:
+            yield day, cur, float(rate)
+        elif parents:
+            # A finished date cube: drop it and its rate children.
+            parents[-1].clear()
+
+
+def parse_ecb_snapshot(xml_data: bytes) -> Tuple[Optional[str], dict]:
+    """Parse ECB FX XML into its first reference date and its rates.
+
+    Rates are EUR-based; the date is ``None`` if the feed carries no
+    ``time`` attribute. Parsing stops at the second date.
+    """
+    first: Optional[str] = None
+    rates = {"EUR": 1.0}
+    for n, (day, cur, rate) in enumerate(iter_ecb_rates(io.BytesIO(xml_data))):
+        if n == 0:
+            first = day
+        elif day != first:
+            break
+        rates[cur] = rate
+    return first, rates
 
 
 def parse_ecb_rates(xml_data: bytes) -> dict:
     """Parse ECB FX XML into a currency->rate mapping (EUR base)."""
-    tree = ElementTree.fromstring(xml_data)
-    ns = {
-        "gesmes": "http://www.gesmes.org/xml/2002-08-01",
-        "ecb": "http://www.ecb.int/vocabulary/2002-08-01/eurofxref",
-    }
-    cube = tree.find(".//ecb:Cube/ecb:Cube", ns)
-    rates = {"EUR": 1.0}
-    if cube is not None:
-        for child in cube:
-            cur = child.attrib.get("currency")
-            rate = child.attrib.get("rate")
-            if cur and rate:
-                rates[cur] = float(rate)
-    return rates
+    return parse_ecb_snapshot(xml_data)[1]
 
 
 def get_ecb_rates() -> dict:
@@ -39,7 +102,66 @@ def get_intraday_rates() -> dict:
 
 def convert(amount: float, from_cur: str, to_cur: str, rates: dict) -> float:
     """Convert an amount between currencies using EUR-based rates."""
+    if type(rates) is FxRates:
+        try:
+            return amount * rates.cross[from_cur, to_cur]
+        except KeyError:
+            raise ValueError("Missing currency rate") from None
     if from_cur not in rates or to_cur not in rates:
         raise ValueError("Missing currency rate")
     eur = amount / rates[from_cur]
     return eur * rates[to_cur]
+
+
+def _rate_pair(code: str, to_cur: str, rates: dict) -> Tuple[float, float]:
+    # Divide by the first and multiply by the second; NaN when unknown.
+    if code == to_cur:
+        return 1.0, 1.0
+    if code not in rates or to_cur not in rates:
+        return float("nan"), float("nan")
+    return rates[code], rates[to_cur]
+
+
+@timed(OPERATION_SECONDS, "fx.convert_many")
+def convert_many(
+    amounts: Sequence[float],
+    from_currencies: Union[str, Sequence[str]],
+    to_currency: str,
+    rates: dict,
+):
+    """Convert many amounts to ``to_currency`` at once.
+
+    ``from_currencies`` is a single currency code for every amount or one
+    code per amount. Rates are resolved once per distinct code and applied
+    by index. Returns ``(converted, missing)``: ``missing[i]`` is true where
+    a rate is unknown, and ``converted[i]`` is NaN there. Amounts already in
+    ``to_currency`` are returned unchanged. With NumPy both are arrays;
+    otherwise ``converted`` is an ``array('d')`` and ``missing`` a list.
+    """
+    single = isinstance(from_currencies, str)
+    if not single and len(from_currencies) != len(amounts):
+        raise ValueError("amounts and from_currencies differ in length")
+    if np is not None:
+        values = np.asarray(amounts, dtype=float)
+        if single:
+            div, mul = _rate_pair(from_currencies, to_currency, rates)
+            return values / div * mul, np.full(values.shape, div != div)
+        codes, index = np.unique(
+            np.asarray(from_currencies, dtype=str), return_inverse=True
+        )
+        pairs = [_rate_pair(code, to_currency, rates) for code in codes.tolist()]
+        div = np.array([pair[0] for pair in pairs], dtype=float)
+        mul = np.array([pair[1] for pair in pairs], dtype=float)
+        return values / div[index] * mul[index], np.isnan(div)[index]
+
+    codes = [from_currencies] * len(amounts) if single else from_currencies
+    pairs = {}
+    converted = array("d")
+    missing = []
+    for amount, code in zip(amounts, codes):
+        pair = pairs.get(code)
+        if pair is None:
+            pair = pairs[code] = _rate_pair(code, to_currency, rates)
+        converted.append(amount / pair[0] * pair[1])
+        missing.append(pair[0] != pair[0])
+    return converted, missing
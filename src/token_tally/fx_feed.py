@@ -0,0 +1,127 @@
+"""Poll the FX rate feeds with conditional requests.
+
+:class:`FxFeedPoller` fetches every configured feed concurrently over
+keep-alive connections with a timeout. It sends the ``ETag`` and
+``Last-Modified`` validators from the previous fetch, which are kept in the
+``fx_feeds`` table so one-shot cron runs benefit too. A ``304`` response, or
+a body identical to the last one, is skipped without parsing. Changed feeds
+are stored as snapshots: daily rates under their reference date, intraday
+rates under the feed's ``Last-Modified`` time (or the fetch time).
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from hashlib import blake2b
+from typing import Dict, List, Optional, Sequence
+
+from .fx import ECB_URL, INTRADAY_URL, parse_ecb_snapshot
+from .fx_rates import (
+    DB_PATH,
+    ensure_schema,
+    get_feed_state,
+    set_feed_state,
+    store_snapshots,
+    to_instant,
+)
+from .http_pool import HTTPConnectionPool, request_target
+
+
+@dataclass(frozen=True)
+class Feed:
+    name: str
+    url: str
+    intraday: bool = False
+
+
+DEFAULT_FEEDS = (Feed("daily", ECB_URL), Feed("intraday", INTRADAY_URL, intraday=True))
+
+
+@dataclass
+class PollResult:
+    """Outcome of polling one feed.
+
+    ``status`` is ``"stored"`` (with the snapshot ``instant`` and number of
+    ``rates``), ``"unchanged"`` or ``"error"`` (with ``error`` set).
+    """
+
+    feed: str
+    status: str
+    instant: Optional[str] = None
+    rates: int = 0
+    error: Optional[Exception] = None
+
+
+class FxFeedPoller:
+    """Fetch FX feeds concurrently and store only the ones that changed."""
+
+    def __init__(
+        self,
+        db_path: str = DB_PATH,
+        feeds: Sequence[Feed] = DEFAULT_FEEDS,
+        *,
+        timeout: float = 10.0,
+    ) -> None:
+        self.db_path = db_path
+        self.feeds = list(feeds)
+        self._pools = {
+            feed.name: HTTPConnectionPool(feed.url, max_connections=1, timeout=timeout)
+            for feed in self.feeds
+        }
+        # Migrate before any polling thread touches the database.
+        ensure_schema(db_path)
+
+    def poll_feed(self, feed: Feed) -> PollResult:
+        """Fetch one feed and store its rates if they changed."""
+        etag, last_modified, digest = get_feed_state(feed.name, self.db_path)
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        resp = self._pools[feed.name].request(
+            "GET", request_target(feed.url), headers=headers
+        )
+        if resp.status == 304:
+            return PollResult(feed.name, "unchanged")
+        resp.raise_for_status()
+        new_digest = blake2b(resp.body, digest_size=16).hexdigest()
+        etag = resp.header("ETag")
+        last_modified = resp.header("Last-Modified")
+        if new_digest == digest:
+            set_feed_state(feed.name, etag, last_modified, digest, self.db_path)
+            return PollResult(feed.name, "unchanged")
+
+        day, rates = parse_ecb_snapshot(resp.body)
+        if feed.intraday:
+            when = parsedate_to_datetime(last_modified) if last_modified else None
+            instant = to_instant(when or datetime.now(UTC))
+        else:
+            instant = to_instant(day or datetime.now(UTC).date())
+        store_snapshots(
+            [(instant, cur, rate) for cur, rate in rates.items()], self.db_path
+        )
+        set_feed_state(feed.name, etag, last_modified, new_digest, self.db_path)
+        return PollResult(feed.name, "stored", instant, len(rates))
+
+    def _poll_safely(self, feed: Feed) -> PollResult:
+        try:
+            return self.poll_feed(feed)
+        except Exception as exc:
+            return PollResult(feed.name, "error", error=exc)
+
+    def poll(self) -> Dict[str, PollResult]:
+        """Poll every feed concurrently; one failing feed does not stop the rest."""
+        with ThreadPoolExecutor(max_workers=max(len(self.feeds), 1)) as pool:
+            results: List[PollResult] = list(pool.map(self._poll_safely, self.feeds))
+        return {result.feed: result for result in results}
+
+    def close(self) -> None:
+        for pool in self._pools.values():
+            pool.close()
+
+
+__all__ = ["DEFAULT_FEEDS", "Feed", "FxFeedPoller", "PollResult"]
@@ -1,13 +1,112 @@
+"""Stored FX rate snapshots and a cached, time-aware view of them.
+
+Each fetch is stored as a snapshot: one row per currency under the instant
+the rates apply from, so intraday updates are kept as history instead of
+overwriting the day. Daily ECB rates are keyed at midnight UTC of their
+reference date. Instants are stored as ISO 8601 UTC strings with second
+precision, which sort chronologically.
+"""
+
+import argparse
 import sqlite3
-from datetime import date
-from typing import Dict, Optional
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from datetime import UTC, date, datetime, timedelta
+from itertools import islice
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple, Union
 
-from .fx import get_ecb_rates, get_intraday_rates
+from . import migrations
+from . import sqlite_pool
+from .fx import (
+    ECB_HISTORY_URL,
+    FxRates,
+    convert,
+    get_ecb_rates,
+    get_intraday_rates,
+    iter_ecb_rates,
+)
 
 DB_PATH = "fx_rates.db"
 
+_MIGRATIONS: list[migrations.Migration] = [
+    # Latest-date and per-currency history lookups.
+    (1, ["CREATE INDEX IF NOT EXISTS idx_fx_rates_currency ON fx_rates(currency, date)"]),
+    # Key snapshots by instant so intraday history is kept.
+    (
+        2,
+        [
+            """
+            CREATE TABLE fx_rates_by_ts (
+                ts TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (ts, currency)
+            )
+            """,
+            """
+            INSERT INTO fx_rates_by_ts (ts, currency, rate)
+            SELECT date || 'T00:00:00+00:00', currency, rate FROM fx_rates
+            """,
+            "DROP TABLE fx_rates",
+            "ALTER TABLE fx_rates_by_ts RENAME TO fx_rates",
+            "CREATE INDEX idx_fx_rates_currency_ts ON fx_rates(currency, ts)",
+        ],
+    ),
+    # Validators and body digests of the last fetch of each feed.
+    (
+        3,
+        [
+            """
+            CREATE TABLE IF NOT EXISTS fx_feeds (
+                feed TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                digest TEXT
+            )
+            """
+        ],
+    ),
+]
+
+_INSERT_RATE_SQL = "INSERT OR REPLACE INTO fx_rates (ts, currency, rate) VALUES (?, ?, ?)"
+
+# Latest snapshot at or before an instant; a backwards seek on the primary key.
+_SNAPSHOT_AT_SQL = "SELECT ts FROM fx_rates WHERE ts <= ? ORDER BY ts DESC LIMIT 1"
+
+# Daily snapshots are stored at midnight UTC of their reference date; any
+# other instant is an intraday snapshot, which may cover fewer currencies.
+_DAILY_SUFFIX = "T00:00:00+00:00"
+
+# The currencies of daily snapshot ?1, each at its latest rate up to ?2: a
+# primary-key seek for the snapshot plus one index seek per currency.
+_RATES_AT_SQL = """
+    SELECT d.currency, COALESCE(
+        (
+            SELECT r.rate FROM fx_rates AS r
+            WHERE r.currency = d.currency AND r.ts > d.ts AND r.ts <= ?2
+            ORDER BY r.ts DESC LIMIT 1
+        ),
+        d.rate
+    )
+    FROM fx_rates AS d WHERE d.ts = ?1
+"""
+
+# Database paths whose schema has been brought up to date in this process.
+_READY: set[str] = set()
 
-def _ensure_table(conn: sqlite3.Connection) -> None:
+# Bumped per database path whenever this process stores rates, so caches
+# pick up new rates without waiting for their TTL.
+_GENERATIONS: Dict[str, int] = {}
+
+DateLike = Union[str, date, datetime]
+
+
+def _ensure_table(conn: sqlite3.Connection, db_path: str) -> None:
+    key = str(db_path)
+    if key in _READY:
+        return
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS fx_rates (
@@ -18,62 +117,359 @@ def _ensure_table(conn: sqlite3.Connection) -> None:
         )
         """
     )
+    conn.commit()
+    migrations.apply_migrations(conn, "fx_rates", _MIGRATIONS)
+    _READY.add(key)
+
+
+def ensure_schema(db_path: str = DB_PATH) -> None:
+    """Create and migrate the FX tables in ``db_path`` if needed."""
+    _ensure_table(sqlite_pool.connect(db_path), db_path)
+
+
+def to_instant(value: DateLike) -> str:
+    """Normalise a date, datetime or ISO string to the stored UTC instant.
+
+    Dates map to midnight UTC and naive datetimes are taken as UTC.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.astimezone(UTC).isoformat(timespec="seconds")
+
+
+def _day_end(value: DateLike) -> str:
+    # Last stored instant that still belongs to ``value``'s day.
+    if isinstance(value, str):
+        if len(value) > 10:
+            return to_instant(value)
+        value = date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return to_instant(value)
+    start = datetime(value.year, value.month, value.day, tzinfo=UTC)
+    return to_instant(start + timedelta(days=1, seconds=-1))
+
+
+def _bump(db_path: str) -> None:
+    key = str(db_path)
+    _GENERATIONS[key] = _GENERATIONS.get(key, 0) + 1
+
+
+def store_snapshots(
+    rows: Iterable[Tuple[str, str, float]], db_path: str = DB_PATH
+) -> int:
+    """Insert ``(instant, currency, rate)`` rows with one ``executemany``.
+
+    Instants must already be normalised with :func:`to_instant`. Returns the
+    number of rows written.
+    """
+    rows = rows if isinstance(rows, list) else list(rows)
+    with sqlite_pool.connect(db_path) as conn:
+        _ensure_table(conn, db_path)
+        with conn:
+            conn.executemany(_INSERT_RATE_SQL, rows)
+    _bump(db_path)
+    return len(rows)
 
 
 def store_rates(
-    rates: Dict[str, float], fetch_date: Optional[str] = None, db_path: str = DB_PATH
+    rates: Dict[str, float],
+    fetch_date: Optional[str] = None,
+    db_path: str = DB_PATH,
+    *,
+    ts: Optional[DateLike] = None,
 ) -> str:
-    """Persist a mapping of currency rates for a given date."""
-    fetch_date = fetch_date or date.today().isoformat()
-    with sqlite3.connect(db_path) as conn:
-        _ensure_table(conn)
-        for cur, rate in rates.items():
+    """Persist a snapshot of currency rates and return its instant.
+
+    The snapshot is keyed by ``ts`` if given, otherwise by midnight UTC of
+    ``fetch_date`` (default: today). Storing the same instant again
+    replaces it.
+    """
+    instant = to_instant(ts if ts is not None else fetch_date or date.today())
+    store_snapshots([(instant, cur, rate) for cur, rate in rates.items()], db_path)
+    return instant
+
+
+def backfill(
+    source: Union[str, BinaryIO], db_path: str = DB_PATH, *, chunk_size: int = 5000
+) -> int:
+    """Load ECB history from ``source`` into ``db_path``; return rows written.
+
+    ``source`` is a path or binary file of ECB XML, such as
+    ``eurofxref-hist.xml``. Rates are streamed from :func:`fx.iter_ecb_rates`
+    and written with one ``executemany`` per ``chunk_size`` rows, each in
+    its own transaction, so memory use does not grow with the file. Days
+    already stored are overwritten.
+    """
+    instants: Dict[Optional[str], str] = {}
+
+    def rows():
+        for day, cur, rate in iter_ecb_rates(source):
+            instant = instants.get(day)
+            if instant is None:
+                if day is None:
+                    raise ValueError("ECB rates without a date cannot be backfilled")
+                instants.clear()
+                instant = instants[day] = to_instant(day)
+            yield instant, cur, rate
+
+    conn = sqlite_pool.connect(db_path)
+    _ensure_table(conn, db_path)
+    total = 0
+    stream = rows()
+    try:
+        while chunk := list(islice(stream, chunk_size)):
+            with conn:
+                conn.executemany(_INSERT_RATE_SQL, chunk)
+            total += len(chunk)
+    finally:
+        if total:
+            _bump(db_path)
+    return total
+
+
+def get_feed_state(
+    feed: str, db_path: str = DB_PATH
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Return ``(etag, last_modified, digest)`` from the last fetch of ``feed``."""
+    with sqlite_pool.connect(db_path) as conn:
+        _ensure_table(conn, db_path)
+        row = conn.execute(
+            "SELECT etag, last_modified, digest FROM fx_feeds WHERE feed = ?", (feed,)
+        ).fetchone()
+    return row or (None, None, None)
+
+
+def set_feed_state(
+    feed: str,
+    etag: Optional[str],
+    last_modified: Optional[str],
+    digest: Optional[str],
+    db_path: str = DB_PATH,
+) -> None:
+    with sqlite_pool.connect(db_path) as conn:
+        _ensure_table(conn, db_path)
+        with conn:
             conn.execute(
-                "INSERT OR REPLACE INTO fx_rates (date, currency, rate) VALUES (?, ?, ?)",
-                (fetch_date, cur, rate),
+                "INSERT OR REPLACE INTO fx_feeds (feed, etag, last_modified, digest) "
+                "VALUES (?, ?, ?, ?)",
+                (feed, etag, last_modified, digest),
             )
-        conn.commit()
-    return fetch_date
 
 
 def fetch_and_store(db_path: str = DB_PATH, *, intraday: bool = False) -> str:
     """Fetch latest FX rates and store them.
 
-    If ``intraday`` is True, use the intraday feed instead of the daily ECB feed.
+    If ``intraday`` is True, use the intraday feed instead of the daily ECB
+    feed, and key the snapshot by the current time rather than the day.
+    """
+    if intraday:
+        return store_rates(get_intraday_rates(), db_path=db_path, ts=datetime.now(UTC))
+    return store_rates(get_ecb_rates(), db_path=db_path)
+
+
+def _daily_at(conn: sqlite3.Connection, instant: str) -> Optional[str]:
+    """Return the latest daily snapshot at or before ``instant``.
+
+    Each step is a seek, and it steps back at most one day per iteration.
+    """
+    bound = instant
+    while True:
+        row = conn.execute(_SNAPSHOT_AT_SQL, (bound,)).fetchone()
+        if row is None:
+            return None
+        if row[0].endswith(_DAILY_SUFFIX):
+            return row[0]
+        bound = row[0][:10] + _DAILY_SUFFIX
+
+
+class FxRateCache:
+    """In-memory view of one ``fx_rates`` database.
+
+    The latest snapshot is looked up again every ``ttl`` seconds, or right
+    away after this process stores rates in the same path. Historical
+    lookups use an indexed seek per distinct ``as_of`` and are remembered
+    until the next reload. Snapshots are kept as :class:`FxRates`, so their
+    cross-rate matrix is built once; the ``max_snapshots`` most recently
+    used stay in memory. Returned mappings are shared between callers and
+    must not be modified.
     """
-    rates = get_intraday_rates() if intraday else get_ecb_rates()
-    return store_rates(rates, db_path=db_path)
+
+    def __init__(
+        self, db_path: str = DB_PATH, *, ttl: float = 300.0, max_snapshots: int = 64
+    ) -> None:
+        self.db_path = str(db_path)
+        self.ttl = ttl
+        self.max_snapshots = max_snapshots
+        self._lock = threading.Lock()
+        self._resolved: OrderedDict[Optional[str], Optional[str]] = OrderedDict()
+        self._rates: OrderedDict[str, FxRates] = OrderedDict()
+        self._loaded_at = float("-inf")
+        self._generation = -1
+
+    def invalidate(self) -> None:
+        """Force a reload on the next lookup."""
+        self._loaded_at = float("-inf")
+
+    def _check(self) -> None:
+        generation = _GENERATIONS.get(self.db_path, 0)
+        now = time.monotonic()
+        if generation == self._generation and now - self._loaded_at < self.ttl:
+            return
+        with self._lock:
+            if generation != self._generation or now - self._loaded_at >= self.ttl:
+                self._resolved = OrderedDict()
+                self._rates = OrderedDict()
+                self._loaded_at = now
+                self._generation = generation
+
+    @staticmethod
+    def _remember(cache: OrderedDict, key: object, value: object, limit: int) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    def snapshot_at(self, as_of: Optional[DateLike] = None) -> Optional[str]:
+        """Return the instant of the snapshot in effect at ``as_of``.
+
+        A bare date means the end of that day; ``None`` means the latest.
+        """
+        self._check()
+        bound = None if as_of is None else _day_end(as_of)
+        with self._lock:
+            if bound in self._resolved:
+                self._resolved.move_to_end(bound)
+                return self._resolved[bound]
+        with sqlite_pool.connect(self.db_path) as conn:
+            _ensure_table(conn, self.db_path)
+            if bound is None:
+                row = conn.execute("SELECT MAX(ts) FROM fx_rates").fetchone()
+            else:
+                row = conn.execute(_SNAPSHOT_AT_SQL, (bound,)).fetchone()
+        instant = row[0] if row else None
+        with self._lock:
+            self._remember(self._resolved, bound, instant, self.max_snapshots * 4)
+        return instant
+
+    def _load(self, instant: str) -> FxRates:
+        with self._lock:
+            rates = self._rates.get(instant)
+            if rates is not None:
+                self._rates.move_to_end(instant)
+                return rates
+        with sqlite_pool.connect(self.db_path) as conn:
+            daily = _daily_at(conn, instant) or instant
+            rates = FxRates(conn.execute(_RATES_AT_SQL, (daily, instant)).fetchall())
+        with self._lock:
+            self._remember(self._rates, instant, rates, self.max_snapshots)
+        return rates
+
+    def rates(self, as_of: Optional[DateLike] = None) -> FxRates:
+        """Return the latest rates at or before ``as_of`` (default: latest).
+
+        ``as_of`` may be an instant or a date, which includes the whole day.
+        The currencies are those of the latest daily snapshot, each at its
+        latest rate, so an intraday snapshot covering only some currencies
+        does not hide the others, and currencies the daily feed dropped are
+        not kept alive at a stale rate.
+        """
+        instant = self.snapshot_at(as_of)
+        return FxRates() if instant is None else self._load(instant)
+
+    def rates_on(self, day: DateLike) -> FxRates:
+        """Return the last rates stored during ``day`` (empty if none)."""
+        if isinstance(day, datetime):
+            day = day.date()
+        day = str(day)[:10]
+        instant = self.snapshot_at(day)
+        if instant is None or instant[:10] != day:
+            return FxRates()
+        return self._load(instant)
+
+    def convert(
+        self,
+        amount: float,
+        from_cur: str,
+        to_cur: str,
+        as_of: Optional[DateLike] = None,
+    ) -> float:
+        """Convert ``amount`` with the rates in effect at ``as_of``."""
+        return convert(amount, from_cur, to_cur, self.rates(as_of))
+
+
+_CACHES: Dict[str, FxRateCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_rate_cache(db_path: str = DB_PATH) -> FxRateCache:
+    """Return the process-wide :class:`FxRateCache` for ``db_path``."""
+    key = str(db_path)
+    cache = _CACHES.get(key)
+    if cache is None:
+        with _CACHES_LOCK:
+            cache = _CACHES.setdefault(key, FxRateCache(key))
+    return cache
 
 
 def get_rates(
     fetch_date: Optional[str] = None, db_path: str = DB_PATH
 ) -> Dict[str, float]:
-    """Load rates for the specified date or the most recent available."""
-    with sqlite3.connect(db_path) as conn:
-        _ensure_table(conn)
-        if fetch_date is None:
-            cur = conn.execute("SELECT MAX(date) FROM fx_rates")
-            row = cur.fetchone()
-            fetch_date = row[0] if row and row[0] else None
-            if fetch_date is None:
-                return {}
-        cur = conn.execute(
-            "SELECT currency, rate FROM fx_rates WHERE date = ?", (fetch_date,)
-        )
-        return {cur: rate for cur, rate in cur.fetchall()}
+    """Load rates for the specified date or the most recent available.
+
+    Served from :func:`get_rate_cache`; the result must not be modified.
+    """
+    cache = get_rate_cache(db_path)
+    if fetch_date is None:
+        return cache.rates()
+    return cache.rates_on(fetch_date)
 
 
 def main(argv: Optional[list[str]] = None) -> None:
-    argv = argv or []
-    if argv and argv[0] == "fetch":
-        intraday = "--intraday" in argv[1:]
-        fetch_date = fetch_and_store(intraday=intraday)
+    parser = argparse.ArgumentParser(description="Fetch and store FX rates")
+    parser.add_argument("--db", default=DB_PATH, help="FX rates database")
+    sub = parser.add_subparsers(dest="cmd")
+
+    fetch = sub.add_parser("fetch", help="Fetch and store the latest rates")
+    fetch.add_argument("--intraday", action="store_true", help="Use the intraday feed")
+
+    sub.add_parser("poll", help="Poll the daily and intraday feeds for changes")
+
+    hist = sub.add_parser("backfill", help="Load ECB's historical rates")
+    hist.add_argument(
+        "source", nargs="?", default=ECB_HISTORY_URL, help="XML file or URL"
+    )
+    hist.add_argument("--chunk-size", type=int, default=5000)
+    hist.add_argument("--timeout", type=float, default=60.0, help="HTTP timeout")
+
+    args = parser.parse_args(list(argv) if argv is not None else None)
+    if args.cmd == "fetch":
+        fetch_date = fetch_and_store(args.db, intraday=args.intraday)
         print(f"Stored FX rates for {fetch_date}")
+    elif args.cmd == "poll":
+        from .fx_feed import FxFeedPoller
+
+        poller = FxFeedPoller(args.db)
+        try:
+            results = poller.poll()
+        finally:
+            poller.close()
+        for name, result in results.items():
+            detail = result.instant or result.error or ""
+            print(f"{name}: {result.status} {detail}".rstrip())
+    elif args.cmd == "backfill":
+        if args.source.startswith(("http://", "https://")):
+            with urllib.request.urlopen(args.source, timeout=args.timeout) as resp:
+                count = backfill(resp, args.db, chunk_size=args.chunk_size)
+        else:
+            count = backfill(args.source, args.db, chunk_size=args.chunk_size)
+        print(f"Stored {count} FX rates")
     else:
-        print("Usage: python -m token_tally.fx_rates fetch [--intraday]")
+        parser.print_help()
 
 
 if __name__ == "__main__":
-    import sys
-
-    main(sys.argv[1:])
+    main()
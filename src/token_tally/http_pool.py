@@ -0,0 +1,197 @@
+"""Keep-alive HTTP connection pool for outbound API clients.
+
+``urllib.request.urlopen`` opens a new TCP (and TLS) connection for every
+request. ``HTTPConnectionPool`` keeps up to ``max_connections`` persistent
+``http.client`` connections to a single origin and hands them out to threads
+one at a time. :func:`shared_pool` keeps one pool per origin for module-level
+helpers such as the accounting integrations.
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+# Methods that are safe to send twice (RFC 9110, section 9.2.2).
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"})
+
+# Errors raised when a server has closed an idle keep-alive connection.
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class HTTPStatusError(RuntimeError):
+    """Raised by :meth:`Response.raise_for_status` for 4xx/5xx responses."""
+
+    def __init__(self, status: int, body: bytes):
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+        self.body = body
+
+
+@dataclass
+class Response:
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+
+    def header(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.headers.get(name, default)
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise HTTPStatusError(self.status, self.body)
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class HTTPConnectionPool:
+    """Bounded pool of persistent connections to ``base_url``'s origin.
+
+    ``request`` blocks while all ``max_connections`` connections are busy.
+    An idempotent request that fails on a reused connection because the
+    server dropped it is retried once on a fresh connection. Other methods
+    are only retried with ``retry_stale=True``, e.g. a POST carrying an
+    idempotency key, since the server may have processed the first attempt.
+    """
+
+    def __init__(
+        self, base_url: str, *, max_connections: int = 8, timeout: float = 30.0
+    ) -> None:
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {parts.scheme!r}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname or ""
+        self.port = parts.port
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        cls = (
+            http.client.HTTPSConnection
+            if self.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _checkout(self) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("connection pool is closed")
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def _checkin(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if not self._closed:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        *,
+        retry_stale: Optional[bool] = None,
+    ) -> Response:
+        """Send a request and return the fully read response.
+
+        ``retry_stale`` defaults to whether ``method`` is idempotent.
+        """
+        if retry_stale is None:
+            retry_stale = method.upper() in _IDEMPOTENT_METHODS
+        with self._slots:
+            conn, reused = self._checkout()
+            try:
+                try:
+                    response = self._send(conn, method, path, body, headers)
+                except _STALE_ERRORS:
+                    conn.close()
+                    if not (reused and retry_stale):
+                        raise
+                    conn = self._new_connection()
+                    response = self._send(conn, method, path, body, headers)
+            except BaseException:
+                conn.close()
+                raise
+            if response.header("Connection", "").lower() == "close":
+                conn.close()
+            else:
+                self._checkin(conn)
+            return response
+
+    @staticmethod
+    def _send(
+        conn: http.client.HTTPConnection,
+        method: str,
+        path: str,
+        body: Optional[bytes],
+        headers: Optional[Dict[str, str]],
+    ) -> Response:
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        return Response(resp.status, resp.headers, resp.read())
+
+    def close(self) -> None:
+        """Close idle connections; connections in use close on return."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def __enter__(self) -> "HTTPConnectionPool":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+_SHARED: Dict[str, HTTPConnectionPool] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def request_target(url: str) -> str:
+    """Return the path and query of ``url`` for use in a request line."""
+    parts = urlsplit(url)
+    return (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+
+def shared_pool(url: str, *, max_connections: int = 8) -> HTTPConnectionPool:
+    """Return the process-wide pool for ``url``'s origin, creating it once."""
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    with _SHARED_LOCK:
+        pool = _SHARED.get(origin)
+        if pool is None:
+            pool = _SHARED[origin] = HTTPConnectionPool(
+                origin, max_connections=max_connections
+            )
+        return pool
+
+
+__all__ = [
+    "HTTPConnectionPool",
+    "HTTPStatusError",
+    "Response",
+    "request_target",
+    "shared_pool",
+]
@@ -0,0 +1,116 @@
+"""Kafka publishing shared by the usage ledgers."""
+
+from __future__ import annotations
+
+import json
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+try:
+    from kafka import KafkaProducer
+except ImportError:  # pragma: no cover - kafka-python not installed
+    KafkaProducer = None  # type: ignore
+
+DeliveryErrorHandler = Callable[[str, Any, Exception], None]
+
+
+def build_producer(
+    servers: Iterable[str],
+    *,
+    asynchronous: bool = False,
+    linger_ms: int = 20,
+    batch_size: int = 64 * 1024,
+    compression_type: Optional[str] = "gzip",
+) -> Any:
+    """Return a ``KafkaProducer`` for ``servers`` or ``None`` if unavailable.
+
+    Batching and compression settings only apply to asynchronous producers;
+    synchronous ones flush after every send, so lingering would add latency.
+    """
+    if KafkaProducer is None:
+        return None
+    kwargs: dict[str, Any] = {}
+    if asynchronous:
+        kwargs = {
+            "linger_ms": linger_ms,
+            "batch_size": batch_size,
+            "compression_type": compression_type,
+        }
+    return KafkaProducer(
+        bootstrap_servers=list(servers),
+        value_serializer=lambda v: json.dumps(v, default=str).encode("utf-8"),
+        **kwargs,
+    )
+
+
+class EventPublisher:
+    """Send JSON events to Kafka, synchronously or with delivery callbacks.
+
+    Synchronous publishers flush after each call, as the ledgers always did.
+    Asynchronous publishers return as soon as the producer has buffered the
+    message. A delivery callback frees an in-flight slot, and failed
+    deliveries are passed to ``on_error``. At most ``max_in_flight`` messages
+    may be outstanding; further calls block until deliveries complete.
+    """
+
+    def __init__(
+        self,
+        producer: Any,
+        *,
+        asynchronous: bool = False,
+        max_in_flight: int = 10_000,
+        on_error: Optional[DeliveryErrorHandler] = None,
+    ) -> None:
+        self.producer = producer
+        self.asynchronous = asynchronous
+        self.on_error = on_error
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._closed = False
+
+    def publish(self, topic: str, value: Any) -> None:
+        """Send one message to ``topic``."""
+        self.publish_many(topic, [value])
+
+    def publish_many(self, topic: str, values: Iterable[Any]) -> None:
+        """Send ``values`` to ``topic``; synchronous mode flushes once."""
+        if self._closed:
+            raise RuntimeError("publisher is closed")
+        if not self.asynchronous:
+            for value in values:
+                self.producer.send(topic, value)
+            self.producer.flush()
+            return
+        for value in values:
+            self._slots.acquire()
+            try:
+                future = self.producer.send(topic, value)
+            except Exception as exc:
+                self._failed(topic, value, exc)
+                continue
+            future.add_callback(self._delivered)
+            future.add_errback(self._failed, topic, value)
+
+    def _delivered(self, metadata: Any) -> None:
+        self._slots.release()
+
+    def _failed(self, topic: str, value: Any, exc: Exception) -> None:
+        self._slots.release()
+        if self.on_error is not None:
+            self.on_error(topic, value, exc)
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Block until every buffered message has been delivered or failed."""
+        self.producer.flush(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Drain outstanding messages and close the producer."""
+        if self._closed:
+            return
+        self._closed = True
+        self.producer.flush(timeout)
+        close = getattr(self.producer, "close", None)
+        if callable(close):
+            close(timeout)
+
+
+__all__ = ["EventPublisher", "build_producer"]
@@ -1,35 +1,188 @@
+import json
 import sqlite3
+import time
 from datetime import datetime, UTC
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Tuple
 
 from . import fx
 from . import markup
-
-try:
-    from opentelemetry import trace
-except Exception:  # pragma: no cover - optional
-
-    class _DummySpan:
-        def __enter__(self):
-            return self
-
-        def __exit__(self, *exc: object) -> None:
-            pass
-
-        def set_attribute(self, *args: object, **kwargs: object) -> None:
-            pass
-
-    class _DummyTracer:
-        def start_as_current_span(self, name: str) -> _DummySpan:
-            return _DummySpan()
-
-    class _TraceModule:
-        def get_tracer(self, name: str | None = None) -> _DummyTracer:
-            return _DummyTracer()
-
-    trace = _TraceModule()  # type: ignore
-
-tracer = trace.get_tracer(__name__)
+from . import migrations
+from . import sqlite_pool
+from .metrics import OPERATION_SECONDS, timed
+from .tracing import get_tracer
+
+tracer = get_tracer(__name__)
+
+_INSERT_USAGE_SQL = """
+    INSERT OR REPLACE INTO usage_events (
+        id, customer_id, feature, units, unit_cost, invoice_cycle,
+        business_unit
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_PENDING_COLUMNS = (
+    "id, customer_id, feature, units, unit_cost, ts, invoice_cycle, business_unit, "
+    "stripe_idempotency_key"
+)
+_PENDING_USAGE_SQL = (
+    f"SELECT {_PENDING_COLUMNS} FROM usage_events WHERE stripe_status = 'pending'"
+)
+# Keyset pagination over the partial pending index.
+_PENDING_PAGE_SQL = (
+    f"SELECT {_PENDING_COLUMNS} FROM usage_events "
+    "WHERE stripe_status = 'pending' AND id > ? ORDER BY id LIMIT ?"
+)
+# Events already planned into a usage record by an earlier sync run, paged
+# by (key, id) so each record's events come out together.
+_KEYED_PENDING_PAGE_SQL = (
+    f"SELECT {_PENDING_COLUMNS} FROM usage_events "
+    "WHERE stripe_status = 'pending' AND stripe_idempotency_key IS NOT NULL "
+    "AND (stripe_idempotency_key, id) > (?, ?) "
+    "ORDER BY stripe_idempotency_key, id LIMIT ?"
+)
+_MARK_SYNCED_SQL = (
+    "UPDATE usage_events SET stripe_status = 'synced', stripe_record_id = ? WHERE id = ?"
+)
+_PENDING_KEYS = [
+    "id",
+    "customer_id",
+    "feature",
+    "units",
+    "unit_cost",
+    "ts",
+    "invoice_cycle",
+    "business_unit",
+    "idempotency_key",
+]
+_USAGE_BY_CYCLE_SQL = (
+    "SELECT customer_id, units, unit_cost FROM usage_events WHERE invoice_cycle = ?"
+)
+_SPEND_BY_CUSTOMER_SQL = (
+    "SELECT customer_id, SUM(units * unit_cost) FROM usage_events "
+    "WHERE invoice_cycle = ? GROUP BY customer_id"
+)
+# ``ts`` is stored as ISO text, so comparing it directly against day bounds
+# matches ``date(ts)`` while still letting SQLite search the ts index.
+_USAGE_BY_RANGE_SQL = """
+    SELECT customer_id, feature, units, unit_cost, ts
+    FROM usage_events
+    WHERE ts >= date(?) AND ts < date(?, '+1 day')
+"""
+
+# Per-customer invoice and credit totals, in order of first appearance.
+_INVOICE_TOTALS_SQL = """
+    SELECT customer_id,
+           SUM(CASE WHEN units >= 0 THEN units * unit_cost ELSE 0 END),
+           SUM(CASE WHEN units < 0 THEN -units * unit_cost ELSE 0 END)
+    FROM usage_events
+    WHERE invoice_cycle = ?
+    GROUP BY customer_id
+    HAVING SUM(units >= 0) > 0
+    ORDER BY MIN(rowid)
+"""
+_INSERT_INVOICE_SQL = (
+    "INSERT OR REPLACE INTO invoices (id, customer_id, cycle, amount, business_unit) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+_INSERT_CREDIT_NOTE_SQL = (
+    "INSERT OR REPLACE INTO credit_notes (id, invoice_id, amount, description) "
+    "VALUES (?, ?, ?, ?)"
+)
+_ENQUEUE_OUTBOX_SQL = """
+    INSERT INTO accounting_outbox (invoice_id, destination, payload)
+    VALUES (?, ?, ?)
+    ON CONFLICT (invoice_id, destination) DO UPDATE SET
+        payload = excluded.payload,
+        status = 'pending',
+        attempts = 0,
+        last_error = NULL,
+        next_attempt_at = 0,
+        lease_until = 0,
+        updated_at = CURRENT_TIMESTAMP
+    -- Never hand a job another worker is delivering back to the queue.
+    WHERE accounting_outbox.status != 'in_progress'
+        OR accounting_outbox.lease_until < ?
+"""
+_OUTBOX_KEYS = ["id", "invoice_id", "destination", "payload", "status", "attempts", "last_error"]
+
+# Schema changes applied on top of the base tables, in version order.
+_MIGRATIONS: list[migrations.Migration] = [
+    (
+        1,
+        [
+            # Partial index: only the small pending backlog is indexed.
+            "CREATE INDEX IF NOT EXISTS idx_usage_events_pending "
+            "ON usage_events(id) WHERE stripe_status = 'pending'",
+            # Covers per-cycle listings and spend aggregation.
+            "CREATE INDEX IF NOT EXISTS idx_usage_events_cycle "
+            "ON usage_events(invoice_cycle, customer_id, units, unit_cost)",
+            # Covers date-range exports.
+            "CREATE INDEX IF NOT EXISTS idx_usage_events_ts "
+            "ON usage_events(ts, customer_id, feature, units, unit_cost)",
+        ],
+    ),
+    (
+        2,
+        [
+            # Accounting pushes queued with their invoice, delivered later.
+            """
+            CREATE TABLE IF NOT EXISTS accounting_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                invoice_id TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (invoice_id, destination)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_accounting_outbox_status "
+            "ON accounting_outbox(status, id)",
+        ],
+    ),
+    (
+        3,
+        [
+            # Epoch seconds before which a failed push is not retried.
+            "ALTER TABLE accounting_outbox "
+            "ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0",
+        ],
+    ),
+    (
+        4,
+        [
+            # Epoch seconds until which an 'in_progress' claim is held.
+            "ALTER TABLE accounting_outbox "
+            "ADD COLUMN lease_until REAL NOT NULL DEFAULT 0",
+        ],
+    ),
+    (
+        5,
+        [
+            # Key of the Stripe usage record a pending event was planned into.
+            "ALTER TABLE usage_events ADD COLUMN stripe_idempotency_key TEXT",
+            # One row per usage sync run; its id makes record keys unique.
+            """
+            CREATE TABLE IF NOT EXISTS usage_sync_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+        ],
+    ),
+    (
+        6,
+        [
+            # Pages the keyed leftovers of earlier sync runs.
+            "CREATE INDEX IF NOT EXISTS idx_usage_events_keyed_pending "
+            "ON usage_events(stripe_idempotency_key, id) "
+            "WHERE stripe_status = 'pending' AND stripe_idempotency_key IS NOT NULL",
+        ],
+    ),
+]
 
 
 class Ledger:
@@ -40,7 +193,7 @@ class Ledger:
         self._ensure_tables()
 
     def _ensure_tables(self) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS payouts (
@@ -105,6 +258,7 @@ class Ledger:
             )
 
             conn.commit()
+            migrations.apply_migrations(conn, "ledger", _MIGRATIONS)
 
     def add_payout(
         self,
@@ -115,13 +269,8 @@ class Ledger:
         status: str,
         processor: str,
     ) -> None:
-        with tracer.start_as_current_span("Ledger.add_payout") as span:
-            if span:
-                try:
-                    span.set_attribute("payout_id", payout_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
-            with sqlite3.connect(self.db_path) as conn:
+        with tracer.span("Ledger.add_payout", payout_id=payout_id):
+            with sqlite_pool.connect(self.db_path) as conn:
                 conn.execute(
                     """
                     INSERT OR REPLACE INTO payouts (id, user_id, amount, currency, status, processor)
@@ -132,13 +281,8 @@ class Ledger:
                 conn.commit()
 
     def update_status(self, payout_id: str, status: str) -> None:
-        with tracer.start_as_current_span("Ledger.update_status") as span:
-            if span:
-                try:
-                    span.set_attribute("payout_id", payout_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
-            with sqlite3.connect(self.db_path) as conn:
+        with tracer.span("Ledger.update_status", payout_id=payout_id):
+            with sqlite_pool.connect(self.db_path) as conn:
                 conn.execute(
                     "UPDATE payouts SET status = ? WHERE id = ?",
                     (status, payout_id),
@@ -146,7 +290,7 @@ class Ledger:
                 conn.commit()
 
     def get_payout(self, payout_id: str) -> Optional[Dict[str, Any]]:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             cur = conn.execute(
                 "SELECT id, user_id, amount, currency, status, processor, created_at "
                 "FROM payouts WHERE id = ?",
@@ -168,6 +312,7 @@ class Ledger:
 
     # Usage event helpers -------------------------------------------------
 
+    @timed(OPERATION_SECONDS, "ledger.add_usage_event")
     def add_usage_event(
         self,
         event_id: str,
@@ -184,12 +329,7 @@ class Ledger:
         ts: Optional[datetime] = None,
         markup_db_path: Optional[str] = None,
     ) -> None:
-        with tracer.start_as_current_span("Ledger.add_usage_event") as span:
-            if span:
-                try:
-                    span.set_attribute("event_id", event_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
+        with tracer.span("Ledger.add_usage_event", event_id=event_id):
             ts = ts or datetime.now(UTC)
             markup_rule = None
             if provider and model:
@@ -207,15 +347,9 @@ class Ledger:
             if currency != "USD" and fx_rates:
                 final_cost = fx.convert(final_cost, currency, "USD", fx_rates)
 
-            with sqlite3.connect(self.db_path) as conn:
+            with sqlite_pool.connect(self.db_path) as conn:
                 conn.execute(
-                    """
-                    INSERT OR REPLACE INTO usage_events (
-                        id, customer_id, feature, units, unit_cost, invoice_cycle,
-                        business_unit
-                    )
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """,
+                    _INSERT_USAGE_SQL,
                     (
                         event_id,
                         customer_id,
@@ -228,58 +362,202 @@ class Ledger:
                 )
                 conn.commit()
 
+    @timed(OPERATION_SECONDS, "ledger.add_usage_events")
+    def add_usage_events(
+        self,
+        events: Iterable[Dict[str, Any]],
+        *,
+        fx_rates: Optional[dict] = None,
+        markup_db_path: Optional[str] = None,
+        chunk_size: int = 1000,
+    ) -> List[Dict[str, Any]]:
+        """Bulk version of :meth:`add_usage_event`.
+
+        Each event is a dict with the keyword arguments of
+        :meth:`add_usage_event`, except ``fx_rates`` and ``markup_db_path``,
+        which apply to the whole batch. Markups are resolved once per
+        ``(provider, model)`` group from the in-memory rule index, costs are
+        converted to USD with one :func:`fx.convert_many` call, and rows are
+        written with one ``executemany`` per ``chunk_size`` transaction.
+
+        Invalid rows are skipped rather than aborting the batch; they are
+        returned as ``[{"event_id": ..., "error": ...}, ...]``.
+        """
+        batch = events if isinstance(events, (list, tuple)) else list(events)
+        failures: List[Dict[str, Any]] = []
+        pending: List[Tuple[Dict[str, Any], str]] = []
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        now = datetime.now(UTC)
+        with tracer.batch_span("Ledger.add_usage_events", len(batch)) as span:
+            for ev in batch:
+                try:
+                    for key in ("event_id", "customer_id", "feature", "units"):
+                        if key not in ev:
+                            raise KeyError(key)
+                    float(ev["unit_cost"])
+                    str(ev["invoice_cycle"])
+                    ts = (ev.get("ts") or now).isoformat()
+                except (KeyError, TypeError, ValueError, AttributeError) as exc:
+                    event_id = ev.get("event_id") if isinstance(ev, dict) else None
+                    failures.append({"event_id": event_id, "error": repr(exc)})
+                    continue
+                if ev.get("provider") and ev.get("model"):
+                    group = groups.setdefault((ev["provider"], ev["model"]), [])
+                    group.append(len(pending))
+                pending.append((ev, ts))
+
+            markups = [0.0] * len(pending)
+            if groups:
+                index = markup.get_markup_index(markup_db_path or "markup_rules.db")
+                for (provider, model), positions in groups.items():
+                    rules = index.lookup_many(
+                        provider, model, [pending[i][1] for i in positions]
+                    )
+                    for i, rule in zip(positions, rules):
+                        markups[i] = rule["markup"] if rule else 0.0
+
+            costs = [
+                float(ev["unit_cost"]) * (1 + markup_rule)
+                for (ev, _), markup_rule in zip(pending, markups)
+            ]
+            missing = [False] * len(costs)
+            if fx_rates:
+                currencies = [ev.get("currency", "USD") for ev, _ in pending]
+                costs, missing = fx.convert_many(costs, currencies, "USD", fx_rates)
+
+            rows: List[Tuple[str, tuple]] = []
+            for (ev, _), final_cost, no_rate in zip(pending, costs, missing):
+                if no_rate:
+                    error = ValueError("Missing currency rate")
+                    failures.append({"event_id": ev["event_id"], "error": repr(error)})
+                    continue
+                rows.append(
+                    (
+                        ev["event_id"],
+                        (
+                            ev["event_id"],
+                            ev["customer_id"],
+                            ev["feature"],
+                            ev["units"],
+                            float(final_cost),
+                            ev["invoice_cycle"],
+                            ev.get("business_unit", ""),
+                        ),
+                    )
+                )
+
+            conn = sqlite_pool.connect(self.db_path)
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start : start + chunk_size]
+                try:
+                    with conn:
+                        conn.executemany(_INSERT_USAGE_SQL, [row for _, row in chunk])
+                except sqlite3.Error:
+                    # Retry row by row so one bad row only fails itself.
+                    for event_id, row in chunk:
+                        try:
+                            with conn:
+                                conn.execute(_INSERT_USAGE_SQL, row)
+                        except sqlite3.Error as exc:
+                            failures.append({"event_id": event_id, "error": repr(exc)})
+            span.set_attribute("failures", len(failures))
+        return failures
+
     def get_pending_usage_events(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cur = conn.execute(
-                "SELECT id, customer_id, feature, units, unit_cost, ts, invoice_cycle, business_unit "
-                "FROM usage_events WHERE stripe_status = 'pending'"
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(_PENDING_USAGE_SQL)
+            return [dict(zip(_PENDING_KEYS, row)) for row in cur.fetchall()]
+
+    def iter_pending_usage_pages(
+        self, page_size: int = 500
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Yield pending events in id order, in lists of up to ``page_size``.
+
+        Pages are keyed on the last id seen, so rows marked synced while the
+        caller iterates do not shift later pages.
+        """
+        last_id = ""
+        while True:
+            with sqlite_pool.connect(self.db_path) as conn:
+                rows = conn.execute(_PENDING_PAGE_SQL, (last_id, page_size)).fetchall()
+            if rows:
+                yield [dict(zip(_PENDING_KEYS, row)) for row in rows]
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    def iter_pending_usage_events(self, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Yield pending events in id order, reading ``page_size`` rows at a time."""
+        for page in self.iter_pending_usage_pages(page_size):
+            yield from page
+
+    def iter_keyed_pending_usage_events(
+        self, page_size: int = 500
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield pending events that already carry a usage record key.
+
+        Events come ordered by key, ``page_size`` rows at a time, so the
+        events of one record are consecutive.
+        """
+        last = ("", "")
+        while True:
+            with sqlite_pool.connect(self.db_path) as conn:
+                rows = conn.execute(
+                    _KEYED_PENDING_PAGE_SQL, (*last, page_size)
+                ).fetchall()
+            for row in rows:
+                yield dict(zip(_PENDING_KEYS, row))
+            if len(rows) < page_size:
+                return
+            last = (rows[-1][-1], rows[-1][0])
+
+    def start_usage_sync_run(self) -> int:
+        """Record the start of a usage sync and return its run number."""
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute("INSERT INTO usage_sync_runs DEFAULT VALUES")
+            conn.commit()
+        return cur.lastrowid
+
+    def set_usage_idempotency_keys(self, keys: Iterable[Tuple[str, str]]) -> None:
+        """Store ``(event_id, idempotency_key)`` pairs in one transaction."""
+        rows = [(key, event_id) for event_id, key in keys]
+        with sqlite_pool.connect(self.db_path) as conn:
+            conn.executemany(
+                "UPDATE usage_events SET stripe_idempotency_key = ? WHERE id = ?", rows
             )
-            keys = [
-                "id",
-                "customer_id",
-                "feature",
-                "units",
-                "unit_cost",
-                "ts",
-                "invoice_cycle",
-                "business_unit",
-            ]
-            return [dict(zip(keys, row)) for row in cur.fetchall()]
+            conn.commit()
 
     def mark_usage_synced(self, event_id: str, record_id: str) -> None:
-        with tracer.start_as_current_span("Ledger.mark_usage_synced") as span:
-            if span:
-                try:
-                    span.set_attribute("event_id", event_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(
-                    "UPDATE usage_events SET stripe_status = 'synced', stripe_record_id = ? WHERE id = ?",
-                    (record_id, event_id),
-                )
+        with tracer.span("Ledger.mark_usage_synced", event_id=event_id):
+            with sqlite_pool.connect(self.db_path) as conn:
+                conn.execute(_MARK_SYNCED_SQL, (record_id, event_id))
+                conn.commit()
+
+    def mark_usage_synced_many(self, synced: Iterable[Tuple[str, str]]) -> int:
+        """Mark ``(event_id, record_id)`` pairs synced in one transaction."""
+        rows = [(record_id, event_id) for event_id, record_id in synced]
+        with tracer.batch_span("Ledger.mark_usage_synced_many", len(rows)):
+            with sqlite_pool.connect(self.db_path) as conn:
+                conn.executemany(_MARK_SYNCED_SQL, rows)
                 conn.commit()
+        return len(rows)
 
     def get_usage_events_by_cycle(self, cycle: str):
-        with sqlite3.connect(self.db_path) as conn:
-            cur = conn.execute(
-                "SELECT customer_id, units, unit_cost FROM usage_events WHERE invoice_cycle = ?",
-                (cycle,),
-            )
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(_USAGE_BY_CYCLE_SQL, (cycle,))
             keys = ["customer_id", "units", "unit_cost"]
             return [dict(zip(keys, row)) for row in cur.fetchall()]
 
+    def get_spend_by_customer(self, cycle: str) -> Dict[str, float]:
+        """Return ``{customer_id: spend}`` for ``cycle`` aggregated in SQL."""
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(_SPEND_BY_CUSTOMER_SQL, (cycle,))
+            return {row[0]: float(row[1]) for row in cur.fetchall()}
+
     def get_usage_events_by_range(self, start: str, end: str):
         """Return usage events between ``start`` and ``end`` dates (inclusive)."""
-        with sqlite3.connect(self.db_path) as conn:
-            cur = conn.execute(
-                """
-                SELECT customer_id, feature, units, unit_cost, ts
-                FROM usage_events
-                WHERE date(ts) >= date(?) AND date(ts) <= date(?)
-                """,
-                (start, end),
-            )
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(_USAGE_BY_RANGE_SQL, (start, end))
             keys = ["customer_id", "feature", "units", "unit_cost", "ts"]
             return [dict(zip(keys, row)) for row in cur.fetchall()]
 
@@ -290,47 +568,172 @@ class Ledger:
         cycle: str,
         amount: float,
         business_unit: str = "",
+        outbox: Iterable[Tuple[str, Dict[str, Any]]] = (),
     ) -> None:
-        with tracer.start_as_current_span("Ledger.create_invoice") as span:
-            if span:
-                try:
-                    span.set_attribute("invoice_id", invoice_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(
-                    "INSERT OR REPLACE INTO invoices (id, customer_id, cycle, amount, business_unit) VALUES (?, ?, ?, ?, ?)",
-                    (invoice_id, customer_id, cycle, amount, business_unit),
-                )
-                conn.commit()
+        """Store an invoice and queue ``(destination, payload)`` pushes with it."""
+        with tracer.span("Ledger.create_invoice", invoice_id=invoice_id):
+            self.record_invoices(
+                [(invoice_id, customer_id, cycle, amount, business_unit)],
+                outbox=[(invoice_id, dest, payload) for dest, payload in outbox],
+            )
 
     def create_credit_note(
         self, note_id: str, invoice_id: str, amount: float, description: str
     ) -> None:
-        with tracer.start_as_current_span("Ledger.create_credit_note") as span:
-            if span:
-                try:
-                    span.set_attribute("note_id", note_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
-            with sqlite3.connect(self.db_path) as conn:
+        with tracer.span("Ledger.create_credit_note", note_id=note_id):
+            with sqlite_pool.connect(self.db_path) as conn:
                 conn.execute(
                     "INSERT OR REPLACE INTO credit_notes (id, invoice_id, amount, description) VALUES (?, ?, ?, ?)",
                     (note_id, invoice_id, amount, description),
                 )
                 conn.commit()
 
+    def get_invoice_totals(self, cycle: str) -> List[Tuple[str, float, float]]:
+        """Return ``(customer_id, total, credit)`` for ``cycle`` computed in SQL.
+
+        ``total`` sums non-negative usage and ``credit`` the magnitude of
+        negative usage. Customers with only credits are omitted.
+        """
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(_INVOICE_TOTALS_SQL, (cycle,))
+            return [(row[0], float(row[1]), float(row[2])) for row in cur.fetchall()]
+
+    def record_invoices(
+        self,
+        invoices: Iterable[Tuple[str, str, str, float, str]],
+        credit_notes: Iterable[Tuple[str, str, float, str]] = (),
+        outbox: Iterable[Tuple[str, str, Dict[str, Any]]] = (),
+    ) -> None:
+        """Write invoices, credit notes and outbox jobs in one transaction.
+
+        ``outbox`` holds ``(invoice_id, destination, payload)`` entries.
+        Re-queuing an existing ``(invoice_id, destination)`` resets it to
+        pending with the new payload.
+        """
+        now = time.time()
+        jobs = [(inv, dest, json.dumps(payload), now) for inv, dest, payload in outbox]
+        with tracer.span("Ledger.record_invoices"):
+            with sqlite_pool.connect(self.db_path) as conn:
+                conn.executemany(_INSERT_INVOICE_SQL, invoices)
+                conn.executemany(_INSERT_CREDIT_NOTE_SQL, credit_notes)
+                conn.executemany(_ENQUEUE_OUTBOX_SQL, jobs)
+
+    def get_outbox_jobs(
+        self,
+        status: str = "pending",
+        invoice_ids: Optional[Iterable[str]] = None,
+        *,
+        due_before: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Return outbox jobs with ``status``, optionally for ``invoice_ids``.
+
+        ``due_before`` (epoch seconds) skips jobs still backing off.
+        """
+        query = (
+            "SELECT id, invoice_id, destination, payload, status, attempts, last_error "
+            "FROM accounting_outbox WHERE status = ?"
+        )
+        params: List[Any] = [status]
+        if due_before is not None:
+            query += " AND next_attempt_at <= ?"
+            params.append(due_before)
+        if invoice_ids is not None:
+            ids = list(invoice_ids)
+            query += f" AND invoice_id IN ({', '.join('?' * len(ids))})"
+            params.extend(ids)
+        query += " ORDER BY id"
+        with sqlite_pool.connect(self.db_path) as conn:
+            rows = conn.execute(query, params).fetchall()
+        jobs = [dict(zip(_OUTBOX_KEYS, row)) for row in rows]
+        for job in jobs:
+            job["payload"] = json.loads(job["payload"])
+        return jobs
+
+    def claim_outbox_jobs(self, job_ids: Iterable[int], lease_until: float) -> List[int]:
+        """Atomically mark pending jobs ``in_progress`` until ``lease_until``.
+
+        Returns the ids this call claimed; jobs another worker already holds
+        (or that are no longer pending) are left out and must not be sent.
+        """
+        ids = list(job_ids)
+        if not ids:
+            return []
+        with sqlite_pool.connect(self.db_path) as conn:
+            # Take the write lock before reading, so no other worker can
+            # claim the same pending jobs between the SELECT and the UPDATE.
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            claimed = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT id FROM accounting_outbox "
+                    f"WHERE id IN ({', '.join('?' * len(ids))}) AND status = 'pending' "
+                    "ORDER BY id",
+                    ids,
+                )
+            ]
+            if claimed:
+                conn.execute(
+                    "UPDATE accounting_outbox SET status = 'in_progress', lease_until = ?, "
+                    "updated_at = CURRENT_TIMESTAMP "
+                    f"WHERE id IN ({', '.join('?' * len(claimed))})",
+                    [lease_until, *claimed],
+                )
+        return claimed
+
+    def release_expired_outbox_leases(self, now: float) -> int:
+        """Return ``in_progress`` jobs whose lease ended before ``now`` to pending."""
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(
+                "UPDATE accounting_outbox SET status = 'pending', lease_until = 0, "
+                "updated_at = CURRENT_TIMESTAMP "
+                "WHERE status = 'in_progress' AND lease_until < ?",
+                (now,),
+            )
+        return cur.rowcount
+
+    def update_outbox_job(
+        self,
+        job_id: int,
+        status: str,
+        attempts: int,
+        last_error: Optional[str] = None,
+        next_attempt_at: float = 0.0,
+        lease_until: float = 0.0,
+    ) -> None:
+        with sqlite_pool.connect(self.db_path) as conn:
+            conn.execute(
+                "UPDATE accounting_outbox SET status = ?, attempts = ?, last_error = ?, "
+                "next_attempt_at = ?, lease_until = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE id = ?",
+                (status, attempts, last_error, next_attempt_at, lease_until, job_id),
+            )
+
+    def count_outbox_jobs(self, status: str = "pending") -> Dict[str, int]:
+        """Return ``{destination: count}`` of outbox jobs with ``status``."""
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(
+                "SELECT destination, COUNT(*) FROM accounting_outbox "
+                "WHERE status = ? GROUP BY destination",
+                (status,),
+            )
+            return dict(cur.fetchall())
+
+    def get_invoice_sync_status(self, invoice_id: str) -> Dict[str, str]:
+        """Return ``{destination: status}`` for an invoice's accounting pushes."""
+        with sqlite_pool.connect(self.db_path) as conn:
+            cur = conn.execute(
+                "SELECT destination, status FROM accounting_outbox WHERE invoice_id = ?",
+                (invoice_id,),
+            )
+            return dict(cur.fetchall())
+
     # Budget helpers ------------------------------------------------------
 
     def set_budget(self, customer_id: str, monthly_limit: float) -> None:
         """Insert or update a monthly budget for a customer."""
-        with tracer.start_as_current_span("Ledger.set_budget") as span:
-            if span:
-                try:
-                    span.set_attribute("customer_id", customer_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
-            with sqlite3.connect(self.db_path) as conn:
+        with tracer.span("Ledger.set_budget", customer_id=customer_id):
+            with sqlite_pool.connect(self.db_path) as conn:
                 conn.execute(
                     "INSERT OR REPLACE INTO budgets (customer_id, monthly_limit) VALUES (?, ?)",
                     (customer_id, monthly_limit),
@@ -339,7 +742,7 @@ class Ledger:
 
     def get_budget(self, customer_id: str) -> Optional[float]:
         """Return the monthly limit for the given customer, if set."""
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             cur = conn.execute(
                 "SELECT monthly_limit FROM budgets WHERE customer_id = ?",
                 (customer_id,),
@@ -349,6 +752,6 @@ class Ledger:
 
     def list_budgets(self) -> list[tuple[str, float]]:
         """Return ``[(customer_id, monthly_limit), ...]`` for all budgets."""
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             cur = conn.execute("SELECT customer_id, monthly_limit FROM budgets")
             return [(row[0], float(row[1])) for row in cur.fetchall()]
@@ -1,5 +1,89 @@
+from bisect import bisect_right
+from datetime import datetime
+from typing import Optional, Dict, Iterable, List, Any, Sequence, Tuple
+import math
 import sqlite3
-from typing import Optional, Dict, List, Any
+import threading
+import uuid
+
+from . import migrations
+from . import sqlite_pool
+from .metrics import OPERATION_SECONDS, timed
+
+_RULE_KEYS = ["id", "provider", "model", "markup", "effective_date"]
+
+_INSERT_RULE_SQL = """
+    INSERT OR REPLACE INTO markup_rules
+        (id, provider, model, markup, effective_date)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+class RuleValidationError(ValueError):
+    """Raised when a bulk load contains invalid rules; nothing was written.
+
+    ``errors`` lists ``{"index" or "line", "error"}`` entries.
+    """
+
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} invalid markup rule(s)")
+        self.errors = errors
+
+
+def _rule_row(rule: Any) -> Tuple[str, str, str, float, str]:
+    if not isinstance(rule, dict):
+        raise TypeError("rule must be an object")
+    missing = [
+        key
+        for key in ("provider", "model", "markup", "effective_date")
+        if rule.get(key) in (None, "")
+    ]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    markup = float(rule["markup"])
+    if not math.isfinite(markup):
+        raise ValueError("markup must be a finite number")
+    effective_date = str(rule["effective_date"])
+    datetime.fromisoformat(effective_date)
+    rule_id = str(rule.get("id") or uuid.uuid4())
+    return (rule_id, str(rule["provider"]), str(rule["model"]), markup, effective_date)
+
+
+def validate_rules(
+    rules: Iterable[Any],
+) -> Tuple[List[Tuple[str, str, str, float, str]], List[Dict[str, Any]]]:
+    """Check rule dictionaries before writing any of them.
+
+    Returns ``(rows, errors)``: insertable rows for the valid rules and
+    ``{"index", "error"}`` entries for the invalid ones. Rules without an
+    ``id`` get a random one; an id repeated within the batch is an error.
+    """
+    rows: List[Tuple[str, str, str, float, str]] = []
+    errors: List[Dict[str, Any]] = []
+    seen: set[str] = set()
+    for i, rule in enumerate(rules):
+        try:
+            row = _rule_row(rule)
+        except (TypeError, ValueError) as exc:
+            errors.append({"index": i, "error": str(exc)})
+            continue
+        if row[0] in seen:
+            errors.append({"index": i, "error": f"duplicate id {row[0]!r}"})
+            continue
+        seen.add(row[0])
+        rows.append(row)
+    return rows, errors
+
+
+_MIGRATIONS: list[migrations.Migration] = [
+    (
+        1,
+        [
+            "CREATE INDEX IF NOT EXISTS idx_markup_rules_lookup "
+            "ON markup_rules (provider, model, effective_date)"
+        ],
+    ),
+]
 
 
 class MarkupRuleStore:
@@ -9,25 +93,42 @@ class MarkupRuleStore:
         self.db_path = db_path
         self._ensure_table()
 
-    def load_rules(self, rules: List[Dict[str, Any]]) -> None:
-        """Bulk insert rules represented as dictionaries."""
-        for rule in rules:
-            self.create_rule(
-                rule["id"],
-                rule["provider"],
-                rule["model"],
-                float(rule["markup"]),
-                rule["effective_date"],
-            )
+    def _write_rules(self, rows: List[Tuple[str, str, str, float, str]]) -> int:
+        with sqlite_pool.connect(self.db_path) as conn:
+            conn.executemany(_INSERT_RULE_SQL, rows)
+        _invalidate_index(self.db_path)
+        return len(rows)
+
+    def load_rules(self, rules: List[Dict[str, Any]]) -> int:
+        """Bulk insert rules represented as dictionaries.
 
-    def load_from_dsl(self, text: str) -> None:
-        """Parse DSL text and load resulting rules."""
-        from .pricing_dsl import parse_pricing_dsl
+        Every rule is validated first and all of them are written in one
+        transaction, so either the whole batch is applied or, on
+        :class:`RuleValidationError`, none of it. Returns the rule count.
+        """
+        rows, errors = validate_rules(rules)
+        if errors:
+            raise RuleValidationError(errors)
+        return self._write_rules(rows)
 
-        self.load_rules(parse_pricing_dsl(text))
+    def load_from_dsl(self, text: str) -> int:
+        """Parse DSL text and load resulting rules atomically.
+
+        Parse and validation errors are reported together by line number.
+        """
+        from .pricing_dsl import parse_pricing_dsl_report
+
+        numbered, errors = parse_pricing_dsl_report(text)
+        rows, invalid = validate_rules([rule for _, rule in numbered])
+        errors += [
+            {"line": numbered[err["index"]][0], "error": err["error"]} for err in invalid
+        ]
+        if errors:
+            raise RuleValidationError(sorted(errors, key=lambda err: err["line"]))
+        return self._write_rules(rows)
 
     def _ensure_table(self) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS markup_rules (
@@ -40,6 +141,7 @@ class MarkupRuleStore:
                 """
             )
             conn.commit()
+            migrations.apply_migrations(conn, "markup", _MIGRATIONS)
 
     def create_rule(
         self,
@@ -49,19 +151,16 @@ class MarkupRuleStore:
         markup: float,
         effective_date: str,
     ) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
-                """
-                INSERT OR REPLACE INTO markup_rules
-                    (id, provider, model, markup, effective_date)
-                VALUES (?, ?, ?, ?, ?)
-                """,
+                _INSERT_RULE_SQL,
                 (rule_id, provider, model, markup, effective_date),
             )
             conn.commit()
+        _invalidate_index(self.db_path)
 
     def get_rule(self, rule_id: str) -> Optional[Dict[str, Any]]:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             cur = conn.execute(
                 """
                 SELECT id, provider, model, markup, effective_date
@@ -76,7 +175,7 @@ class MarkupRuleStore:
         return None
 
     def list_rules(self) -> List[Dict[str, Any]]:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             cur = conn.execute(
                 "SELECT id, provider, model, markup, effective_date FROM markup_rules"
             )
@@ -95,17 +194,140 @@ class MarkupRuleStore:
         if not fields:
             return
         values.append(rule_id)
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
                 f"UPDATE markup_rules SET {', '.join(fields)} WHERE id = ?",
                 values,
             )
             conn.commit()
+        _invalidate_index(self.db_path)
 
     def delete_rule(self, rule_id: str) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute("DELETE FROM markup_rules WHERE id = ?", (rule_id,))
             conn.commit()
+        _invalidate_index(self.db_path)
+
+
+class MarkupRuleIndex:
+    """In-memory index answering "which rule applies at ``ts``" lookups.
+
+    Rules are grouped per ``(provider, model)`` and sorted by
+    ``effective_date`` so the active rule is found by bisection. The index
+    reloads lazily after :class:`MarkupRuleStore` writes in this process and
+    when another connection commits to the database, which it detects through
+    ``PRAGMA data_version`` on its own connection.
+    """
+
+    def __init__(self, db_path: str = "markup_rules.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._generation = 0
+        self._loaded_generation = -1
+        self._data_version: Optional[int] = None
+        self._version = 0
+        self._dates: Dict[Tuple[str, str], List[str]] = {}
+        self._rules: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+
+    def invalidate(self) -> None:
+        """Force a reload on the next lookup."""
+        self._generation += 1
+
+    def _refresh(self) -> None:
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            generation = self._generation
+            if (
+                generation == self._loaded_generation
+                and version == self._data_version
+            ):
+                return
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT id, provider, model, markup, effective_date
+                    FROM markup_rules
+                    ORDER BY provider, model, effective_date
+                    """
+                ).fetchall()
+            except sqlite3.OperationalError:  # table not created yet
+                rows = []
+            dates: Dict[Tuple[str, str], List[str]] = {}
+            rules: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+            for row in rows:
+                key = (row[1], row[2])
+                dates.setdefault(key, []).append(row[4])
+                rules.setdefault(key, []).append(dict(zip(_RULE_KEYS, row)))
+            self._dates = dates
+            self._rules = rules
+            self._data_version = version
+            self._loaded_generation = generation
+            self._version += 1
+
+    def version(self) -> int:
+        """Return a counter that increases whenever the rules may have changed.
+
+        Any commit to the database file bumps it, so it can change without
+        the rules changing, but never the other way round.
+        """
+        self._refresh()
+        return self._version
+
+    @timed(OPERATION_SECONDS, "markup.lookup")
+    def lookup(self, provider: str, model: str, ts: str) -> Optional[Dict[str, Any]]:
+        """Return the rule active at ``ts`` for ``provider``/``model``."""
+        self._refresh()
+        key = (provider, model)
+        dates = self._dates.get(key)
+        if not dates:
+            return None
+        idx = bisect_right(dates, ts)
+        if idx == 0:
+            return None
+        return dict(self._rules[key][idx - 1])
+
+    @timed(OPERATION_SECONDS, "markup.lookup_many")
+    def lookup_many(
+        self, provider: str, model: str, timestamps: Sequence[str]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Return the active rule for each of ``timestamps``.
+
+        Entries are shared between timestamps that resolve to the same rule.
+        """
+        self._refresh()
+        key = (provider, model)
+        dates = self._dates.get(key)
+        if not dates:
+            return [None] * len(timestamps)
+        rules = [dict(rule) for rule in self._rules[key]]
+        result: List[Optional[Dict[str, Any]]] = []
+        for ts in timestamps:
+            idx = bisect_right(dates, ts)
+            result.append(rules[idx - 1] if idx else None)
+        return result
+
+
+_INDEXES: Dict[str, MarkupRuleIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_markup_index(db_path: str = "markup_rules.db") -> MarkupRuleIndex:
+    """Return the shared :class:`MarkupRuleIndex` for ``db_path``."""
+    key = str(db_path)
+    index = _INDEXES.get(key)
+    if index is None:
+        with _INDEXES_LOCK:
+            index = _INDEXES.get(key)
+            if index is None:
+                index = _INDEXES[key] = MarkupRuleIndex(key)
+    return index
+
+
+def _invalidate_index(db_path: str) -> None:
+    index = _INDEXES.get(str(db_path))
+    if index is not None:
+        index.invalidate()
 
 
 def get_effective_markup(
@@ -115,21 +337,4 @@ def get_effective_markup(
     db_path: str = "markup_rules.db",
 ) -> Optional[Dict[str, Any]]:
     """Return the markup rule active at ``ts`` for the given provider/model."""
-
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.execute(
-            """
-            SELECT id, provider, model, markup, effective_date
-            FROM markup_rules
-            WHERE provider = ? AND model = ? AND effective_date <= ?
-            ORDER BY effective_date DESC
-            LIMIT 1
-            """,
-            (provider, model, ts),
-        )
-        row = cur.fetchone()
-
-    if row:
-        keys = ["id", "provider", "model", "markup", "effective_date"]
-        return dict(zip(keys, row))
-    return None
+    return get_markup_index(db_path).lookup(provider, model, ts)
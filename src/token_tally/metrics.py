@@ -1,31 +1,175 @@
-"""Simple Prometheus metrics helpers."""
+"""Simple Prometheus metrics helpers.
+
+Hot paths are timed with :func:`timed`, which works as a decorator or a
+context manager::
+
+    @timed(OPERATION_SECONDS, "ledger.add_usage_event")
+    def add_usage_event(...): ...
+
+    with timed(TOKEN_COUNT_SECONDS, provider):
+        ...
+
+Without ``prometheus_client`` nothing is exported, so :func:`timed` returns
+decorated functions unchanged and hands out a shared no-op context manager.
+"""
 
 from __future__ import annotations
 
+import functools
+from time import perf_counter
+from typing import Any, Callable, TypeVar
+
 try:
-    from prometheus_client import Counter, start_http_server
+    from prometheus_client import Counter, Gauge, Histogram, Summary, start_http_server
 
     _PROM_AVAILABLE = True
 except Exception:  # pragma: no cover - prometheus optional
     _PROM_AVAILABLE = False
 
-    class Counter:  # type: ignore
-        def __init__(self, *args, **kwargs) -> None:
+    class _Metric:
+        def __init__(self, name: str = "", documentation: str = "", labelnames=(), **kwargs) -> None:
             self.value = 0.0
             self._value = self
+            self._labelnames = tuple(labelnames)
+            self._children: dict = {}
 
-        def inc(self, amount: float = 1.0) -> None:
-            self.value += amount
+        def labels(self, *values, **kwvalues):
+            key = values or tuple(kwvalues[name] for name in self._labelnames)
+            child = self._children.get(key)
+            if child is None:
+                child = self._children.setdefault(key, type(self)())
+            return child
 
         def get(self) -> float:
             return self.value
 
+    class Counter(_Metric):  # type: ignore
+        def inc(self, amount: float = 1.0) -> None:
+            self.value += amount
+
+    class Gauge(_Metric):  # type: ignore
+        def inc(self, amount: float = 1.0) -> None:
+            self.value += amount
+
+        def dec(self, amount: float = 1.0) -> None:
+            self.value -= amount
+
+        def set(self, value: float) -> None:
+            self.value = float(value)
+
+    class Histogram(_Metric):  # type: ignore
+        def __init__(self, *args, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+            self._sum = self
+            self.count = 0
+
+        def observe(self, amount: float) -> None:
+            self.value += amount
+            self.count += 1
+
+    class Summary(Histogram):  # type: ignore
+        pass
+
     def start_http_server(*args, **kwargs) -> None:  # type: ignore
         print("prometheus_client not installed; metrics disabled")
 
 
 REQUEST_COUNTER = Counter("requests_handled_total", "Number of HTTP requests handled")
 TOKEN_COUNTER = Counter("tokens_counted_total", "Number of tokens counted")
+TOKEN_CACHE_HITS = Counter(
+    "token_count_cache_hits_total", "Token counts served from the cache"
+)
+TOKEN_CACHE_MISSES = Counter(
+    "token_count_cache_misses_total", "Token counts missing from the cache"
+)
+ACCOUNTING_OUTBOX_DEPTH = Gauge(
+    "accounting_outbox_pending",
+    "Invoice pushes waiting in the accounting outbox",
+    ["destination"],
+)
+ACCOUNTING_DELIVERY_SECONDS = Histogram(
+    "accounting_delivery_seconds",
+    "Time spent delivering one outbox request to an accounting system",
+    ["destination"],
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "markup_http_request_seconds",
+    "Markup API request latency",
+    ["method", "endpoint"],
+)
+
+OPERATION_SECONDS = Histogram(
+    "token_tally_operation_seconds",
+    "Latency of instrumented hot paths",
+    ["operation"],
+)
+TOKEN_COUNT_SECONDS = Summary(
+    "token_count_seconds",
+    "Time spent counting tokens",
+    ["provider"],
+)
+
+# Timing is only worth its cost when the measurements are exported.
+_TIMING_ENABLED = _PROM_AVAILABLE
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class _Timer:
+    """Observe elapsed seconds into a metric around a block or a function."""
+
+    __slots__ = ("_metric", "_start")
+
+    def __init__(self, metric: Any) -> None:
+        self._metric = metric
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self._metric.observe(perf_counter() - self._start)
+
+    def __call__(self, func: F) -> F:
+        metric = self._metric
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(perf_counter() - start)
+
+        return wrapper  # type: ignore[return-value]
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopTimer":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        pass
+
+    def __call__(self, func: F) -> F:
+        return func
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timed(metric: Any, *labelvalues: str) -> Any:
+    """Time a function or ``with`` block into a Histogram or Summary.
+
+    ``labelvalues`` select the labelled child of ``metric``.
+    """
+    if not _TIMING_ENABLED:
+        return _NOOP_TIMER
+    return _Timer(metric.labels(*labelvalues) if labelvalues else metric)
 
 
 def start_metrics_server(port: int = 8001) -> None:
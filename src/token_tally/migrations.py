@@ -0,0 +1,92 @@
+"""Versioned schema migrations for the SQLite-backed stores.
+
+Several stores may share one database file, so applied versions are tracked
+per store in a ``schema_migrations`` table rather than in
+``PRAGMA user_version``. Each migration runs in its own transaction together
+with the row that records it.
+
+Stores keep their original ``CREATE TABLE IF NOT EXISTS`` statements as the
+baseline and list every later change as a numbered migration. A step is
+either an SQL statement or a callable that receives the connection, for data
+backfills. Stores should read optional schema features once at startup with
+:func:`table_columns` instead of introspecting tables on hot paths.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from typing import Callable, FrozenSet, Iterable, Sequence, Tuple, Union
+
+Step = Union[str, Callable[[sqlite3.Connection], object]]
+Migration = Tuple[int, Sequence[Step]]
+
+
+def _ensure_table(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            store TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (store, version)
+        )
+        """
+    )
+
+
+def schema_version(conn: sqlite3.Connection, store: str) -> int:
+    """Return the highest migration version applied for ``store``."""
+    _ensure_table(conn)
+    row = conn.execute(
+        "SELECT MAX(version) FROM schema_migrations WHERE store = ?", (store,)
+    ).fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(
+    conn: sqlite3.Connection, store: str, migrations: Iterable[Migration]
+) -> int:
+    """Apply the ``(version, statements)`` pairs not yet recorded for ``store``.
+
+    Each migration takes the write lock (``BEGIN IMMEDIATE``) and checks
+    again that it is still unapplied, so connections migrating the same
+    database concurrently apply every version exactly once.
+
+    Returns the resulting schema version.
+    """
+    _ensure_table(conn)
+    applied = {
+        version
+        for (version,) in conn.execute(
+            "SELECT version FROM schema_migrations WHERE store = ?", (store,)
+        )
+    }
+    for version, statements in sorted(migrations, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        with conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            if conn.execute(
+                "SELECT 1 FROM schema_migrations WHERE store = ? AND version = ?",
+                (store, version),
+            ).fetchone():
+                continue
+            for step in statements:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT OR IGNORE INTO schema_migrations (store, version) VALUES (?, ?)",
+                (store, version),
+            )
+    return schema_version(conn, store)
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> FrozenSet[str]:
+    """Return the column names of ``table`` (empty if it does not exist)."""
+    return frozenset(row[1] for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+__all__ = ["Migration", "Step", "apply_migrations", "schema_version", "table_columns"]
@@ -3,7 +3,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List
+from typing import List, Tuple
 import re
 
 
@@ -32,29 +32,52 @@ def _parse_markup(value: str) -> float:
     return float(value)
 
 
-def parse_pricing_dsl(text: str) -> List[dict]:
-    """Parse DSL text into a list of markup rule dictionaries."""
+def parse_pricing_dsl_report(text: str) -> Tuple[List[Tuple[int, dict]], List[dict]]:
+    """Parse DSL text without stopping at the first bad line.
+
+    Returns ``(rules, errors)``: ``rules`` pairs each rule dictionary with its
+    1-based line number, and ``errors`` holds ``{"line", "error"}`` entries
+    for lines that do not match the grammar or have an unparseable markup.
+    """
 
-    rules: List[dict] = []
-    for line in text.splitlines():
+    rules: List[Tuple[int, dict]] = []
+    errors: List[dict] = []
+    for lineno, line in enumerate(text.splitlines(), start=1):
         line = line.strip()
         if not line or line.startswith("#"):
             continue
         m = _RULE_RE.match(line)
         if not m:
-            raise ValueError(f"Invalid DSL line: {line}")
+            errors.append({"line": lineno, "error": f"Invalid DSL line: {line}"})
+            continue
         provider = m.group("provider")
         model = m.group("model")
-        markup = _parse_markup(m.group("markup"))
+        try:
+            markup = _parse_markup(m.group("markup"))
+        except ValueError:
+            errors.append({"line": lineno, "error": f"Invalid markup: {line}"})
+            continue
         date = m.group("date")
         rule_id = f"{provider}-{model}-{date}"
         rules.append(
-            {
-                "id": rule_id,
-                "provider": provider,
-                "model": model,
-                "markup": markup,
-                "effective_date": date,
-            }
+            (
+                lineno,
+                {
+                    "id": rule_id,
+                    "provider": provider,
+                    "model": model,
+                    "markup": markup,
+                    "effective_date": date,
+                },
+            )
         )
-    return rules
+    return rules, errors
+
+
+def parse_pricing_dsl(text: str) -> List[dict]:
+    """Parse DSL text into a list of markup rule dictionaries."""
+
+    rules, errors = parse_pricing_dsl_report(text)
+    if errors:
+        raise ValueError(errors[0]["error"])
+    return [rule for _, rule in rules]
@@ -1,113 +1,235 @@
 import json
+import secrets
+import threading
+import time
 import uuid
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
 from urllib.parse import urlparse
 
-from .markup import MarkupRuleStore
-from .metrics import REQUEST_COUNTER, start_metrics_server
+from . import sqlite_pool
+from .markup import MarkupRuleStore, RuleValidationError, get_markup_index
+from .metrics import HTTP_REQUEST_SECONDS, REQUEST_COUNTER, start_metrics_server
+from .tracing import get_tracer
 
-try:
-    from opentelemetry import trace
-except Exception:  # pragma: no cover - optional
+tracer = get_tracer(__name__)
 
-    class _DummySpan:
-        def __enter__(self):
-            return self
+store = MarkupRuleStore()
 
-        def __exit__(self, *exc: object) -> None:
-            pass
+# Distinguishes ETags issued by different server processes, whose rule
+# version counters all start from zero.
+_BOOT_ID = secrets.token_hex(4)
 
-        def set_attribute(self, *args: object, **kwargs: object) -> None:
-            pass
 
-    class _DummyTracer:
-        def start_as_current_span(self, name: str) -> _DummySpan:
-            return _DummySpan()
+class ResponseCache:
+    """Serialized GET responses for a single rules version.
 
-    class _TraceModule:
-        def get_tracer(self, name: str | None = None) -> _DummyTracer:
-            return _DummyTracer()
+    Entries are dropped as soon as a request observes a newer version, and
+    the whole cache is cleared by writes made through this server.
+    """
 
-    trace = _TraceModule()  # type: ignore
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._entries: Dict[str, bytes] = {}
 
-tracer = trace.get_tracer(__name__)
+    def get(self, path: str, version: int) -> Optional[bytes]:
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+                return None
+            return self._entries.get(path)
 
-store = MarkupRuleStore()
+    def put(self, path: str, version: int, body: bytes) -> None:
+        with self._lock:
+            if version == self._version:
+                self._entries[path] = body
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+response_cache = ResponseCache()
+
+
+def _endpoint(path: str) -> str:
+    """Collapse a request path into a low-cardinality metrics label."""
+    if path in ("/markup-rules", "/markup-rules:batch", "/markup-rules:dsl"):
+        return path
+    if path.startswith("/markup-rules/"):
+        return "/markup-rules/{id}"
+    return "other"
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 
 class MarkupHandler(BaseHTTPRequestHandler):
-    def _send_json(self, data, status=200):
-        body = json.dumps(data).encode()
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are dropped after this many seconds.
+    timeout = 30
+
+    def _send_body(
+        self, body: bytes, status: int = 200, etag: Optional[str] = None
+    ) -> None:
         self.send_response(status)
         self.send_header("Content-Type", "application/json")
         self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
         self.end_headers()
         self.wfile.write(body)
 
-    def do_GET(self):
+    def _send_json(self, data: Any, status: int = 200) -> None:
+        self._send_body(json.dumps(data).encode(), status)
+
+    def _read_json(self) -> Any:
+        return json.loads(self._body) if self._body else {}
+
+    def _handle(self, method: str, handler: Callable[[str], None]) -> None:
         REQUEST_COUNTER.inc()
-        with tracer.start_as_current_span("MarkupHandler.do_GET"):
-            path = urlparse(self.path).path
-            if path == "/markup-rules":
-                self._send_json(store.list_rules())
-            elif path.startswith("/markup-rules/"):
-                rule_id = path.split("/")[-1]
-                rule = store.get_rule(rule_id)
-                if rule:
-                    self._send_json(rule)
-                else:
-                    self._send_json({"error": "not found"}, 404)
+        start = time.perf_counter()
+        path = urlparse(self.path).path
+        # Always consume the body so the next request on a kept-alive
+        # connection starts at the right byte.
+        length = int(self.headers.get("Content-Length", "0"))
+        self._body = self.rfile.read(length) if length else b""
+        try:
+            with tracer.span(f"MarkupHandler.do_{method}"):
+                handler(path)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(method, _endpoint(path)).observe(
+                time.perf_counter() - start
+            )
+
+    def _render(self, path: str) -> Tuple[int, Any]:
+        if path == "/markup-rules":
+            return 200, store.list_rules()
+        if path.startswith("/markup-rules/"):
+            rule = store.get_rule(path.split("/")[-1])
+            if rule:
+                return 200, rule
+        return 404, {"error": "not found"}
+
+    def _get(self, path: str) -> None:
+        version = get_markup_index(store.db_path).version()
+        etag = f'"{_BOOT_ID}-{version}"'
+        body = response_cache.get(path, version)
+        if body is None:
+            status, data = self._render(path)
+            if status != 200:
+                self._send_json(data, status)
+                return
+            body = json.dumps(data).encode()
+            response_cache.put(path, version, body)
+        if _etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._send_body(body, etag=etag)
+
+    def _post_bulk(self, path: str) -> None:
+        try:
+            if path == "/markup-rules:dsl":
+                count = store.load_from_dsl(self._body.decode("utf-8"))
             else:
-                self._send_json({"error": "not found"}, 404)
+                body = self._read_json()
+                rules = body.get("rules") if isinstance(body, dict) else body
+                if not isinstance(rules, list):
+                    self._send_json({"error": "expected a list of rules"}, 400)
+                    return
+                count = store.load_rules(rules)
+        except RuleValidationError as exc:
+            self._send_json({"errors": exc.errors}, 400)
+            return
+        except (UnicodeDecodeError, ValueError):
+            self._send_json({"error": "invalid body"}, 400)
+            return
+        response_cache.clear()
+        self._send_json({"loaded": count})
+
+    def _post(self, path: str) -> None:
+        if path in ("/markup-rules:batch", "/markup-rules:dsl"):
+            self._post_bulk(path)
+            return
+        if path != "/markup-rules":
+            self._send_json({"error": "not found"}, 404)
+            return
+        body = self._read_json()
+        rule_id = body.get("id") or str(uuid.uuid4())
+        provider = body.get("provider")
+        model = body.get("model")
+        markup = body.get("markup")
+        effective_date = body.get("effective_date")
+        if not all([provider, model, markup, effective_date]):
+            self._send_json({"error": "invalid body"}, 400)
+            return
+        store.create_rule(rule_id, provider, model, float(markup), effective_date)
+        response_cache.clear()
+        self._send_json({"id": rule_id})
+
+    def _put(self, path: str) -> None:
+        if not path.startswith("/markup-rules/"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        rule_id = path.split("/")[-1]
+        updates = self._read_json()
+        store.update_rule(rule_id, **updates)
+        response_cache.clear()
+        self._send_json({"status": "ok"})
+
+    def _delete(self, path: str) -> None:
+        if not path.startswith("/markup-rules/"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        rule_id = path.split("/")[-1]
+        store.delete_rule(rule_id)
+        response_cache.clear()
+        self._send_json({"status": "deleted"})
+
+    def do_GET(self):
+        self._handle("GET", self._get)
 
     def do_POST(self):
-        REQUEST_COUNTER.inc()
-        with tracer.start_as_current_span("MarkupHandler.do_POST"):
-            path = urlparse(self.path).path
-            if path != "/markup-rules":
-                self._send_json({"error": "not found"}, 404)
-                return
-            length = int(self.headers.get("Content-Length", "0"))
-            body = json.loads(self.rfile.read(length)) if length else {}
-            rule_id = body.get("id") or str(uuid.uuid4())
-            provider = body.get("provider")
-            model = body.get("model")
-            markup = body.get("markup")
-            effective_date = body.get("effective_date")
-            if not all([provider, model, markup, effective_date]):
-                self._send_json({"error": "invalid body"}, 400)
-                return
-            store.create_rule(rule_id, provider, model, float(markup), effective_date)
-            self._send_json({"id": rule_id})
+        self._handle("POST", self._post)
 
     def do_PUT(self):
-        REQUEST_COUNTER.inc()
-        with tracer.start_as_current_span("MarkupHandler.do_PUT"):
-            path = urlparse(self.path).path
-            if not path.startswith("/markup-rules/"):
-                self._send_json({"error": "not found"}, 404)
-                return
-            rule_id = path.split("/")[-1]
-            length = int(self.headers.get("Content-Length", "0"))
-            updates = json.loads(self.rfile.read(length)) if length else {}
-            store.update_rule(rule_id, **updates)
-            self._send_json({"status": "ok"})
+        self._handle("PUT", self._put)
 
     def do_DELETE(self):
-        REQUEST_COUNTER.inc()
-        with tracer.start_as_current_span("MarkupHandler.do_DELETE"):
-            path = urlparse(self.path).path
-            if not path.startswith("/markup-rules/"):
-                self._send_json({"error": "not found"}, 404)
-                return
-            rule_id = path.split("/")[-1]
-            store.delete_rule(rule_id)
-            self._send_json({"status": "deleted"})
+        self._handle("DELETE", self._delete)
+
+
+class MarkupServer(ThreadingHTTPServer):
+    """Thread-per-connection server, so one slow client blocks no one else.
+
+    SQLite connections are cached per thread, so each client connection gets
+    its own for as long as it is kept alive; it is closed when the client's
+    thread finishes instead of leaking one handle per client.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            sqlite_pool.close_all()
 
 
-def run(host: str = "0.0.0.0", port: int = 8000):
+def run(host: str = "0.0.0.0", port: int = 8000, *, threaded: bool = True):
     start_metrics_server()
-    server = HTTPServer((host, port), MarkupHandler)
+    server_cls = MarkupServer if threaded else HTTPServer
+    server = server_cls((host, port), MarkupHandler)
     print(f"Markup server running on {host}:{port}")
     server.serve_forever()
 
@@ -0,0 +1,81 @@
+"""Shared SQLite connection manager used by the SQLite-backed stores.
+
+Connections are cached per thread and database path, so repeated calls reuse
+one open handle (and its prepared-statement cache) instead of reconnecting.
+Nothing closes them when a thread exits: code that runs stores on
+short-lived threads (such as one thread per HTTP client) must call
+:func:`close_all` at the end of each thread.
+Each new connection switches the database to WAL mode so dashboard and
+forecast readers do not block ledger writers.
+
+The stores need SQLite 3.24 or newer (``INSERT ... ON CONFLICT DO UPDATE``);
+newer syntax such as ``RETURNING`` or ``unixepoch()`` is not used.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from typing import Dict
+
+# Applied to every new connection. ``synchronous=NORMAL`` is durable across
+# application crashes in WAL mode; only an OS crash can lose the last commits.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+BUSY_TIMEOUT = 5.0
+STATEMENT_CACHE_SIZE = 256
+
+
+class _Connections(threading.local):
+    def __init__(self) -> None:
+        self.by_path: Dict[str, sqlite3.Connection] = {}
+
+
+_local = _Connections()
+
+
+def _open(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Return this thread's connection to ``db_path``, opening it if needed.
+
+    The connection must not be closed by callers. Use it as a context manager
+    (``with connect(path) as conn:``) to commit or roll back a transaction.
+    """
+    key = str(db_path)
+    conn = _local.by_path.get(key)
+    if conn is None:
+        conn = _open(key)
+        _local.by_path[key] = conn
+    return conn
+
+
+def close(db_path: str) -> None:
+    """Close this thread's connection to ``db_path`` if one is open."""
+    conn = _local.by_path.pop(str(db_path), None)
+    if conn is not None:
+        conn.close()
+
+
+def close_all() -> None:
+    """Close every connection opened by the calling thread."""
+    conns = list(_local.by_path.values())
+    _local.by_path.clear()
+    for conn in conns:
+        conn.close()
+
+
+__all__ = ["connect", "close", "close_all"]
@@ -11,7 +11,7 @@ class DummyClient(StripeUsageClient):
     def __init__(self):
         pass
 
-    def create_usage_record(self, subscription_item, quantity, timestamp):
+    def create_usage_record(self, subscription_item, quantity, timestamp, idempotency_key=None):
         return {"id": f"usage-{subscription_item}-{quantity}"}
 
 
@@ -29,6 +29,45 @@ def test_sync_usage_events(tmp_path):
     assert events == []
 
 
+def test_sync_usage_events_raises_on_rejected_records(tmp_path):
+    import pytest
+
+    from token_tally.billing import StripeAPIError
+
+    class RejectingClient(DummyClient):
+        def create_usage_record(self, subscription_item, quantity, timestamp, idempotency_key=None):
+            if subscription_item == "bad":
+                raise StripeAPIError(400, b'{"error": "No such subscription item"}')
+            return {"id": f"usage-{subscription_item}"}
+
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    ledger.add_usage_event("e1", "cust", "item1", 5, 1.0, "2024-05")
+    ledger.add_usage_event("e2", "cust", "bad", 5, 1.0, "2024-05")
+    service = BillingService("sk_test", ledger)
+    service.client = RejectingClient()
+    with pytest.raises(StripeAPIError) as exc_info:
+        service.sync_usage_events()
+    assert exc_info.value.status == 400
+    assert [ev["id"] for ev in ledger.get_pending_usage_events()] == ["e2"]
+
+
+def test_retry_after_http_dates():
+    import email.utils
+    from datetime import UTC, datetime, timedelta
+
+    from token_tally.billing import _retry_after
+
+    later = datetime.now(UTC) + timedelta(seconds=30)
+    assert 25 < _retry_after(email.utils.format_datetime(later, usegmt=True)) <= 30
+    # A "-0000" zone parses to a naive datetime.
+    naive = email.utils.format_datetime(later.replace(tzinfo=None))
+    assert naive.endswith("-0000")
+    assert 25 < _retry_after(naive) <= 30
+    assert _retry_after("Wed, 21 Oct 2015 07:28:00 -0000") == 0.0
+    assert _retry_after("2") == 2.0
+    assert _retry_after("soon") is None
+
+
 def test_consolidate_invoices(tmp_path, monkeypatch):
     db = tmp_path / "ledger.db"
     ledger = Ledger(str(db))
@@ -40,7 +79,7 @@ def test_consolidate_invoices(tmp_path, monkeypatch):
     )
     service = BillingService("sk_test", ledger)
     service.client = DummyClient()
-    monkeypatch.setattr(netsuite, "push_invoice", lambda invoice: {"status": "ok"})
+    monkeypatch.setattr(netsuite, "push_invoice", lambda invoice, external_id=None: {"status": "ok"})
     invoices = service.consolidate_invoices("2024-05")
     assert invoices == [{"invoice_id": "cust-2024-05", "total": 20.0, "credit": 4.0}]
 
@@ -53,7 +92,7 @@ def test_consolidate_invoices_fx(tmp_path, monkeypatch):
     )
     service = BillingService("sk_test", ledger)
     service.client = DummyClient()
-    monkeypatch.setattr(netsuite, "push_invoice", lambda invoice: {"status": "ok"})
+    monkeypatch.setattr(netsuite, "push_invoice", lambda invoice, external_id=None: {"status": "ok"})
 
     monkeypatch.setattr(
         "token_tally.billing.get_rates",
@@ -61,3 +100,373 @@ def test_consolidate_invoices_fx(tmp_path, monkeypatch):
     )
     invoices = service.consolidate_invoices("2024-05", currency="EUR")
     assert invoices == [{"invoice_id": "cust-2024-05", "total": 18.0, "credit": 0.0}]
+
+
+def test_sync_engine_against_fake_stripe(tmp_path):
+    import threading
+    import urllib.parse
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from token_tally.billing import UsageSyncEngine
+
+    seen = {"keys": [], "ports": set(), "throttled": 0}
+    lock = threading.Lock()
+
+    class FakeStripe(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            form = urllib.parse.parse_qs(body.decode())
+            key = self.headers["Idempotency-Key"]
+            with lock:
+                seen["ports"].add(self.client_address[1])
+                throttle = seen["throttled"] < 3
+                if throttle:
+                    seen["throttled"] += 1
+                else:
+                    seen["keys"].append(key)
+            if throttle:
+                payload = b'{"error": "rate_limited"}'
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+            else:
+                payload = ('{"id": "ur_%s"}' % form["subscription_item"][0]).encode()
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeStripe)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        ledger = Ledger(str(tmp_path / "ledger.db"))
+        for i in range(25):
+            ledger.add_usage_event(f"e{i:02d}", "cust", f"item{i}", 1, 1.0, "2024-05")
+        client = StripeUsageClient(
+            "sk_test",
+            url=f"http://127.0.0.1:{server.server_port}/v1/usage_records",
+            max_connections=4,
+        )
+        engine = UsageSyncEngine(ledger, client, concurrency=4, page_size=7, flush_size=5)
+        assert engine.run() == 25
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert engine.failures == []
+    assert ledger.get_pending_usage_events() == []
+    assert len(set(seen["keys"])) == 25
+    assert all(key.startswith("usage-item") for key in seen["keys"])
+    assert len(seen["ports"]) <= 4
+    assert seen["throttled"] == 3
+
+
+def test_sync_engine_aggregates_per_item_and_hour(tmp_path):
+    import sqlite3
+
+    from token_tally.billing import UsageSyncEngine
+
+    class RecordingClient(DummyClient):
+        def __init__(self):
+            self.calls = []
+
+        def create_usage_record(self, subscription_item, quantity, timestamp, idempotency_key=None):
+            self.calls.append((subscription_item, quantity, idempotency_key))
+            return {"id": f"ur-{len(self.calls)}"}
+
+    db = tmp_path / "ledger.db"
+    ledger = Ledger(str(db))
+    stamps = {}
+    for i in range(30):
+        item = "item1" if i % 3 else "item2"
+        ledger.add_usage_event(f"e{i:02d}", "cust", item, 2, 1.0, "2024-05")
+        stamps[f"e{i:02d}"] = f"2024-05-01 {10 + i % 2:02d}:{i:02d}:00"
+    with sqlite3.connect(db) as conn:
+        conn.executemany(
+            "UPDATE usage_events SET ts = ? WHERE id = ?",
+            [(ts, eid) for eid, ts in stamps.items()],
+        )
+
+    client = RecordingClient()
+    engine = UsageSyncEngine(ledger, client, page_size=30)
+    assert engine.run() == 30
+    assert engine.records_sent == len(client.calls) == 4
+    assert sum(q for _, q, _ in client.calls) == 60
+    assert len({key for _, _, key in client.calls}) == 4
+
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute(
+            "SELECT stripe_record_id, feature, strftime('%H', ts), COUNT(*) "
+            "FROM usage_events GROUP BY stripe_record_id"
+        ).fetchall()
+    # Every record id maps back to exactly one (item, hour) group.
+    assert len(rows) == 4
+    assert sum(count for *_, count in rows) == 30
+    assert ledger.get_pending_usage_events() == []
+
+
+def test_sync_engine_reuses_stored_keys_after_failure(tmp_path):
+    import sqlite3
+
+    from token_tally.billing import UsageSyncEngine
+
+    class FlakyClient(DummyClient):
+        def __init__(self):
+            self.calls = []
+            self.down = {"item2"}
+
+        def create_usage_record(self, subscription_item, quantity, timestamp, idempotency_key=None):
+            self.calls.append((subscription_item, quantity, idempotency_key))
+            if subscription_item in self.down:
+                raise ConnectionError("stripe unavailable")
+            return {"id": f"ur-{len(self.calls)}"}
+
+    db = tmp_path / "ledger.db"
+    ledger = Ledger(str(db))
+    for i in range(6):
+        ledger.add_usage_event(f"e{i}", "cust", f"item{i % 3}", 1, 1.0, "2024-05")
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE usage_events SET ts = '2024-05-01 10:00:00'")
+
+    client = FlakyClient()
+    engine = UsageSyncEngine(ledger, client, page_size=3)
+    assert engine.run() == 4
+    # Two pages, so each item is posted once per page under distinct keys.
+    assert len(client.calls) == 6
+    assert len({key for *_, key in client.calls}) == 6
+    assert {event_id for event_id, _ in engine.failures} == {"e2", "e5"}
+    failed_keys = [key for item, _, key in client.calls if item == "item2"]
+    keyed = list(ledger.iter_keyed_pending_usage_events(page_size=1))
+    assert [ev["idempotency_key"] for ev in keyed] == sorted(failed_keys)
+
+    # New usage in the same hour is planned separately; the failed records
+    # are posted again with exactly the same keys and quantities.
+    ledger.add_usage_event("e6", "cust", "item2", 1, 1.0, "2024-05")
+    with sqlite3.connect(db) as conn:
+        conn.execute("UPDATE usage_events SET ts = '2024-05-01 10:00:00'")
+    client.down = set()
+    client.calls = []
+    assert UsageSyncEngine(ledger, client, page_size=3).run() == 3
+    retried = [(q, key) for _, q, key in client.calls if key in failed_keys]
+    assert sorted(retried) == sorted((1, key) for key in failed_keys)
+    assert len(client.calls) == 3
+    assert ledger.get_pending_usage_events() == []
+
+
+def test_consolidate_invoices_outbox_status(tmp_path, monkeypatch):
+    db = tmp_path / "ledger.db"
+    ledger = Ledger(str(db))
+    ledger.add_usage_event("e1", "b", "item1", 3, 1.0, "2024-05")
+    ledger.add_usage_event("e2", "a", "item1", 2, 1.0, "2024-05")
+    ledger.add_usage_event("e3", "b", "item1", -1, 1.0, "2024-05")
+    ledger.add_usage_event("e4", "credit-only", "item1", -5, 1.0, "2024-05")
+    service = BillingService("sk_test", ledger)
+
+    calls = {"netsuite": 0}
+
+    def flaky_netsuite(invoice, external_id=None):
+        calls["netsuite"] += 1
+        if invoice["customer_id"] == "a" and calls["netsuite"] < 3:
+            raise ConnectionError("netsuite timeout")
+        return {"status": "ok"}
+
+    def broken_quickbooks(invoice, token, request_id=None):
+        raise RuntimeError("quickbooks down")
+
+    batches = []
+
+    def broken_quickbooks_batch(invoices, token, request_id=None):
+        batches.append(len(invoices))
+        return [RuntimeError("quickbooks down") for _ in invoices]
+
+    for name in ("NETSUITE_ACCOUNT", "NETSUITE_TOKEN", "NETSUITE_SECRET"):
+        monkeypatch.setenv(name, "x")
+    monkeypatch.setenv("QUICKBOOKS_TOKEN", "tok")
+    monkeypatch.setattr(netsuite, "push_invoice", flaky_netsuite)
+    monkeypatch.setattr("token_tally.billing.send_invoice_to_quickbooks", broken_quickbooks)
+    monkeypatch.setattr(
+        "token_tally.billing.send_invoices_to_quickbooks", broken_quickbooks_batch
+    )
+    monkeypatch.setattr("token_tally.accounting.outbox.time.sleep", lambda s: None)
+
+    invoices = service.consolidate_invoices("2024-05", push_timeout=30.0)
+
+    assert invoices == [
+        {"invoice_id": "b-2024-05", "total": 3.0, "credit": 1.0},
+        {"invoice_id": "a-2024-05", "total": 2.0, "credit": 0.0},
+    ]
+    assert ledger.get_invoice_sync_status("a-2024-05") == {
+        "quickbooks": "failed",
+        "netsuite": "sent",
+    }
+    failed = ledger.get_outbox_jobs("failed")
+    assert {job["invoice_id"] for job in failed} == {"a-2024-05", "b-2024-05"}
+    assert all("quickbooks down" in job["last_error"] for job in failed)
+    assert all(job["attempts"] == 3 for job in failed)
+    # Both QuickBooks invoices travel in one batch request per attempt.
+    assert batches == [2, 2, 2]
+
+
+def test_outbox_defers_retries_past_deadline(tmp_path):
+    import sqlite3
+
+    from token_tally.accounting.outbox import AccountingOutbox
+    from token_tally.metrics import ACCOUNTING_OUTBOX_DEPTH
+
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    ledger.create_invoice(
+        "inv1", "cust", "2024-05", 10.0, outbox=[("erp", {"invoice_id": "inv1"})]
+    )
+    assert ledger.get_invoice_sync_status("inv1") == {"erp": "pending"}
+
+    attempts = []
+
+    def flaky(payload):
+        attempts.append(payload["invoice_id"])
+        if len(attempts) == 1:
+            raise ConnectionError("erp unavailable")
+
+    outbox = AccountingOutbox(ledger, {"erp": flaky}, backoff=60.0)
+    counts = outbox.drain(timeout=1.0)
+    assert counts == {"sent": 0, "failed": 0, "deferred": 1, "in_progress": 0}
+    assert ACCOUNTING_OUTBOX_DEPTH.labels("erp")._value.get() == 1
+    # Still backing off, so an immediate drain does not retry it.
+    assert outbox.drain()["sent"] == 0
+    assert attempts == ["inv1"]
+
+    with sqlite3.connect(ledger.db_path) as conn:
+        conn.execute("UPDATE accounting_outbox SET next_attempt_at = 0")
+    assert outbox.drain()["sent"] == 1
+    assert ledger.get_invoice_sync_status("inv1") == {"erp": "sent"}
+    assert ACCOUNTING_OUTBOX_DEPTH.labels("erp")._value.get() == 0
+
+
+def test_overlapping_drains_post_each_job_once(tmp_path):
+    import threading
+    import time
+
+    from token_tally.accounting.outbox import AccountingOutbox, Destination
+
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    for inv in ("inv1", "inv2", "inv3"):
+        ledger.create_invoice(
+            inv, "cust", "2024-05", 10.0, outbox=[("erp", {"invoice_id": inv})]
+        )
+
+    release = threading.Event()
+    lock = threading.Lock()
+    posts = []
+    active = [0, 0]
+
+    def slow(payload):
+        with lock:
+            posts.append(payload["invoice_id"])
+            active[0] += 1
+            active[1] = max(active)
+        release.wait(5)
+        with lock:
+            active[0] -= 1
+
+    dest = Destination(slow, concurrency=1)
+    first = AccountingOutbox(ledger, {"erp": dest}).drain(timeout=0.2)
+    assert first["sent"] == 0 and first["in_progress"] == 1
+    # The first drain's worker still holds inv1; a second drain must skip it.
+    second = threading.Thread(target=AccountingOutbox(ledger, {"erp": dest}).drain)
+    second.start()
+    time.sleep(0.2)
+    release.set()
+    second.join(5)
+    deadline = time.monotonic() + 5
+    while ledger.count_outbox_jobs("sent").get("erp") != 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    assert sorted(posts) == ["inv1", "inv2", "inv3"]
+    assert active[1] == 1
+
+
+def test_drain_leaves_unstarted_batches_pending(tmp_path):
+    import threading
+    import time
+
+    from token_tally.accounting.outbox import AccountingOutbox, Destination
+
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    for inv in ("inv1", "inv2"):
+        ledger.create_invoice(
+            inv, "cust", "2024-05", 10.0, outbox=[("slow-erp", {"invoice_id": inv})]
+        )
+    release = threading.Event()
+    posts = []
+
+    def slow(payload):
+        posts.append(payload["invoice_id"])
+        release.wait(5)
+
+    outbox = AccountingOutbox(ledger, {"slow-erp": Destination(slow, concurrency=1)})
+    counts = outbox.drain(timeout=0.2)
+    assert counts["in_progress"] == 1
+    release.set()
+    deadline = time.monotonic() + 5
+    while ledger.count_outbox_jobs("sent").get("slow-erp") != 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert posts == ["inv1"]
+    assert ledger.get_invoice_sync_status("inv2") == {"slow-erp": "pending"}
+
+
+def test_outbox_resends_with_stable_request_ids(tmp_path, monkeypatch):
+    from token_tally.accounting.outbox import AccountingOutbox, Destination
+
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    for inv in ("inv1", "inv2"):
+        ledger.create_invoice(
+            inv, "cust", "2024-05", 10.0, outbox=[("erp", {"invoice_id": inv})]
+        )
+    seen = []
+
+    def timing_out(payload, request_id):
+        seen.append((payload["invoice_id"], request_id))
+        if len(seen) <= 2:
+            raise TimeoutError("erp timed out after creating the invoice")
+
+    sleeps = []
+    monkeypatch.setattr("token_tally.accounting.outbox.time.sleep", sleeps.append)
+    outbox = AccountingOutbox(
+        ledger,
+        {"erp": Destination(timing_out, request_ids=True)},
+        backoff=1000.0,
+        lease_seconds=40.0,
+    )
+    assert outbox.drain()["sent"] == 2
+    # In-place retries never sleep past the lease they hold.
+    assert sleeps and max(sleeps) <= 10.0
+    ids = {}
+    for invoice_id, request_id in seen:
+        ids.setdefault(invoice_id, set()).add(request_id)
+    assert all(len(v) == 1 for v in ids.values())
+    assert ids["inv1"] != ids["inv2"]
+
+
+def test_outbox_claims_and_requeues_by_lease(tmp_path):
+    import time
+
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    ledger.create_invoice("inv1", "cust", "2024-05", 10.0, outbox=[("erp", {"v": 1})])
+    [job] = ledger.get_outbox_jobs("pending")
+    assert ledger.claim_outbox_jobs([job["id"]], time.time() + 60) == [job["id"]]
+    assert ledger.claim_outbox_jobs([job["id"]], time.time() + 60) == []
+    # Re-queuing leaves a job with a live lease to its worker ...
+    ledger.create_invoice("inv1", "cust", "2024-05", 10.0, outbox=[("erp", {"v": 2})])
+    assert ledger.get_invoice_sync_status("inv1") == {"erp": "in_progress"}
+    # ... but takes it back once the lease has expired.
+    ledger.update_outbox_job(job["id"], "in_progress", 1, lease_until=time.time() - 1)
+    ledger.create_invoice("inv1", "cust", "2024-05", 10.0, outbox=[("erp", {"v": 3})])
+    [job] = ledger.get_outbox_jobs("pending")
+    assert job["payload"] == {"v": 3} and job["attempts"] == 0
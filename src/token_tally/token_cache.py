@@ -0,0 +1,82 @@
+"""Bounded LRU cache for token counts keyed by a hash of the text."""
+
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Optional, Tuple
+
+from .metrics import TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES
+
+CacheKey = Tuple[str, bytes]
+
+# Rough per-entry cost of the OrderedDict slot and key tuple, in bytes.
+_ENTRY_OVERHEAD = 160
+
+
+class TokenCountCache:
+    """LRU cache mapping ``(provider, hash(text))`` to a token count.
+
+    Only a 16-byte digest of each text is kept, never the text itself.
+    Entries are evicted least-recently-used first once either ``max_entries``
+    or the estimated ``max_bytes`` footprint is exceeded.
+    """
+
+    def __init__(self, max_entries: int = 100_000, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[CacheKey, int] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(provider: str, text: str) -> CacheKey:
+        digest = blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16)
+        return (provider, digest.digest())
+
+    @staticmethod
+    def _entry_size(key: CacheKey, count: int) -> int:
+        return _ENTRY_OVERHEAD + sys.getsizeof(key[1]) + sys.getsizeof(count)
+
+    def get(self, key: CacheKey) -> Optional[int]:
+        with self._lock:
+            count = self._data.get(key)
+            if count is not None:
+                self._data.move_to_end(key)
+        if count is None:
+            TOKEN_CACHE_MISSES.inc()
+        else:
+            TOKEN_CACHE_HITS.inc()
+        return count
+
+    def put(self, key: CacheKey, count: int) -> None:
+        size = self._entry_size(key, count)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= self._entry_size(key, old)
+            self._data[key] = count
+            self._bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                old_key, old_count = self._data.popitem(last=False)
+                self._bytes -= self._entry_size(old_key, old_count)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def size_bytes(self) -> int:
+        """Estimated memory held by cached entries."""
+        return self._bytes
+
+
+__all__ = ["TokenCountCache"]
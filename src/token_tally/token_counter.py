@@ -8,33 +8,17 @@ approximation so the helpers remain dependency-free.
 from __future__ import annotations
 
 import re
-from .metrics import TOKEN_COUNTER
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from datetime import datetime, UTC
+from typing import Any, Callable, Iterable, Optional, Sequence
 
-try:
-    from opentelemetry import trace
-except Exception:  # pragma: no cover - opentelemetry optional
-
-    class _DummySpan:
-        def __enter__(self):
-            return self
-
-        def __exit__(self, *exc: object) -> None:
-            pass
-
-        def set_attribute(self, *args: object, **kwargs: object) -> None:
-            pass
-
-    class _DummyTracer:
-        def start_as_current_span(self, name: str) -> _DummySpan:
-            return _DummySpan()
+from .metrics import TOKEN_COUNT_SECONDS, TOKEN_COUNTER, timed
+from .token_cache import TokenCountCache
+from .tracing import get_tracer
 
-    class _TraceModule:
-        def get_tracer(self, name: str | None = None) -> _DummyTracer:
-            return _DummyTracer()
-
-    trace = _TraceModule()  # type: ignore
-
-tracer = trace.get_tracer(__name__)
+tracer = get_tracer(__name__)
 
 try:  # Optional; only used if installed
     import tiktoken
@@ -44,12 +28,38 @@ except Exception:  # pragma: no cover - missing optional dependency
     tiktoken = None
     _openai_encoding = None
 
+try:  # tiktoken's pre-tokeniser pattern needs the ``regex`` module
+    import regex as _regex_mod
+
+    _openai_pieces = _regex_mod.compile(_openai_encoding._pat_str)
+except Exception:  # pragma: no cover - missing optional dependency
+    _openai_pieces = None
+
 try:
     from anthropic import count_tokens as _anthropic_count_tokens
 except Exception:  # pragma: no cover - missing optional dependency
     _anthropic_count_tokens = None
 
+try:
+    import ollama  # type: ignore
+
+    _ollama_tokenize = getattr(ollama, "tokenize", None)
+    if not callable(_ollama_tokenize):
+        _ollama_tokenize = None
+except Exception:  # pragma: no cover - missing optional dependency
+    _ollama_tokenize = None
+
 _WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_WORD_CHAR_RE = re.compile(r"\w", re.UNICODE)
+_WORD_RUN_RE = re.compile(r"\w*", re.UNICODE)
+
+# Long texts are counted in windows of this many characters so only one
+# window's worth of token strings is alive at a time.
+_COUNT_WINDOW = 1 << 16
+
+# Batches at least this large are split across a process pool.
+BATCH_PROCESS_THRESHOLD = 20_000
+_BATCH_CHUNK_SIZE = 2_000
 
 
 def _regex_split(text: str) -> list[str]:
@@ -57,93 +67,142 @@ def _regex_split(text: str) -> list[str]:
     return _WORD_RE.findall(text)
 
 
-def count_openai_tokens(text: str) -> int:
-    """Token count for OpenAI models using ``tiktoken`` when available."""
-    with tracer.start_as_current_span("count_openai_tokens") as span:
-        if _openai_encoding is not None:
-            try:
-                count = len(_openai_encoding.encode(text))
-            except Exception:  # pragma: no cover - defensive
-                count = len(_regex_split(text))
+def _regex_count(text: str) -> int:
+    """Return ``len(_regex_split(text))`` with memory bounded by the window.
+
+    Windows are cut only where no ``\\w+`` run spans the cut, so counts are
+    identical to splitting the whole text.
+    """
+    n = len(text)
+    count = 0
+    start = 0
+    while start < n:
+        end = start + _COUNT_WINDOW
+        if end >= n:
+            end = n
         else:
-            count = len(_regex_split(text))
-        try:
-            span.set_attribute("tokens", count)
-        except Exception:  # pragma: no cover - span may be dummy
-            pass
-    TOKEN_COUNTER.inc(count)
+            cut = end
+            while (
+                cut > start
+                and _WORD_CHAR_RE.match(text, cut - 1)
+                and _WORD_CHAR_RE.match(text, cut)
+            ):
+                cut -= 1
+            if cut == start:  # a single word fills the window
+                cut = _WORD_RUN_RE.match(text, end).end()
+            end = cut
+        count += len(_WORD_RE.findall(text, start, end))
+        start = end
     return count
 
 
-def count_anthropic_tokens(text: str) -> int:
-    """Token count for Anthropic models using ``anthropic`` when available."""
-    with tracer.start_as_current_span("count_anthropic_tokens") as span:
-        if _anthropic_count_tokens is not None:
-            try:
-                count = _anthropic_count_tokens(text)
-            except Exception:  # pragma: no cover - defensive
-                count = len(_regex_split(text))
-        else:
-            count = len(_regex_split(text))
-        try:
-            span.set_attribute("tokens", count)
-        except Exception:  # pragma: no cover - span may be dummy
-            pass
-    TOKEN_COUNTER.inc(count)
-    return count
+# Raw counters: no tracing or metrics, safe to run in worker processes.
 
 
-def count_cohere_tokens(text: str) -> int:
-    """Token count for Cohere models using a regex-based approximation."""
-    with tracer.start_as_current_span("count_cohere_tokens") as span:
-        count = len(_regex_split(text))
+def _openai_count(text: str) -> int:
+    if _openai_encoding is not None:
         try:
-            span.set_attribute("tokens", count)
-        except Exception:  # pragma: no cover - span may be dummy
+            return len(_openai_encoding.encode(text))
+        except Exception:  # pragma: no cover - defensive
             pass
-    TOKEN_COUNTER.inc(count)
-    return count
+    return _regex_count(text)
 
 
-def count_local_tokens(text: str) -> int:
-    """Token count for local models using a simple whitespace split."""
-    with tracer.start_as_current_span("count_local_tokens") as span:
-        count = len(text.split())
+def _anthropic_count(text: str) -> int:
+    if _anthropic_count_tokens is not None:
         try:
-            span.set_attribute("tokens", count)
-        except Exception:  # pragma: no cover - span may be dummy
+            return _anthropic_count_tokens(text)
+        except Exception:  # pragma: no cover - defensive
             pass
-    TOKEN_COUNTER.inc(count)
-    return count
+    return _regex_count(text)
 
 
-def count_ollama_tokens(text: str) -> int:
-    """Token count for Ollama models using a regex split fallback."""
-    with tracer.start_as_current_span("count_ollama_tokens") as span:
-        count = len(_regex_split(text))
-        try:
-            import importlib
+def _cohere_count(text: str) -> int:
+    return _regex_count(text)
 
-            if importlib.util.find_spec("ollama"):
-                import ollama  # type: ignore
 
-                tokenize = getattr(ollama, "tokenize", None)
-                if callable(tokenize):
-                    try:
-                        count = len(tokenize(text))
-                    except Exception:
-                        count = len(_regex_split(text))
-        except Exception:  # pragma: no cover - defensive
-            count = len(_regex_split(text))
+def _local_count(text: str) -> int:
+    return len(text.split())
 
+
+def _ollama_count(text: str) -> int:
+    if _ollama_tokenize is not None:
         try:
-            span.set_attribute("tokens", count)
-        except Exception:  # pragma: no cover - span may be dummy
+            return len(_ollama_tokenize(text))
+        except Exception:
             pass
+    return _regex_count(text)
+
+
+_cache: Optional[TokenCountCache] = None
+
+
+def enable_token_cache(
+    max_entries: int = 100_000, max_bytes: int = 32 * 1024 * 1024
+) -> TokenCountCache:
+    """Cache token counts by content hash and return the new cache.
+
+    Caching is off by default. Repeated texts such as system prompts are
+    then counted once until evicted.
+    """
+    global _cache
+    _cache = TokenCountCache(max_entries=max_entries, max_bytes=max_bytes)
+    return _cache
+
+
+def disable_token_cache() -> None:
+    """Stop caching token counts."""
+    global _cache
+    _cache = None
+
+
+def _cached_count(provider: str, text: str) -> int:
+    counter = _RAW_COUNTERS[provider]
+    cache = _cache
+    if cache is None:
+        return counter(text)
+    key = cache.key(provider, text)
+    count = cache.get(key)
+    if count is None:
+        count = counter(text)
+        cache.put(key, count)
+    return count
+
+
+def _traced_count(name: str, provider: str, text: str) -> int:
+    with tracer.span(name) as span:
+        with timed(TOKEN_COUNT_SECONDS, provider):
+            count = _cached_count(provider, text)
+        span.set_attribute("tokens", count)
     TOKEN_COUNTER.inc(count)
     return count
 
 
+def count_openai_tokens(text: str) -> int:
+    """Token count for OpenAI models using ``tiktoken`` when available."""
+    return _traced_count("count_openai_tokens", "openai", text)
+
+
+def count_anthropic_tokens(text: str) -> int:
+    """Token count for Anthropic models using ``anthropic`` when available."""
+    return _traced_count("count_anthropic_tokens", "anthropic", text)
+
+
+def count_cohere_tokens(text: str) -> int:
+    """Token count for Cohere models using a regex-based approximation."""
+    return _traced_count("count_cohere_tokens", "cohere", text)
+
+
+def count_local_tokens(text: str) -> int:
+    """Token count for local models using a simple whitespace split."""
+    return _traced_count("count_local_tokens", "local", text)
+
+
+def count_ollama_tokens(text: str) -> int:
+    """Token count for Ollama models using a regex split fallback."""
+    return _traced_count("count_ollama_tokens", "ollama", text)
+
+
 _PROVIDER_MAP = {
     "openai": count_openai_tokens,
     "anthropic": count_anthropic_tokens,
@@ -151,6 +210,14 @@ _PROVIDER_MAP = {
     "ollama": count_ollama_tokens,
 }
 
+_RAW_COUNTERS: dict[str, Callable[[str], int]] = {
+    "openai": _openai_count,
+    "anthropic": _anthropic_count,
+    "cohere": _cohere_count,
+    "ollama": _ollama_count,
+    "local": _local_count,
+}
+
 
 def count_tokens(provider: str, text: str) -> int:
     """Count tokens for a given provider name.
@@ -161,6 +228,235 @@ def count_tokens(provider: str, text: str) -> int:
     return func(text)
 
 
+def _regex_joins(left: str, right: str) -> bool:
+    return bool(_WORD_CHAR_RE.match(left[-1]) and _WORD_CHAR_RE.match(right[0]))
+
+
+def _whitespace_joins(left: str, right: str) -> bool:
+    return not left[-1].isspace() and not right[0].isspace()
+
+
+def _boundary_rule(provider: str) -> Optional[Callable[[str, str], bool]]:
+    """Return whether two texts merge a token at their seam, if predictable.
+
+    Only the regex and whitespace fallbacks qualify; vendor tokenisers can
+    re-segment text around the seam.
+    """
+    if provider == "local":
+        return _whitespace_joins
+    if provider == "cohere":
+        return _regex_joins
+    if provider == "openai" and _openai_encoding is None:
+        return _regex_joins
+    if provider == "anthropic" and _anthropic_count_tokens is None:
+        return _regex_joins
+    if provider == "ollama" and _ollama_tokenize is None:
+        return _regex_joins
+    return None
+
+
+def count_tokens_with_prefix(provider: str, prefix: str, suffix: str) -> int:
+    """Count tokens of ``prefix + suffix`` without re-tokenising ``prefix``.
+
+    When the provider's tokeniser allows it, the prefix count comes from the
+    token cache (see :func:`enable_token_cache`) and only ``suffix`` is
+    tokenised. Otherwise the concatenated text is counted.
+    """
+    key = provider.lower()
+    if key not in _RAW_COUNTERS:
+        key = "local"
+    with tracer.span("count_tokens_with_prefix") as span:
+        joins = _boundary_rule(key)
+        if joins is None or not prefix or not suffix:
+            count = _cached_count(key, prefix + suffix)
+        else:
+            count = _cached_count(key, prefix) + _RAW_COUNTERS[key](suffix)
+            if joins(prefix, suffix):
+                count -= 1
+        span.set_attribute("tokens", count)
+    TOKEN_COUNTER.inc(count)
+    return count
+
+
+def _split_whitespace(text: str) -> tuple[int, str]:
+    """Count words that cannot grow any further and return the rest."""
+    cut = len(text)
+    while cut and not text[cut - 1].isspace():
+        cut -= 1
+    return len(text[:cut].split()), text[cut:]
+
+
+def _split_regex(text: str) -> tuple[int, str]:
+    """Count regex tokens except a trailing word run that may continue."""
+    cut = len(text)
+    while cut and _WORD_CHAR_RE.match(text[cut - 1]):
+        cut -= 1
+    return _regex_count(text[:cut]), text[cut:]
+
+
+def _split_tiktoken(text: str) -> tuple[int, str]:
+    """Encode all but the last two pre-tokeniser pieces.
+
+    BPE never merges across pieces, and later input can only re-segment the
+    pieces at the very end, so the earlier ones are final.
+    """
+    starts = [m.start() for m in _openai_pieces.finditer(text)]
+    if len(starts) <= 2:
+        return 0, text
+    cut = starts[-2]
+    return len(_openai_encoding.encode(text[:cut])), text[cut:]
+
+
+class TokenCounterStream:
+    """Incrementally count tokens of a streamed completion.
+
+    Feed chunks as they arrive with :meth:`feed`. Only the trailing text that
+    a later chunk could still change is buffered: the last word for the
+    regex and whitespace fallbacks, the last two pre-tokeniser pieces for
+    ``tiktoken``. Memory therefore does not grow with the response. Vendor
+    tokenisers that cannot be split (the ``anthropic`` SDK, ``ollama``)
+    buffer the whole text.
+
+    :meth:`finish` returns the same number :func:`count_tokens` gives for
+    the concatenated chunks. If ``ledger`` and ``event`` are provided, it
+    also records a ``UsageEvent`` built from the ``event`` fields with the
+    final count as ``units``.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        *,
+        ledger: Any = None,
+        event: Optional[dict] = None,
+    ) -> None:
+        key = provider.lower()
+        if key not in _RAW_COUNTERS:
+            key = "local"
+        self.provider = key
+        self.ledger = ledger
+        self.event = dict(event or {})
+        self._count = 0
+        self._tail = ""
+        self._finished = False
+        if key == "local":
+            self._split: Optional[Callable[[str], tuple[int, str]]] = _split_whitespace
+        elif _boundary_rule(key) is not None:
+            self._split = _split_regex
+        elif key == "openai" and _openai_pieces is not None:
+            self._split = _split_tiktoken
+        else:
+            self._split = None
+        # ``count_openai_tokens`` falls back to the regex count when tiktoken
+        # rejects special tokens, so track that count alongside.
+        self._fallback: Optional[TokenCounterStream] = None
+        if self._split is _split_tiktoken:
+            self._fallback = TokenCounterStream("cohere")
+
+    def feed(self, chunk: str) -> None:
+        """Add the next chunk of streamed text."""
+        if self._finished:
+            raise RuntimeError("stream already finished")
+        if self._fallback is not None:
+            self._fallback.feed(chunk)
+        text = self._tail + chunk
+        if self._split is None:
+            self._tail = text
+            return
+        try:
+            count, self._tail = self._split(text)
+        except Exception:
+            self._use_fallback()
+            return
+        self._count += count
+
+    def _use_fallback(self) -> None:
+        fallback = self._fallback
+        assert fallback is not None
+        self._split = fallback._split
+        self._count = fallback._count
+        self._tail = fallback._tail
+        self._fallback = None
+
+    @property
+    def count(self) -> int:
+        """Tokens counted so far, excluding the still-buffered tail."""
+        return self._count
+
+    def finish(self) -> int:
+        """Count the buffered tail and return the total for the stream."""
+        if self._finished:
+            return self._count
+        with tracer.span("TokenCounterStream.finish") as span:
+            try:
+                if self._split is _split_tiktoken:
+                    tail = len(_openai_encoding.encode(self._tail))
+                else:
+                    tail = _RAW_COUNTERS[self.provider](self._tail)
+            except Exception:
+                self._use_fallback()
+                tail = _RAW_COUNTERS[self.provider](self._tail)
+            self._count += tail
+            self._tail = ""
+            self._finished = True
+            span.set_attribute("tokens", self._count)
+        TOKEN_COUNTER.inc(self._count)
+        if self.ledger is not None:
+            from .usage_ledger import UsageEvent
+
+            fields = {
+                "ts": datetime.now(UTC),
+                "provider": self.provider,
+                "metric_type": "tokens",
+                **self.event,
+                "units": self._count,
+            }
+            self.ledger.add_event(UsageEvent(**fields))
+        return self._count
+
+
+def _count_batch_raw(provider: str, texts: Sequence[str]) -> list[int]:
+    if provider == "openai" and _openai_encoding is not None:
+        try:
+            return [len(tokens) for tokens in _openai_encoding.encode_batch(list(texts))]
+        except Exception:
+            pass  # e.g. a special token in one text; count individually
+    counter = _RAW_COUNTERS.get(provider, _local_count)
+    return [counter(text) for text in texts]
+
+
+def count_tokens_batch(
+    provider: str, texts: Iterable[str], *, processes: Optional[int] = None
+) -> array:
+    """Count tokens for many texts at once.
+
+    Returns an ``array('q')`` with one count per text, equal to what
+    :func:`count_tokens` returns for each. OpenAI texts use ``tiktoken``'s
+    batch encoder. Batches of at least ``BATCH_PROCESS_THRESHOLD`` texts are
+    spread over a process pool of ``processes`` workers (CPU count by default);
+    pass ``processes=1`` to stay in-process. One span and one
+    ``TOKEN_COUNTER`` update are recorded per batch.
+    """
+    key = provider.lower()
+    batch = texts if isinstance(texts, (list, tuple)) else list(texts)
+    with tracer.batch_span("count_tokens_batch", len(batch), provider=key) as span:
+        if processes != 1 and len(batch) >= BATCH_PROCESS_THRESHOLD:
+            chunks = [
+                batch[i : i + _BATCH_CHUNK_SIZE]
+                for i in range(0, len(batch), _BATCH_CHUNK_SIZE)
+            ]
+            counts = array("q")
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                for part in pool.map(_count_batch_raw, repeat(key), chunks):
+                    counts.extend(part)
+        else:
+            counts = array("q", _count_batch_raw(key, batch))
+        total = sum(counts)
+        span.set_attribute("tokens", total)
+    TOKEN_COUNTER.inc(total)
+    return counts
+
+
 __all__ = [
     "count_openai_tokens",
     "count_anthropic_tokens",
@@ -168,4 +464,9 @@ __all__ = [
     "count_ollama_tokens",
     "count_local_tokens",
     "count_tokens",
+    "count_tokens_batch",
+    "count_tokens_with_prefix",
+    "TokenCounterStream",
+    "enable_token_cache",
+    "disable_token_cache",
 ]
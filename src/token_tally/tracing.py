@@ -0,0 +1,229 @@
+"""Shared OpenTelemetry tracing shim with head sampling.
+
+Modules get a tracer once at import time and open spans with keyword
+attributes::
+
+    tracer = get_tracer(__name__)
+
+    with tracer.span("Ledger.add_usage_event", event_id=event_id) as span:
+        ...
+        span.set_attribute("failures", len(failures))
+
+When tracing is disabled (``opentelemetry`` missing, ``OTEL_SDK_DISABLED``
+set, or a sample rate of 0) :meth:`Tracer.span` checks one attribute and
+returns a shared no-op span, so instrumented hot paths pay no more than a
+method call.
+
+Sampling is decided once per trace, at the outermost token_tally span: when
+that span is not sampled, nothing below it is recorded either. Unsampled
+spans are shared singletons too; no backend span or scope is created. Bulk APIs
+open a single :meth:`Tracer.batch_span` carrying ``batch.size``; per-item
+spans inside it are suppressed so a batch of 10k events yields one span.
+
+The sample rate is read from ``TOKEN_TALLY_TRACE_SAMPLE_RATE`` (default
+``1.0``; invalid values are logged and ignored) and can be changed at
+runtime with :func:`configure`.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from contextvars import ContextVar
+from random import random as _random
+from typing import Any, Optional
+
+try:
+    from opentelemetry import trace as _otel_trace
+except Exception:  # pragma: no cover - opentelemetry optional
+    _otel_trace = None
+
+# Trace state of the current context: None outside any token_tally span,
+# True inside a sampled span, False inside an unsampled or batch span.
+_RECORDING: ContextVar[Optional[bool]] = ContextVar("token_tally_tracing", default=None)
+
+_UNSET: Any = object()
+
+logger = logging.getLogger(__name__)
+
+
+class _NoopSpan:
+    """Stand-in span for disabled, unsampled and suppressed spans."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type: object, exc: object, tb: object) -> None:
+        return None
+
+    def set_attribute(self, key: str, value: object) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict) -> None:
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Scope:
+    """Run a span with the trace state set to ``recording`` inside it."""
+
+    __slots__ = ("_cm", "_recording", "_token")
+
+    def __init__(self, cm: Any, recording: bool) -> None:
+        self._cm = cm
+        self._recording = recording
+
+    def __enter__(self) -> Any:
+        span = self._cm.__enter__()
+        self._token = _RECORDING.set(self._recording)
+        return span
+
+    def __exit__(self, *exc: object) -> Any:
+        _RECORDING.reset(self._token)
+        return self._cm.__exit__(*exc)
+
+
+class _UnsampledSpan(_NoopSpan):
+    """Root of an unsampled trace: no span, and no spans below it.
+
+    Only entered outside any token_tally span, so leaving it restores the
+    state to ``None`` without keeping a token; one instance serves all
+    threads and tasks.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_UnsampledSpan":
+        _RECORDING.set(False)
+        return self
+
+    def __exit__(self, exc_type: object, exc: object, tb: object) -> None:
+        _RECORDING.set(None)
+
+
+_UNSAMPLED_SPAN = _UnsampledSpan()
+
+
+class _Config:
+    __slots__ = ("backend", "sample_rate", "enabled", "generation")
+
+    def __init__(self) -> None:
+        self.backend: Any = None
+        self.sample_rate = 1.0
+        self.enabled = False
+        self.generation = 0
+
+
+_config = _Config()
+
+
+def configure(*, sample_rate: Optional[float] = None, backend: Any = _UNSET) -> None:
+    """Change the head-sampling rate or tracer backend at runtime.
+
+    ``sample_rate`` is the fraction of traces recorded, from 0 (tracing off)
+    to 1 (every call). ``backend`` is anything with a ``get_tracer(name)``
+    method, such as ``opentelemetry.trace`` or a ``TracerProvider``; pass
+    ``None`` to disable tracing entirely.
+    """
+    if sample_rate is not None:
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        _config.sample_rate = float(sample_rate)
+    if backend is not _UNSET:
+        _config.backend = backend
+    _config.enabled = _config.backend is not None and _config.sample_rate > 0
+    _config.generation += 1
+
+
+def is_enabled() -> bool:
+    return _config.enabled
+
+
+class Tracer:
+    """Per-module tracer returned by :func:`get_tracer`."""
+
+    __slots__ = ("name", "_tracer", "_generation")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._tracer: Any = None
+        self._generation = -1
+
+    def span(self, name: str, **attributes: Any) -> Any:
+        """Return a context manager for a span named ``name``."""
+        if not _config.enabled:
+            return NOOP_SPAN
+        state = _RECORDING.get()
+        if state is False:
+            return NOOP_SPAN
+        if state is None and _config.sample_rate < 1.0 and _random() >= _config.sample_rate:
+            return _UNSAMPLED_SPAN
+        return self._start(name, attributes, state, True)
+
+    def batch_span(self, name: str, size: int, **attributes: Any) -> Any:
+        """Like :meth:`span` for a bulk call over ``size`` items.
+
+        Spans opened inside it are not recorded.
+        """
+        if not _config.enabled:
+            return NOOP_SPAN
+        state = _RECORDING.get()
+        if state is False:
+            return NOOP_SPAN
+        if state is None and _config.sample_rate < 1.0 and _random() >= _config.sample_rate:
+            return _UNSAMPLED_SPAN
+        attributes["batch.size"] = size
+        return self._start(name, attributes, state, False)
+
+    def _start(self, name: str, attributes: dict, state: Optional[bool], children: bool) -> Any:
+        if self._generation != _config.generation:
+            self._tracer = _config.backend.get_tracer(self.name)
+            self._generation = _config.generation
+        cm = self._tracer.start_as_current_span(name, attributes=attributes or None)
+        if state is True and children:
+            return cm
+        return _Scope(cm, children)
+
+
+def get_tracer(name: str) -> Tracer:
+    return Tracer(name)
+
+
+def _sample_rate_from_env() -> Optional[float]:
+    value = os.getenv("TOKEN_TALLY_TRACE_SAMPLE_RATE")
+    if not value:
+        return None
+    try:
+        rate = float(value)
+    except ValueError:
+        rate = float("nan")
+    if not 0.0 <= rate <= 1.0:
+        # A typo in the environment must not stop the service importing.
+        logger.warning(
+            "Ignoring invalid TOKEN_TALLY_TRACE_SAMPLE_RATE=%r; using %s",
+            value,
+            _config.sample_rate,
+        )
+        return None
+    return rate
+
+
+def _configure_from_env() -> None:
+    disabled = os.getenv("OTEL_SDK_DISABLED", "").lower() == "true"
+    configure(
+        sample_rate=_sample_rate_from_env(),
+        backend=None if disabled else _otel_trace,
+    )
+
+
+_configure_from_env()
+
+
+__all__ = ["NOOP_SPAN", "Tracer", "configure", "get_tracer", "is_enabled"]
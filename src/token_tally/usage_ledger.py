@@ -1,42 +1,24 @@
 """Usage event ledger with optional Kafka streaming."""
 
+from concurrent.futures import Future
 from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta, UTC
 from typing import Optional, Iterable, Any
+import argparse
 import os
 import json
+import queue
 import sqlite3
+import threading
+import time
 
-try:
-    from opentelemetry import trace
-except Exception:  # pragma: no cover - optional
-
-    class _DummySpan:
-        def __enter__(self):
-            return self
-
-        def __exit__(self, *exc: object) -> None:
-            pass
-
-        def set_attribute(self, *args: object, **kwargs: object) -> None:
-            pass
-
-    class _DummyTracer:
-        def start_as_current_span(self, name: str) -> _DummySpan:
-            return _DummySpan()
-
-    class _TraceModule:
-        def get_tracer(self, name: str | None = None) -> _DummyTracer:
-            return _DummyTracer()
-
-    trace = _TraceModule()  # type: ignore
-
-tracer = trace.get_tracer(__name__)
+from . import migrations
+from . import sqlite_pool
+from .kafka_publisher import EventPublisher, build_producer
+from .metrics import OPERATION_SECONDS, timed
+from .tracing import get_tracer
 
-try:
-    from kafka import KafkaProducer
-except ImportError:  # pragma: no cover - kafka-python not installed
-    KafkaProducer = None  # type: ignore
+tracer = get_tracer(__name__)
 
 try:
     from clickhouse_driver import Client
@@ -54,6 +36,105 @@ class UsageEvent:
     metric_type: str
     units: float
     unit_cost_usd: float
+    region: Optional[str] = None
+
+
+_INSERT_EVENT_SQL = """
+    INSERT INTO usage_events (
+        event_id, ts, customer_id, provider, model,
+        metric_type, units, unit_cost_usd
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_REGION_EVENT_SQL = """
+    INSERT INTO usage_events (
+        event_id, ts, customer_id, provider, model,
+        metric_type, units, unit_cost_usd, region
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_UPSERT_HOURLY_SQL = """
+    INSERT INTO usage_hourly (
+        hour, customer_id, provider, model, region, units, cost, events
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (hour, customer_id, provider, model, region) DO UPDATE SET
+        units = units + excluded.units,
+        cost = cost + excluded.cost,
+        events = events + excluded.events
+"""
+
+# Buckets raw ISO timestamps the same way as ``_hour_bucket``; SQLite
+# normalises any UTC offset and treats naive timestamps as UTC.
+_REBUILD_HOURLY_SQL = """
+    INSERT INTO usage_hourly (
+        hour, customer_id, provider, model, region, units, cost, events
+    )
+    SELECT
+        strftime('%Y-%m-%dT%H:00:00+00:00', ts),
+        customer_id, provider, model, {region},
+        SUM(units), SUM(units * unit_cost_usd), COUNT(*)
+    FROM usage_events
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+_CREATE_HOURLY_SQL = """
+    CREATE TABLE IF NOT EXISTS usage_hourly (
+        hour TEXT NOT NULL,
+        customer_id TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        model TEXT NOT NULL,
+        region TEXT NOT NULL DEFAULT '',
+        units REAL NOT NULL,
+        cost REAL NOT NULL,
+        events INTEGER NOT NULL,
+        PRIMARY KEY (hour, customer_id, provider, model, region)
+    )
+"""
+
+
+def _event_row(event: UsageEvent) -> tuple:
+    return (
+        event.event_id,
+        event.ts.isoformat(),
+        event.customer_id,
+        event.provider,
+        event.model,
+        event.metric_type,
+        event.units,
+        event.unit_cost_usd,
+    )
+
+
+def _hour_bucket(ts: datetime) -> str:
+    """Return the UTC hour containing ``ts``; naive values are taken as UTC."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(UTC)
+    return ts.strftime("%Y-%m-%dT%H:00:00+00:00")
+
+
+def _hourly_rows(events: Iterable[UsageEvent], with_region: bool) -> list[tuple]:
+    """Collapse ``events`` into one rollup delta per hour bucket and key.
+
+    Regions are only kept when ``usage_events`` can store them; otherwise
+    :meth:`UsageLedger.rebuild_rollup` could not reproduce the same rows.
+    """
+    buckets: dict[tuple, list[float]] = {}
+    for event in events:
+        key = (
+            _hour_bucket(event.ts),
+            event.customer_id,
+            event.provider,
+            event.model,
+            (event.region or "") if with_region else "",
+        )
+        acc = buckets.get(key)
+        if acc is None:
+            acc = buckets[key] = [0.0, 0.0, 0]
+        acc[0] += event.units
+        acc[1] += event.units * event.unit_cost_usd
+        acc[2] += 1
+    return [key + tuple(acc) for key, acc in buckets.items()]
 
 
 class UsageLedger:
@@ -65,20 +146,36 @@ class UsageLedger:
         kafka_servers: Optional[Iterable[str]] = None,
         kafka_topic: str = "usage_events",
         dead_letter_topic: str = "dead_letter",
+        *,
+        producer: Any = None,
+        kafka_async: bool = False,
+        max_in_flight: int = 10_000,
     ):
+        """Create the ledger.
+
+        ``producer`` may be passed instead of ``kafka_servers`` to reuse an
+        existing Kafka producer. With ``kafka_async`` events are published
+        without waiting for the broker; deliveries that fail are written to
+        ``dead_letter_events``. Call :meth:`close` to drain them on shutdown.
+        """
         self.db_path = db_path
         self.kafka_topic = kafka_topic
         self.dead_letter_topic = dead_letter_topic
-        self.producer = None
-        if kafka_servers and KafkaProducer:
-            self.producer = KafkaProducer(
-                bootstrap_servers=list(kafka_servers),
-                value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+        if producer is None and kafka_servers:
+            producer = build_producer(kafka_servers, asynchronous=kafka_async)
+        self.producer = producer
+        self.publisher: Optional[EventPublisher] = None
+        if producer is not None:
+            self.publisher = EventPublisher(
+                producer,
+                asynchronous=kafka_async,
+                max_in_flight=max_in_flight,
+                on_error=self._on_delivery_failure,
             )
         self._ensure_table()
 
     def _ensure_table(self) -> None:
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS usage_events (
@@ -104,78 +201,123 @@ class UsageLedger:
                 """
             )
             conn.commit()
+            # Optional columns are read once here; hot paths use the flags.
+            columns = migrations.table_columns(conn, "usage_events")
+            self._has_region = "region" in columns
+            migrations.apply_migrations(
+                conn,
+                "usage_ledger",
+                [(1, [_CREATE_HOURLY_SQL, self._rebuild_rollup])],
+            )
+
+    def _insert(self, conn: Any, events: list[UsageEvent]) -> None:
+        if self._has_region:
+            conn.executemany(
+                _INSERT_REGION_EVENT_SQL,
+                [_event_row(e) + (e.region,) for e in events],
+            )
+        else:
+            conn.executemany(_INSERT_EVENT_SQL, [_event_row(e) for e in events])
+        conn.executemany(_UPSERT_HOURLY_SQL, _hourly_rows(events, self._has_region))
+
+    def _rebuild_rollup(self, conn: Any) -> int:
+        region = "COALESCE(region, '')" if self._has_region else "''"
+        conn.execute("DELETE FROM usage_hourly")
+        cur = conn.execute(_REBUILD_HOURLY_SQL.format(region=region))
+        return cur.rowcount
+
+    def rebuild_rollup(self) -> int:
+        """Recompute ``usage_hourly`` from the raw events.
+
+        Returns the number of rollup rows written. Use this to backfill
+        databases created before the rollup existed or after editing
+        ``usage_events`` by hand.
+        """
+        with sqlite_pool.connect(self.db_path) as conn:
+            count = self._rebuild_rollup(conn)
+            conn.commit()
+        return count
 
+    @timed(OPERATION_SECONDS, "usage_ledger.add_event")
     def add_event(self, event: UsageEvent) -> None:
         """Insert event and optionally stream to Kafka."""
-        with tracer.start_as_current_span("UsageLedger.add_event") as span:
-            if span:
-                try:
-                    span.set_attribute("event_id", event.event_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(
-                    """
-                    INSERT INTO usage_events (
-                        event_id, ts, customer_id, provider, model,
-                        metric_type, units, unit_cost_usd
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        event.event_id,
-                        event.ts.isoformat(),
-                        event.customer_id,
-                        event.provider,
-                        event.model,
-                        event.metric_type,
-                        event.units,
-                        event.unit_cost_usd,
-                    ),
-                )
+        with tracer.span("UsageLedger.add_event", event_id=event.event_id):
+            with sqlite_pool.connect(self.db_path) as conn:
+                self._insert(conn, [event])
                 conn.commit()
-            if self.producer:
-                self.producer.send(self.kafka_topic, asdict(event))
-                self.producer.flush()
+            if self.publisher:
+                self.publisher.publish(self.kafka_topic, asdict(event))
+
+    @timed(OPERATION_SECONDS, "usage_ledger.add_events")
+    def add_events(self, events: Iterable[UsageEvent]) -> int:
+        """Insert ``events`` in one transaction and stream them as one batch.
+
+        Returns the number of events written. Kafka is flushed once per call
+        rather than once per event.
+        """
+        batch = list(events)
+        if not batch:
+            return 0
+        with tracer.batch_span("UsageLedger.add_events", len(batch)):
+            with sqlite_pool.connect(self.db_path) as conn:
+                self._insert(conn, batch)
+                conn.commit()
+            if self.publisher:
+                self.publisher.publish_many(
+                    self.kafka_topic, [asdict(event) for event in batch]
+                )
+        return len(batch)
 
     def get_hourly_totals(
         self, hours: int, region: Optional[str] = None
     ) -> list[float]:
         """Return spend totals for the last ``hours`` hours.
 
-        When ``region`` is provided and the ``usage_events`` table includes a
-        ``region`` column, totals are filtered accordingly.
+        Totals are read from the ``usage_hourly`` rollup, so the cost grows
+        with ``hours`` rather than with the number of events. When ``region``
+        is provided and the ``usage_events`` table includes a ``region``
+        column, totals are filtered accordingly.
         """
         end = datetime.now(UTC).replace(minute=0, second=0, microsecond=0)
         start = end - timedelta(hours=hours)
         totals = [0.0 for _ in range(hours)]
-        with sqlite3.connect(self.db_path) as conn:
-            query = "SELECT ts, units, unit_cost_usd FROM usage_events WHERE ts >= ? AND ts < ?"
-            params: list[str] = [start.isoformat(), end.isoformat()]
-            if region is not None:
-                info = conn.execute("PRAGMA table_info(usage_events)").fetchall()
-                if any(col[1] == "region" for col in info):
-                    query += " AND region = ?"
-                    params.append(region)
-            cur = conn.execute(query, params)
-            for ts_str, units, unit_cost in cur.fetchall():
-                ts = datetime.fromisoformat(ts_str)
-                idx = int((ts - start).total_seconds() // 3600)
-                if 0 <= idx < hours:
-                    totals[idx] += units * unit_cost
+        query = "SELECT hour, SUM(cost) FROM usage_hourly WHERE hour >= ? AND hour < ?"
+        params: list[str] = [start.isoformat(), end.isoformat()]
+        if region is not None and self._has_region:
+            query += " AND region = ?"
+            params.append(region)
+        query += " GROUP BY hour"
+        with sqlite_pool.connect(self.db_path) as conn:
+            rows = conn.execute(query, params).fetchall()
+        for hour, cost in rows:
+            idx = int((datetime.fromisoformat(hour) - start).total_seconds() // 3600)
+            if 0 <= idx < hours:
+                totals[idx] += cost
         return totals
 
-    def _write_dead_letter(self, data: dict, error: str) -> None:
-        raw = json.dumps(data)
+    def _record_dead_letter(self, data: Any, error: str) -> None:
+        raw = json.dumps(data, default=str)
         ts = datetime.now(UTC).isoformat()
-        with sqlite3.connect(self.db_path) as conn:
+        with sqlite_pool.connect(self.db_path) as conn:
             conn.execute(
                 "INSERT INTO dead_letter_events (raw, error, ts) VALUES (?, ?, ?)",
                 (raw, error, ts),
             )
             conn.commit()
-        if self.producer:
-            self.producer.send(self.dead_letter_topic, {"raw": data, "error": error})
-            self.producer.flush()
+
+    def _write_dead_letter(self, data: dict, error: str) -> None:
+        self._record_dead_letter(data, error)
+        if self.publisher:
+            self.publisher.publish(self.dead_letter_topic, {"raw": data, "error": error})
+
+    def _on_delivery_failure(self, topic: str, value: Any, exc: Exception) -> None:
+        # Only record locally; republishing to Kafka could fail the same way.
+        self._record_dead_letter(value, f"kafka delivery to {topic} failed: {exc}")
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Drain in-flight Kafka messages and close the producer."""
+        if self.publisher:
+            self.publisher.close(timeout)
 
     def parse_event(self, data: dict) -> Optional[UsageEvent]:
         """Convert a dict to ``UsageEvent`` and log malformed input."""
@@ -202,7 +344,13 @@ class UsageLedger:
 
 
 class ClickHouseUsageLedger:
-    """Usage ledger backed by ClickHouse."""
+    """Usage ledger backed by ClickHouse.
+
+    Kafka delivery failures are reported on the producer's I/O thread, but
+    the ClickHouse client is not thread-safe, so they are queued there and
+    written to ``dead_letter_events`` by the caller's thread on the next
+    :meth:`add_event` or :meth:`close`.
+    """
 
     def __init__(
         self,
@@ -211,6 +359,10 @@ class ClickHouseUsageLedger:
         region: Optional[str] = None,
         kafka_servers: Optional[Iterable[str]] = None,
         kafka_topic: str = "usage_events",
+        hourly_rollup: bool = False,
+        producer: Any = None,
+        kafka_async: bool = False,
+        max_in_flight: int = 10_000,
         **client_kwargs: Any,
     ) -> None:
         if Client is None:
@@ -219,11 +371,18 @@ class ClickHouseUsageLedger:
             host = os.getenv("EU_CLICKHOUSE_HOST", host)
         self.client = Client(host=host, **client_kwargs)
         self.kafka_topic = kafka_topic
-        self.producer = None
-        if kafka_servers and KafkaProducer:
-            self.producer = KafkaProducer(
-                bootstrap_servers=list(kafka_servers),
-                value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+        self.hourly_rollup = hourly_rollup
+        if producer is None and kafka_servers:
+            producer = build_producer(kafka_servers, asynchronous=kafka_async)
+        self.producer = producer
+        self._failed: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+        self.publisher: Optional[EventPublisher] = None
+        if producer is not None:
+            self.publisher = EventPublisher(
+                producer,
+                asynchronous=kafka_async,
+                max_in_flight=max_in_flight,
+                on_error=self._on_delivery_failure,
             )
         self._ensure_table()
 
@@ -245,14 +404,78 @@ class ClickHouseUsageLedger:
             ORDER BY (ts, event_id)
             """
         )
+        self.client.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letter_events (
+                raw String,
+                error String,
+                ts DateTime
+            )
+            ENGINE = MergeTree()
+            ORDER BY ts
+            """
+        )
+        try:
+            desc = self.client.execute("DESCRIBE TABLE usage_events")
+        except Exception:
+            desc = []
+        self._columns = {col[0] for col in desc or []}
+        if self.hourly_rollup:
+            self._ensure_rollup()
 
+    def _ensure_rollup(self) -> None:
+        """Create a ``SummingMergeTree`` hourly rollup fed by a materialized view.
+
+        A materialized view only sees inserts made after it exists, so when
+        the view is first created the existing events are backfilled into
+        ``usage_hourly`` with one ``INSERT ... SELECT``. Events inserted
+        while that runs can be counted twice; enable the rollup while writers
+        are paused. Parts are summed lazily by merges, so readers must still
+        ``sum()`` per hour.
+        """
+        rows = self.client.execute("EXISTS TABLE usage_hourly_mv")
+        backfill = not (rows and rows[0][0])
+        region_col = ", region" if "region" in self._columns else ""
+        region_def = "region String," if region_col else ""
+        self.client.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS usage_hourly (
+                hour DateTime,
+                customer_id String,
+                provider String,
+                model String,
+                {region_def}
+                units Float64,
+                cost Float64
+            )
+            ENGINE = SummingMergeTree((units, cost))
+            PARTITION BY toYYYYMM(hour)
+            ORDER BY (hour, customer_id, provider, model{region_col})
+            """
+        )
+        select = f"""
+            SELECT
+                toStartOfHour(ts) AS hour,
+                customer_id, provider, model{region_col},
+                sum(units) AS units,
+                sum(units * unit_cost_usd) AS cost
+            FROM usage_events
+            GROUP BY hour, customer_id, provider, model{region_col}
+            """
+        self.client.execute(
+            "CREATE MATERIALIZED VIEW IF NOT EXISTS usage_hourly_mv "
+            f"TO usage_hourly AS {select}"
+        )
+        if backfill:
+            self.client.execute(
+                f"INSERT INTO usage_hourly (hour, customer_id, provider, model"
+                f"{region_col}, units, cost) {select}"
+            )
+
+    @timed(OPERATION_SECONDS, "clickhouse_ledger.add_event")
     def add_event(self, event: UsageEvent) -> None:
-        with tracer.start_as_current_span("ClickHouseUsageLedger.add_event") as span:
-            if span:
-                try:
-                    span.set_attribute("event_id", event.event_id)
-                except Exception:  # pragma: no cover - dummy span
-                    pass
+        with tracer.span("ClickHouseUsageLedger.add_event", event_id=event.event_id):
+            self._flush_dead_letters()
             self.client.execute(
                 """
                 INSERT INTO usage_events (
@@ -273,29 +496,202 @@ class ClickHouseUsageLedger:
                     )
                 ],
             )
-            if self.producer:
-                self.producer.send(self.kafka_topic, asdict(event))
-                self.producer.flush()
+            if self.publisher:
+                self.publisher.publish(self.kafka_topic, asdict(event))
+
+    def _on_delivery_failure(self, topic: str, value: Any, exc: Exception) -> None:
+        # Runs on the Kafka I/O thread: only hand the row over.
+        self._failed.put(
+            (
+                json.dumps(value, default=str),
+                f"kafka delivery to {topic} failed: {exc}",
+                datetime.now(UTC),
+            )
+        )
+
+    def _flush_dead_letters(self) -> None:
+        rows = []
+        while True:
+            try:
+                rows.append(self._failed.get_nowait())
+            except queue.Empty:
+                break
+        if rows:
+            self.client.execute(
+                "INSERT INTO dead_letter_events (raw, error, ts) VALUES", rows
+            )
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Drain in-flight Kafka messages, record failures and close the producer."""
+        if self.publisher:
+            self.publisher.close(timeout)
+        self._flush_dead_letters()
 
     def get_hourly_totals(
         self, hours: int, region: Optional[str] = None
     ) -> list[float]:
+        """Return spend totals for the last ``hours`` hours.
+
+        Hours are bucketed and summed server-side, so one row per hour comes
+        back regardless of event volume. With ``hourly_rollup`` enabled the
+        pre-aggregated ``usage_hourly`` table is read instead of raw events.
+        """
         end = datetime.now(UTC).replace(minute=0, second=0, microsecond=0)
         start = end - timedelta(hours=hours)
         totals = [0.0 for _ in range(hours)]
-        query = "SELECT ts, units, unit_cost_usd FROM usage_events WHERE ts >= %(start)s AND ts < %(end)s"
+        if self.hourly_rollup:
+            query = (
+                "SELECT hour, sum(cost) FROM usage_hourly "
+                "WHERE hour >= %(start)s AND hour < %(end)s"
+            )
+        else:
+            query = (
+                "SELECT toStartOfHour(ts) AS hour, sum(units * unit_cost_usd) "
+                "FROM usage_events WHERE ts >= %(start)s AND ts < %(end)s"
+            )
         params = {"start": start, "end": end}
-        if region is not None:
-            try:
-                desc = self.client.execute("DESCRIBE TABLE usage_events")
-            except Exception:
-                desc = []
-            if any(col[0] == "region" for col in desc):
-                query += " AND region = %(region)s"
-                params["region"] = region
+        if region is not None and "region" in self._columns:
+            query += " AND region = %(region)s"
+            params["region"] = region
+        query += " GROUP BY hour ORDER BY hour"
         rows = self.client.execute(query, params)
-        for ts, units, unit_cost in rows:
-            idx = int((ts - start).total_seconds() // 3600)
+        for hour, total in rows:
+            if hour.tzinfo is None:
+                hour = hour.replace(tzinfo=UTC)
+            idx = int((hour - start).total_seconds() // 3600)
             if 0 <= idx < hours:
-                totals[idx] += units * unit_cost
+                totals[idx] += total
         return totals
+
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Background writer that group-commits events to a :class:`UsageLedger`.
+
+    Submitted events are queued and written by a single worker thread through
+    :meth:`UsageLedger.add_events` once ``max_batch`` events are waiting or
+    ``max_delay`` seconds have passed since the first event of the batch. The
+    queue holds at most ``max_queue`` events; when it is full :meth:`submit`
+    blocks (or raises ``queue.Full`` after ``timeout``) so producers slow down
+    instead of growing memory without bound. If a batch violates a
+    constraint (e.g. a duplicate ``event_id``), its events are retried one
+    at a time so only the offending event's future fails.
+    """
+
+    def __init__(
+        self,
+        ledger: UsageLedger,
+        *,
+        max_batch: int = 500,
+        max_delay: float = 0.05,
+        max_queue: int = 10_000,
+    ) -> None:
+        if max_batch < 1:
+            raise ValueError("max_batch must be positive")
+        self.ledger = ledger
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        # Orders submits against close so nothing is queued behind _STOP.
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="usage-ledger-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        event: UsageEvent,
+        *,
+        durable: bool = False,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """Queue ``event`` for the next group commit.
+
+        The returned future resolves once the batch containing the event has
+        been committed. With ``durable=True`` this call waits for that commit
+        and re-raises any write error.
+        """
+        fut: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            self._queue.put((event, fut), timeout=timeout)
+        if durable:
+            fut.result(timeout=timeout)
+        return fut
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Flush pending events and stop the worker thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def __enter__(self) -> "GroupCommitWriter":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: list[tuple[UsageEvent, Future]]) -> None:
+        try:
+            self.ledger.add_events(event for event, _ in batch)
+        except sqlite3.IntegrityError as exc:
+            if len(batch) == 1:
+                batch[0][1].set_exception(exc)
+                return
+            # One bad event rolled the whole group back; isolate it.
+            for item in batch:
+                self._commit([item])
+        except Exception as exc:
+            for _, fut in batch:
+                fut.set_exception(exc)
+        else:
+            for _, fut in batch:
+                fut.set_result(None)
+
+
+def main(argv: Iterable[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Usage ledger maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rebuild_p = sub.add_parser(
+        "rebuild-rollup", help="Rebuild the hourly rollup from raw events"
+    )
+    rebuild_p.add_argument("db_path", help="Path to the usage ledger database")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    if args.cmd == "rebuild-rollup":
+        count = UsageLedger(args.db_path).rebuild_rollup()
+        print(count)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,7 @@ def test_billing_cli_sync(tmp_path):
         """
 from token_tally.billing import StripeUsageClient
 
-def _fake(self, subscription_item, quantity, timestamp):
+def _fake(self, subscription_item, quantity, timestamp, idempotency_key=None):
     return {"id": "dummy"}
 
 StripeUsageClient.create_usage_record = _fake
@@ -15,14 +15,18 @@ def test_consolidate_invoices_quickbooks(tmp_path, monkeypatch):
 
     sent = {}
 
-    def fake_send(invoice, token):
+    def fake_send(invoice, token, request_id=None):
         sent["invoice"] = invoice
         sent["token"] = token
         return {"id": "qb1"}
 
     monkeypatch.setattr("token_tally.billing.send_invoice_to_quickbooks", fake_send)
     monkeypatch.setenv("QUICKBOOKS_TOKEN", "tok")
+    # By default the push is only queued for the drain worker.
     service.consolidate_invoices("2024-05")
+    assert sent == {}
+    assert ledger.get_invoice_sync_status("cust-2024-05") == {"quickbooks": "pending"}
+    service.consolidate_invoices("2024-05", push_timeout=30.0)
     assert sent["token"] == "tok"
     assert sent["invoice"]["invoice_id"] == "cust-2024-05"
 
@@ -35,7 +39,7 @@ def test_consolidate_invoices_no_quickbooks(tmp_path, monkeypatch):
 
     called = {"count": 0}
 
-    def fake_send(invoice, token):
+    def fake_send(invoice, token, request_id=None):
         called["count"] += 1
         return {}
 
@@ -43,3 +47,64 @@ def test_consolidate_invoices_no_quickbooks(tmp_path, monkeypatch):
     monkeypatch.delenv("QUICKBOOKS_TOKEN", raising=False)
     service.consolidate_invoices("2024-05")
     assert called["count"] == 0
+
+
+def test_quickbooks_batch_reuses_connection(monkeypatch):
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from token_tally.accounting import quickbooks
+
+    seen = {"ports": [], "sizes": [], "paths": []}
+
+    class FakeQuickBooks(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            items = body["BatchItemRequest"]
+            seen["ports"].append(self.client_address[1])
+            seen["paths"].append(self.path)
+            seen["sizes"].append(len(items))
+            responses = [
+                {"bId": item["bId"], "Fault": {"Error": [{"Message": "Duplicate"}]}}
+                if item["Invoice"]["invoice_id"] == "dup"
+                else {"bId": item["bId"], "Invoice": {"Id": "1"}}
+                for item in items
+            ]
+            payload = json.dumps({"BatchItemResponse": responses}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeQuickBooks)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(
+        quickbooks,
+        "QUICKBOOKS_BATCH_URL",
+        f"http://127.0.0.1:{server.server_port}/v3/batch",
+    )
+    try:
+        first = quickbooks.send_invoices_to_quickbooks(
+            [{"invoice_id": "a"}, {"invoice_id": "dup"}, {"invoice_id": "b"}], "tok"
+        )
+        second = quickbooks.send_invoices_to_quickbooks(
+            [{"invoice_id": "c"}], "tok", request_id="tt-1"
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert first[0] is None and first[2] is None
+    assert isinstance(first[1], quickbooks.QuickBooksFault)
+    assert "Duplicate" in str(first[1])
+    assert second == [None]
+    assert seen["sizes"] == [3, 1]
+    assert seen["paths"] == ["/v3/batch", "/v3/batch?requestid=tt-1"]
+    assert len(set(seen["ports"])) == 1
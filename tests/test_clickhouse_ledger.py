@@ -11,17 +11,23 @@ import token_tally.usage_ledger as usage_ledger
 class DummyClient:
     def __init__(self):
         self.rows = []
+        self.queries = []
 
     def execute(self, query, params=None):
+        self.queries.append(query)
         stmt = query.strip().split()[0].upper()
         if stmt == "INSERT":
-            self.rows.extend(params)
+            self.rows.extend(params or [])
         elif stmt == "SELECT":
+            assert "GROUP BY hour" in query
             start = params["start"]
             end = params["end"]
-            return [
-                (row[1], row[6], row[7]) for row in self.rows if start <= row[1] < end
-            ]
+            totals = {}
+            for row in self.rows:
+                if start <= row[1] < end:
+                    hour = row[1].replace(minute=0, second=0, microsecond=0)
+                    totals[hour] = totals.get(hour, 0.0) + row[6] * row[7]
+            return sorted(totals.items())
         else:
             return None
 
@@ -64,3 +70,69 @@ def test_region_selects_eu_host(monkeypatch):
     ledger = ClickHouseUsageLedger(region="eu")
     assert isinstance(ledger.client, DummyClientHost)
     assert ledger.client.host == "eu.example.com"
+
+
+def test_clickhouse_hourly_rollup(monkeypatch):
+    dummy = DummyClient()
+    monkeypatch.setattr(usage_ledger, "Client", lambda *a, **k: dummy)
+    ledger = ClickHouseUsageLedger(host="dummy", hourly_rollup=True)
+    assert any("SummingMergeTree" in q for q in dummy.queries)
+    assert any("MATERIALIZED VIEW" in q for q in dummy.queries)
+    # History from before the view existed is backfilled once.
+    assert any(q.startswith("INSERT INTO usage_hourly") for q in dummy.queries)
+    ledger.get_hourly_totals(2, region="eu")
+    assert "FROM usage_hourly" in dummy.queries[-1]
+    assert sum("DESCRIBE" in q for q in dummy.queries) == 1
+
+
+def test_delivery_failures_written_from_caller_thread(monkeypatch):
+    import threading
+
+    class ThreadCheckingClient(DummyClient):
+        def execute(self, query, params=None):
+            assert threading.current_thread() is threading.main_thread()
+            return super().execute(query, params)
+
+    class FailingFuture:
+        def add_callback(self, fn, *args):
+            pass
+
+        def add_errback(self, fn, *args):
+            # Deliveries are reported on the producer's I/O thread.
+            t = threading.Thread(target=fn, args=(*args, RuntimeError("broker down")))
+            t.start()
+            t.join()
+
+    class Producer:
+        def send(self, topic, value):
+            return FailingFuture()
+
+        def flush(self, timeout=None):
+            pass
+
+        def close(self, timeout=None):
+            pass
+
+    dummy = ThreadCheckingClient()
+    monkeypatch.setattr(usage_ledger, "Client", lambda *a, **k: dummy)
+    ledger = ClickHouseUsageLedger(host="dummy", producer=Producer(), kafka_async=True)
+    event = UsageEvent("e1", datetime.now(UTC), "cust", "openai", "gpt-4", "tokens", 1, 0.5)
+    ledger.add_event(event)
+    assert not any("dead_letter_events (raw" in q for q in dummy.queries)
+    ledger.close()
+    assert "dead_letter_events (raw" in dummy.queries[-1]
+    assert "broker down" in dummy.rows[-1][1]
+
+
+def test_clickhouse_rollup_backfills_only_new_view(monkeypatch):
+    class ExistingView(DummyClient):
+        def execute(self, query, params=None):
+            if query.startswith("EXISTS"):
+                self.queries.append(query)
+                return [(1,)]
+            return super().execute(query, params)
+
+    dummy = ExistingView()
+    monkeypatch.setattr(usage_ledger, "Client", lambda *a, **k: dummy)
+    ClickHouseUsageLedger(host="dummy", hourly_rollup=True)
+    assert not any(q.startswith("INSERT INTO usage_hourly") for q in dummy.queries)
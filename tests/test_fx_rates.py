@@ -1,5 +1,9 @@
 import sys
 import pathlib
+import sqlite3
+import time
+
+import pytest
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
 
@@ -73,3 +77,234 @@ def test_fetch_and_store_intraday(tmp_path, monkeypatch):
     fetch_and_store(db_path=str(db), intraday=True)
     rates = get_rates(db_path=str(db))
     assert rates["USD"] == 1.2
+
+
+def test_rate_cache_as_of_and_ttl(tmp_path, monkeypatch):
+    import sqlite3
+    from datetime import date
+
+    from token_tally.fx import FxRates
+    from token_tally.fx_rates import FxRateCache
+
+    db = str(tmp_path / "fx.db")
+    store_rates({"EUR": 1.0, "USD": 1.1}, db_path=db, fetch_date="2024-05-30")
+    store_rates({"EUR": 1.0, "USD": 1.2}, db_path=db, fetch_date="2024-06-03")
+    cache = FxRateCache(db, ttl=60)
+
+    assert cache.rates()["USD"] == 1.2
+    assert cache.rates("2024-06-01")["USD"] == 1.1
+    assert cache.rates(date(2024, 6, 3))["USD"] == 1.2
+    assert cache.rates("2024-01-01") == {}
+    assert cache.rates_on("2024-06-01") == {}
+    assert cache.rates("2024-06-02") is cache.rates("2024-05-31")
+    assert round(cache.convert(1.1, "USD", "EUR", "2024-05-31"), 9) == 1.0
+
+    # Rows written by another process show up once the TTL expires.
+    with sqlite3.connect(db) as conn:
+        conn.execute(
+            "INSERT INTO fx_rates (ts, currency, rate) "
+            "VALUES ('2024-06-04T00:00:00+00:00', 'USD', 1.3)"
+        )
+    assert cache.rates()["USD"] == 1.2
+    clock = [time.monotonic() + 61]
+    monkeypatch.setattr(fx_rates.time, "monotonic", lambda: clock[0])
+    assert cache.rates()["USD"] == 1.3
+
+    # Rates stored by this process are visible immediately.
+    store_rates({"EUR": 1.0, "USD": 1.4}, db_path=db, fetch_date="2024-06-05")
+    assert get_rates(db_path=db)["USD"] == 1.4
+    assert cache.rates()["USD"] == 1.4
+
+    rates = FxRates({"EUR": 1.0, "USD": 1.25, "GBP": 0.8})
+    assert rates.cross["USD", "GBP"] == 0.8 / 1.25
+    assert convert(10.0, "USD", "GBP", rates) == 10.0 * (0.8 / 1.25)
+    with pytest.raises(ValueError):
+        convert(1.0, "USD", "JPY", rates)
+
+
+def test_partial_intraday_snapshot_keeps_daily_currencies(tmp_path):
+    from token_tally.fx_rates import FxRateCache
+
+    db = str(tmp_path / "fx.db")
+    store_rates({"USD": 1.1, "GBP": 0.85}, db_path=db, fetch_date="2024-06-03")
+    store_rates({"USD": 1.2}, db_path=db, ts="2024-06-03T14:00:00+00:00")
+    cache = FxRateCache(db)
+
+    assert cache.rates() == {"USD": 1.2, "GBP": 0.85}
+    assert cache.rates("2024-06-03T12:00:00+00:00") == {"USD": 1.1, "GBP": 0.85}
+    assert round(cache.convert(1.2, "USD", "GBP"), 9) == 0.85
+
+
+def test_currency_dropped_from_daily_snapshot_is_not_carried_forward(tmp_path):
+    from token_tally.fx_rates import FxRateCache
+
+    db = str(tmp_path / "fx.db")
+    store_rates({"USD": 1.1, "CYP": 0.57}, db_path=db, fetch_date="2007-12-31")
+    store_rates({"USD": 1.2}, db_path=db, fetch_date="2008-01-02")
+    store_rates({"USD": 1.3}, db_path=db, ts="2008-01-03T14:00:00+00:00")
+    cache = FxRateCache(db)
+
+    assert cache.rates("2007-12-31") == {"USD": 1.1, "CYP": 0.57}
+    assert cache.rates() == {"USD": 1.3}
+    assert get_rates("2008-01-02", db_path=db) == {"USD": 1.2}
+    with pytest.raises(ValueError):
+        cache.convert(1.0, "USD", "CYP")
+
+
+def test_snapshot_queries_are_index_seeks(tmp_path):
+    import sqlite3
+
+    db = str(tmp_path / "fx.db")
+    store_rates({"USD": 1.1}, db_path=db, fetch_date="2024-06-03")
+    with sqlite3.connect(db) as conn:
+        for sql, params in [
+            (fx_rates._SNAPSHOT_AT_SQL, ("2024-06-03",)),
+            (fx_rates._RATES_AT_SQL, ("2024-06-03", "2024-06-04")),
+        ]:
+            plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            assert plan and all("SCAN" not in step for step in plan), plan
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_convert_many_mixed_currencies(monkeypatch, use_numpy):
+    from token_tally import fx
+
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(fx, "np", None)
+    rates = {"EUR": 1.0, "USD": 1.25, "GBP": 0.8}
+    converted, missing = fx.convert_many(
+        [10.0, 8.0, 5.0, 3.0], ["EUR", "GBP", "JPY", "USD"], "USD", rates
+    )
+    assert list(missing) == [False, False, True, False]
+    assert converted[0] == convert(10.0, "EUR", "USD", rates)
+    assert converted[1] == convert(8.0, "GBP", "USD", rates)
+    assert converted[2] != converted[2]
+    assert converted[3] == 3.0
+
+    converted, missing = fx.convert_many([1.25, 2.5], "USD", "EUR", rates)
+    assert list(converted) == [1.0, 2.0] and not any(missing)
+    converted, missing = fx.convert_many([1.0], "USD", "CHF", rates)
+    assert list(missing) == [True]
+    with pytest.raises(ValueError):
+        fx.convert_many([1.0, 2.0], ["USD"], "EUR", rates)
+
+
+def _ecb_xml(day, usd):
+    return (
+        "<?xml version='1.0' encoding='UTF-8'?>"
+        "<gesmes:Envelope xmlns:gesmes='http://www.gesmes.org/xml/2002-08-01' "
+        "xmlns='http://www.ecb.int/vocabulary/2002-08-01/eurofxref'>"
+        f"<Cube><Cube time='{day}'><Cube currency='USD' rate='{usd}'/>"
+        "</Cube></Cube></gesmes:Envelope>"
+    ).encode()
+
+
+def test_feed_poller_conditional_requests_and_history(tmp_path):
+    import sqlite3
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from token_tally.fx_feed import Feed, FxFeedPoller
+    from token_tally.fx_rates import FxRateCache
+
+    bodies = {
+        "/daily.xml": (_ecb_xml("2024-05-31", 1.1), "Fri, 31 May 2024 15:00:00 GMT"),
+        "/intraday.xml": (_ecb_xml("2024-06-03", 1.2), "Mon, 03 Jun 2024 09:30:00 GMT"),
+    }
+    seen = []
+
+    class Feeds(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body, modified = bodies[self.path]
+            etag = f'"{hash(body)}"'
+            seen.append((self.path, self.headers.get("If-None-Match") == etag))
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", modified)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Feeds)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    db = str(tmp_path / "fx.db")
+    feeds = [Feed("daily", base + "/daily.xml"), Feed("intraday", base + "/intraday.xml", True)]
+    try:
+        poller = FxFeedPoller(db, feeds, timeout=5)
+        first = poller.poll()
+        assert first["daily"].instant == "2024-05-31T00:00:00+00:00"
+        assert first["intraday"].instant == "2024-06-03T09:30:00+00:00"
+
+        assert {r.status for r in poller.poll().values()} == {"unchanged"}
+        assert sorted(seen[2:]) == [("/daily.xml", True), ("/intraday.xml", True)]
+
+        bodies["/intraday.xml"] = (_ecb_xml("2024-06-03", 1.3), "Mon, 03 Jun 2024 14:00:00 GMT")
+        # A fresh poller reuses the validators stored in the database.
+        poller.close()
+        poller = FxFeedPoller(db, feeds, timeout=5)
+        results = poller.poll()
+        assert results["daily"].status == "unchanged"
+        assert results["intraday"].instant == "2024-06-03T14:00:00+00:00"
+        poller.close()
+    finally:
+        server.shutdown()
+
+    cache = FxRateCache(db)
+    assert cache.rates("2024-06-03T12:00:00+00:00")["USD"] == 1.2
+    assert cache.rates("2024-06-03")["USD"] == 1.3
+    assert cache.rates("2024-06-02")["USD"] == 1.1
+    with sqlite3.connect(db) as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN " + fx_rates._SNAPSHOT_AT_SQL, ("2024-06-03",)
+        ).fetchall()
+    assert "SEARCH" in plan[0][-1] and "INDEX" in plan[0][-1], plan
+
+
+def test_backfill_streams_history(tmp_path, capsys):
+    from datetime import date, timedelta
+
+    from token_tally.fx import iter_ecb_rates
+    from token_tally.fx_rates import FxRateCache, backfill
+
+    start = date(2024, 1, 1)
+    days = [(start + timedelta(days=i)).isoformat() for i in range(40)]
+    cubes = "".join(
+        f"<Cube time='{day}'><Cube currency='USD' rate='{1 + i / 100:.2f}'/>"
+        f"<Cube currency='GBP' rate='0.85'/></Cube>"
+        for i, day in enumerate(reversed(days))
+    )
+    path = tmp_path / "eurofxref-hist.xml"
+    path.write_text(
+        "<?xml version='1.0' encoding='UTF-8'?>"
+        "<gesmes:Envelope xmlns:gesmes='http://www.gesmes.org/xml/2002-08-01' "
+        "xmlns='http://www.ecb.int/vocabulary/2002-08-01/eurofxref'>"
+        f"<Cube>{cubes}</Cube></gesmes:Envelope>"
+    )
+
+    rows = list(iter_ecb_rates(str(path)))
+    assert rows[:3] == [(days[-1], "EUR", 1.0), (days[-1], "USD", 1.0), (days[-1], "GBP", 0.85)]
+    assert len(rows) == 120
+
+    db = str(tmp_path / "fx.db")
+    assert backfill(str(path), db, chunk_size=7) == 120
+    cache = FxRateCache(db)
+    assert cache.rates()["USD"] == 1.0
+    assert cache.rates(days[0]) == {"EUR": 1.0, "USD": 1.39, "GBP": 0.85}
+
+    fx_rates.main(["--db", db, "backfill", str(path), "--chunk-size", "50"])
+    assert "Stored 120 FX rates" in capsys.readouterr().out
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM fx_rates").fetchone()[0] == 120
@@ -0,0 +1,59 @@
+import sys
+import pathlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from token_tally.http_pool import HTTPConnectionPool, _STALE_ERRORS  # noqa: E402
+
+
+class _DroppingHandler(BaseHTTPRequestHandler):
+    """Answers keep-alive style, then silently drops the connection."""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        self.requests.append(self.command)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+        self.close_connection = True
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pool():
+    _DroppingHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _DroppingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pool = HTTPConnectionPool(f"http://127.0.0.1:{server.server_port}", max_connections=1)
+    yield pool
+    pool.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_stale_connection_retried_for_idempotent_methods(pool):
+    assert pool.request("GET", "/").status == 200
+    assert pool.request("GET", "/").status == 200
+    assert _DroppingHandler.requests == ["GET", "GET"]
+
+
+def test_stale_connection_not_retried_for_post(pool):
+    assert pool.request("POST", "/", b"x").status == 200
+    # Only a POST the caller marks safe to resend is retried.
+    assert pool.request("POST", "/", b"x", retry_stale=True).status == 200
+    with pytest.raises(_STALE_ERRORS):
+        pool.request("POST", "/", b"x")
+    assert _DroppingHandler.requests == ["POST", "POST"]
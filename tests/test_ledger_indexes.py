@@ -0,0 +1,149 @@
+import pathlib
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from token_tally import ledger as ledger_mod  # noqa: E402
+from token_tally.ledger import Ledger  # noqa: E402
+from token_tally.migrations import apply_migrations, schema_version  # noqa: E402
+
+
+def _plan(db, sql, params):
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [row[-1] for row in rows]
+
+
+@pytest.mark.parametrize(
+    "sql, params, index",
+    [
+        (ledger_mod._PENDING_USAGE_SQL, (), "idx_usage_events_pending"),
+        (ledger_mod._PENDING_PAGE_SQL, ("e1", 100), "idx_usage_events_pending"),
+        (
+            ledger_mod._KEYED_PENDING_PAGE_SQL,
+            ("usage-a", "e1", 100),
+            "idx_usage_events_keyed_pending",
+        ),
+        (ledger_mod._USAGE_BY_CYCLE_SQL, ("2024-06",), "idx_usage_events_cycle"),
+        (ledger_mod._SPEND_BY_CUSTOMER_SQL, ("2024-06",), "idx_usage_events_cycle"),
+        (
+            ledger_mod._USAGE_BY_RANGE_SQL,
+            ("2024-06-01", "2024-06-30"),
+            "idx_usage_events_ts",
+        ),
+    ],
+)
+def test_usage_queries_use_indexes(tmp_path, sql, params, index):
+    db = str(tmp_path / "ledger.db")
+    Ledger(db)
+    plan = _plan(db, sql, params)
+    assert any(index in step for step in plan), plan
+    assert not any(step == "SCAN usage_events" for step in plan), plan
+
+
+def test_migrations_are_recorded_once(tmp_path):
+    db = str(tmp_path / "ledger.db")
+    Ledger(db)
+    Ledger(db)
+    with sqlite3.connect(db) as conn:
+        assert schema_version(conn, "ledger") == len(ledger_mod._MIGRATIONS)
+        assert schema_version(conn, "other") == 0
+        assert apply_migrations(conn, "other", [(1, ["CREATE TABLE t (x)"])]) == 1
+        assert apply_migrations(conn, "other", [(1, ["CREATE TABLE t (x)"])]) == 1
+        rows = conn.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0]
+    assert rows == len(ledger_mod._MIGRATIONS) + 1
+
+
+def test_failed_migration_rolls_back(tmp_path):
+    db = str(tmp_path / "m.db")
+    with sqlite3.connect(db) as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            apply_migrations(conn, "s", [(1, ["CREATE TABLE a (x)", "BOGUS"])])
+        assert schema_version(conn, "s") == 0
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master")}
+    assert "a" not in tables
+
+
+def test_concurrent_migrations_apply_once(tmp_path):
+    import threading
+    import time
+
+    db = str(tmp_path / "m.db")
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE t (x)")
+    # The pause keeps each migration open long enough for the others to
+    # read the applied versions before it commits.
+    pause = lambda conn: time.sleep(0.05)  # noqa: E731
+    steps = [
+        (1, ["ALTER TABLE t ADD COLUMN y", pause]),
+        (2, ["ALTER TABLE t RENAME x TO z", pause]),
+    ]
+    barrier = threading.Barrier(4)
+    errors = []
+
+    def migrate():
+        conn = sqlite3.connect(db, timeout=10)
+        barrier.wait()
+        try:
+            apply_migrations(conn, "s", steps)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=migrate) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    with sqlite3.connect(db) as conn:
+        assert schema_version(conn, "s") == 2
+        assert [r[1] for r in conn.execute("PRAGMA table_info(t)")] == ["z", "y"]
+
+
+def test_range_query_is_inclusive_of_end_date(tmp_path):
+    db = str(tmp_path / "ledger.db")
+    ledger = Ledger(db)
+    for i, ts in enumerate(
+        ["2024-05-31 23:59:59", "2024-06-01 00:00:00", "2024-06-30 23:59:59", "2024-07-01 00:00:00"]
+    ):
+        ledger.add_usage_event(f"e{i}", "c", "f", 1, 1.0, "2024-06")
+        with sqlite3.connect(db) as conn:
+            conn.execute("UPDATE usage_events SET ts = ? WHERE id = ?", (ts, f"e{i}"))
+    rows = ledger.get_usage_events_by_range("2024-06-01", "2024-06-30")
+    assert sorted(r["ts"] for r in rows) == ["2024-06-01 00:00:00", "2024-06-30 23:59:59"]
+
+
+def test_stores_track_migrations_independently(tmp_path):
+    from token_tally import fx_rates
+    from token_tally.audit import AuditLog
+    from token_tally.markup import MarkupRuleStore
+    from token_tally.usage_ledger import UsageLedger
+
+    # Ledger and UsageLedger both own a ``usage_events`` table, so only the
+    # other stores can share a file with either of them.
+    db = str(tmp_path / "shared.db")
+    UsageLedger(db)
+    AuditLog(db)
+    MarkupRuleStore(db)
+    fx_rates.store_rates({"USD": 1.1}, "2024-06-01", db_path=db)
+    with sqlite3.connect(db) as conn:
+        stores = dict(
+            conn.execute("SELECT store, MAX(version) FROM schema_migrations GROUP BY store")
+        )
+        hourly = conn.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'usage_hourly'"
+        ).fetchone()
+    assert stores == {"usage_ledger": 1, "audit": 1, "markup": 1, "fx_rates": 3}
+    assert hourly is not None
+
+    plan = _plan(
+        db,
+        "SELECT prev_hash FROM audit_events WHERE customer_id = ? ORDER BY ts DESC LIMIT 1",
+        ("c",),
+    )
+    assert any("idx_audit_events_customer_ts" in step for step in plan), plan
@@ -87,3 +87,87 @@ def test_event_markup_and_fx(tmp_path):
 
     expected = convert(0.02 * 1.1, "EUR", "USD", rates)
     assert round(stored, 6) == round(expected, 6)
+
+
+def test_markup_index_lookup_and_invalidation(tmp_path):
+    from token_tally.markup import get_markup_index
+
+    db = str(tmp_path / "rules.db")
+    store = MarkupRuleStore(db)
+    store.create_rule("a", "openai", "gpt-4", 0.1, "2024-01-01")
+    store.create_rule("b", "openai", "gpt-4", 0.2, "2024-06-01")
+    index = get_markup_index(db)
+
+    assert index.lookup("openai", "gpt-4", "2023-12-31") is None
+    assert index.lookup("openai", "gpt-4", "2024-03-01T00:00:00")["id"] == "a"
+    assert get_effective_markup("openai", "gpt-4", "2024-07-01", db_path=db)["id"] == "b"
+
+    store.update_rule("b", markup=0.5)
+    assert index.lookup("openai", "gpt-4", "2024-07-01")["markup"] == 0.5
+    store.delete_rule("b")
+    assert index.lookup("openai", "gpt-4", "2024-07-01")["id"] == "a"
+
+    with sqlite3.connect(db) as conn:
+        conn.execute(
+            "INSERT INTO markup_rules VALUES ('c', 'openai', 'gpt-4', 0.3, '2024-09-01')"
+        )
+    results = index.lookup_many(
+        "openai", "gpt-4", ["2023-01-01", "2024-02-01", "2024-10-01"]
+    )
+    assert [r and r["id"] for r in results] == [None, "a", "c"]
+    assert index.lookup_many("cohere", "x", ["2024-01-01"]) == [None]
+
+
+def test_bulk_usage_events_match_single_inserts(tmp_path):
+    rule_db = tmp_path / "rules.db"
+    store = MarkupRuleStore(str(rule_db))
+    store.create_rule("a", "openai", "gpt-4", 0.1, "2024-01-01")
+    store.create_rule("b", "openai", "gpt-4", 0.2, "2024-06-01")
+    store.create_rule("c", "anthropic", "claude", 0.5, "2024-01-01")
+    rates = {"EUR": 1.0, "USD": 1.1}
+
+    events = [
+        {
+            "event_id": f"e{i}",
+            "customer_id": "cust",
+            "feature": "feat",
+            "units": 1,
+            "unit_cost": 0.01 * (i + 1),
+            "invoice_cycle": "2024-06",
+            "provider": provider,
+            "model": model,
+            "currency": currency,
+            "ts": datetime(2024, month, 1),
+        }
+        for i, (provider, model, currency, month) in enumerate(
+            [
+                ("openai", "gpt-4", "EUR", 3),
+                ("openai", "gpt-4", "USD", 7),
+                ("anthropic", "claude", "EUR", 2),
+                (None, None, "USD", 5),
+            ]
+        )
+    ]
+    bad = [
+        {"event_id": "missing-cost", "customer_id": "c", "feature": "f", "units": 1,
+         "invoice_cycle": "2024-06"},
+        dict(events[0], event_id="no-rate", currency="JPY"),
+    ]
+
+    single = Ledger(str(tmp_path / "single.db"))
+    for ev in events:
+        single.add_usage_event(**ev, fx_rates=rates, markup_db_path=str(rule_db))
+    bulk = Ledger(str(tmp_path / "bulk.db"))
+    failures = bulk.add_usage_events(
+        events[:2] + bad + events[2:],
+        fx_rates=rates,
+        markup_db_path=str(rule_db),
+        chunk_size=2,
+    )
+
+    assert [f["event_id"] for f in failures] == ["missing-cost", "no-rate"]
+    query = "SELECT id, unit_cost, business_unit FROM usage_events ORDER BY id"
+    with sqlite3.connect(tmp_path / "single.db") as conn:
+        expected = conn.execute(query).fetchall()
+    with sqlite3.connect(tmp_path / "bulk.db") as conn:
+        assert conn.execute(query).fetchall() == expected
@@ -0,0 +1,170 @@
+import http.client
+import json
+import pathlib
+import socket
+import sys
+import threading
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from token_tally import server as server_mod  # noqa: E402
+from token_tally.markup import MarkupRuleStore  # noqa: E402
+from token_tally.metrics import HTTP_REQUEST_SECONDS  # noqa: E402
+
+
+def _start(tmp_path, monkeypatch):
+    store = MarkupRuleStore(str(tmp_path / "rules.db"))
+    store.create_rule("r1", "openai", "gpt-4", 0.1, "2024-01-01")
+    monkeypatch.setattr(server_mod, "store", store)
+    server_mod.response_cache.clear()
+    server = server_mod.MarkupServer(("127.0.0.1", 0), server_mod.MarkupHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _request(conn, method, path, body=None, headers=None):
+    payload = json.dumps(body).encode() if body is not None else None
+    conn.request(method, path, body=payload, headers=headers or {})
+    resp = conn.getresponse()
+    return resp, resp.read()
+
+
+def test_keep_alive_etag_and_invalidation(tmp_path, monkeypatch):
+    server = _start(tmp_path, monkeypatch)
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    try:
+        resp, body = _request(conn, "GET", "/markup-rules")
+        etag = resp.getheader("ETag")
+        assert resp.status == 200 and etag
+        assert [r["id"] for r in json.loads(body)] == ["r1"]
+        sock = conn.sock
+
+        resp, body = _request(conn, "GET", "/markup-rules", headers={"If-None-Match": etag})
+        assert resp.status == 304 and body == b""
+
+        resp, _ = _request(conn, "POST", "/nope", body={"ignored": True})
+        assert resp.status == 404
+        resp, _ = _request(
+            conn,
+            "POST",
+            "/markup-rules",
+            body={"id": "r2", "provider": "openai", "model": "gpt-4",
+                  "markup": 0.2, "effective_date": "2024-06-01"},
+        )
+        assert resp.status == 200
+
+        resp, body = _request(conn, "GET", "/markup-rules", headers={"If-None-Match": etag})
+        assert resp.status == 200
+        assert resp.getheader("ETag") != etag
+        assert sorted(r["id"] for r in json.loads(body)) == ["r1", "r2"]
+        # Every request above travelled over the same connection.
+        assert conn.sock is sock
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+
+    histogram = HTTP_REQUEST_SECONDS.labels("GET", "/markup-rules")
+    assert histogram._sum.get() > 0
+
+
+def test_slow_client_does_not_block_others(tmp_path, monkeypatch):
+    server = _start(tmp_path, monkeypatch)
+    slow = socket.create_connection(("127.0.0.1", server.server_port))
+    try:
+        slow.sendall(b"GET /markup-rules HTTP/1.1\r\nHost: x\r\n")  # never finished
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=5)
+        resp, body = _request(conn, "GET", "/markup-rules/r1")
+        assert resp.status == 200
+        assert json.loads(body)["id"] == "r1"
+        conn.close()
+    finally:
+        slow.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_batch_and_dsl_uploads_are_atomic(tmp_path, monkeypatch):
+    server = _start(tmp_path, monkeypatch)
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    try:
+        rules = [
+            {"id": f"b{i}", "provider": "openai", "model": f"m{i}",
+             "markup": 0.1, "effective_date": "2024-01-01"}
+            for i in range(2000)
+        ]
+        bad = rules + [
+            {"id": "x", "provider": "openai", "model": "m", "markup": "lots",
+             "effective_date": "2024-01-01"},
+            {"id": "b5", "provider": "openai", "model": "m5", "markup": 0.1,
+             "effective_date": "2024-01-01"},
+        ]
+        resp, body = _request(conn, "POST", "/markup-rules:batch", body={"rules": bad})
+        assert resp.status == 400
+        assert [e["index"] for e in json.loads(body)["errors"]] == [2000, 2001]
+        assert server_mod.store.get_rule("b0") is None
+
+        resp, body = _request(conn, "POST", "/markup-rules:batch", body=rules)
+        assert resp.status == 200 and json.loads(body) == {"loaded": 2000}
+        assert len(server_mod.store.list_rules()) == 2001
+
+        dsl = (
+            "# sheet\nopenai gpt-4o 20% 2024-07-01\nnot a rule\n"
+            "openai gpt-4o 10% 2024-02-30\nopenai gpt-4 1.2.3 2024-01-01\n"
+        )
+        conn.request("POST", "/markup-rules:dsl", body=dsl.encode())
+        resp = conn.getresponse()
+        errors = json.loads(resp.read())["errors"]
+        assert resp.status == 400
+        assert [e["line"] for e in errors] == [3, 4, 5]
+        assert server_mod.store.get_rule("openai-gpt-4o-2024-07-01") is None
+
+        conn.request("POST", "/markup-rules:dsl", body=b"openai gpt-4o 20% 2024-07-01\n")
+        resp = conn.getresponse()
+        assert resp.status == 200 and json.loads(resp.read()) == {"loaded": 1}
+        assert server_mod.store.get_rule("openai-gpt-4o-2024-07-01")["markup"] == 0.2
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_client_threads_close_their_sqlite_connections(tmp_path, monkeypatch):
+    import sqlite3
+    import time
+
+    from token_tally import sqlite_pool
+
+    opened = []
+    real_open = sqlite_pool._open
+
+    def tracking_open(path):
+        conn = real_open(path)
+        if threading.current_thread() is not threading.main_thread():
+            opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(sqlite_pool, "_open", tracking_open)
+    server = _start(tmp_path, monkeypatch)
+    try:
+        for _ in range(2):
+            conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+            for _ in range(2):
+                resp, _ = _request(conn, "PUT", "/markup-rules/r1", body={"markup": 0.3})
+                assert resp.status == 200
+            conn.close()
+        # One connection per client, reused across its kept-alive requests.
+        assert len(opened) == 2
+        deadline = time.monotonic() + 5
+        for db in opened:
+            while True:
+                try:
+                    # Unlike execute(), this skips the same-thread check.
+                    db.in_transaction
+                except sqlite3.ProgrammingError:
+                    break
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+    finally:
+        server.shutdown()
+        server.server_close()
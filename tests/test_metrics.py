@@ -62,3 +62,26 @@ def test_gateway_latency_metrics(tmp_path):
         ["node", str(run_js)], capture_output=True, text=True, check=True
     )
     assert 'gateway_request_latency_ms_total{provider="openai"} 100' in result.stdout
+
+
+def test_timed_decorator_and_context_manager(monkeypatch):
+    from token_tally import metrics
+
+    histogram = metrics.Histogram("test_timed_seconds", "test", ["op"])
+
+    def work():
+        return 42
+
+    monkeypatch.setattr(metrics, "_TIMING_ENABLED", False)
+    assert metrics.timed(histogram, "noop")(work) is work
+    with metrics.timed(histogram, "noop"):
+        pass
+    assert histogram.labels("noop")._sum.get() == 0
+
+    monkeypatch.setattr(metrics, "_TIMING_ENABLED", True)
+    timed_work = metrics.timed(histogram, "fn")(work)
+    assert timed_work() == 42 and timed_work.__name__ == "work"
+    with metrics.timed(histogram, "block"):
+        sum(range(1000))
+    assert histogram.labels("fn")._sum.get() > 0
+    assert histogram.labels("block")._sum.get() > 0
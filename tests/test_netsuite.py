@@ -20,11 +20,14 @@ class _Handler(BaseHTTPRequestHandler):
         body = self.rfile.read(length)
         _Handler.received["body"] = json.loads(body)
         _Handler.received["auth"] = self.headers.get("Authorization")
+        _Handler.received["request"] = (self.command, self.path)
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
         self.end_headers()
         self.wfile.write(b'{"status": "ok"}')
 
+    do_PUT = do_POST
+
 
 def _start_server():
     server = HTTPServer(("127.0.0.1", 0), _Handler)
@@ -50,3 +53,21 @@ def test_push_invoice_env(monkeypatch):
     assert resp["status"] == "ok"
     assert _Handler.received["body"]["id"] == "inv1"
     assert _Handler.received["auth"].startswith("Basic ")
+
+
+def test_push_invoice_upserts_by_external_id(monkeypatch):
+    server, thread = _start_server()
+    url = f"http://127.0.0.1:{server.server_address[1]}/push"
+    for name, value in [
+        ("NETSUITE_ACCOUNT", "acct"),
+        ("NETSUITE_TOKEN", "tok"),
+        ("NETSUITE_SECRET", "sec"),
+        ("NETSUITE_API_URL", url),
+    ]:
+        monkeypatch.setenv(name, value)
+
+    netsuite.push_invoice({"id": "inv1"}, external_id="tt-1")
+
+    server.shutdown()
+    thread.join()
+    assert _Handler.received["request"] == ("PUT", "/push/eid:tt-1")
@@ -0,0 +1,38 @@
+import sys
+import pathlib
+import threading
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from token_tally import sqlite_pool
+
+
+def test_connection_reused_per_thread(tmp_path):
+    db = str(tmp_path / "pool.db")
+    conn = sqlite_pool.connect(db)
+    assert sqlite_pool.connect(db) is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other = {}
+    thread = threading.Thread(target=lambda: other.update(conn=sqlite_pool.connect(db)))
+    thread.start()
+    thread.join()
+    assert other["conn"] is not conn
+
+    sqlite_pool.close(db)
+    assert sqlite_pool.connect(db) is not conn
+    sqlite_pool.close_all()
+
+
+def test_rollback_on_error(tmp_path):
+    db = str(tmp_path / "pool.db")
+    with sqlite_pool.connect(db) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+    try:
+        with sqlite_pool.connect(db) as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    count = sqlite_pool.connect(db).execute("SELECT count(*) FROM t").fetchone()[0]
+    assert count == 0
@@ -67,3 +67,101 @@ def test_parse_dcgm_gpu_minutes():
     ]
     result = tt.parse_dcgm_gpu_minutes(lines)
     assert abs(result - 1.5) < 1e-6
+
+
+def test_count_tokens_batch(monkeypatch):
+    texts = ["hello world!", "", "foo, bar baz", "one two three four"]
+    for provider in ["openai", "anthropic", "cohere", "ollama", "local", "other"]:
+        counts = tt.count_tokens_batch(provider, texts)
+        assert list(counts) == [tt.count_tokens(provider, t) for t in texts]
+
+    before = tt.TOKEN_COUNTER._value.get()
+    monkeypatch.setattr(tc, "BATCH_PROCESS_THRESHOLD", 2)
+    monkeypatch.setattr(tc, "_BATCH_CHUNK_SIZE", 3)
+    counts = tt.count_tokens_batch("local", iter(texts * 2), processes=2)
+    assert list(counts) == [2, 0, 3, 4] * 2
+    assert tt.TOKEN_COUNTER._value.get() - before == 18
+
+
+def test_token_cache_hits_and_eviction():
+    from token_tally.metrics import TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES
+    from token_tally.token_cache import TokenCountCache
+
+    cache = tt.enable_token_cache(max_entries=2)
+    try:
+        hits = TOKEN_CACHE_HITS._value.get()
+        misses = TOKEN_CACHE_MISSES._value.get()
+        assert tt.count_local_tokens("a b") == 2
+        assert tt.count_local_tokens("a b") == 2
+        assert TOKEN_CACHE_HITS._value.get() - hits == 1
+        assert TOKEN_CACHE_MISSES._value.get() - misses == 1
+        tt.count_cohere_tokens("a b")
+        tt.count_local_tokens("c")
+        assert len(cache) == 2
+        assert cache.get(cache.key("local", "a b")) is None
+    finally:
+        tt.disable_token_cache()
+
+    small = TokenCountCache(max_bytes=1)
+    small.put(small.key("local", "x"), 1)
+    assert len(small) == 0
+
+
+def test_count_tokens_with_prefix():
+    prefix = "You are a helpful assistant. Answer"
+    for suffix in ["", " briefly.", "ing now", "!?", "\nnext", "_x y"]:
+        for provider in ["local", "cohere", "openai", "anthropic", "ollama"]:
+            expected = tt.count_tokens(provider, prefix + suffix)
+            got = tt.count_tokens_with_prefix(provider, prefix, suffix)
+            assert got == expected, (provider, suffix)
+
+
+def test_token_counter_stream_matches_count_tokens():
+    import random
+
+    text = "Hello, world! Streaming   completions\n\tarrive in chunks_of-text 42x."
+    rng = random.Random(0)
+    for provider in ["openai", "anthropic", "cohere", "ollama", "local", "other"]:
+        for _ in range(20):
+            stream = tt.TokenCounterStream(provider)
+            pos = 0
+            while pos < len(text):
+                step = rng.randint(1, 7)
+                stream.feed(text[pos : pos + step])
+                pos += step
+            assert stream.finish() == tt.count_tokens(provider, text), provider
+
+
+def test_token_counter_stream_emits_usage_event(tmp_path):
+    ledger = tt.UsageLedger(str(tmp_path / "usage.db"))
+    stream = tt.TokenCounterStream(
+        "local",
+        ledger=ledger,
+        event={
+            "event_id": "s1",
+            "customer_id": "cust",
+            "model": "llama",
+            "unit_cost_usd": 0.001,
+        },
+    )
+    for _ in range(1000):
+        stream.feed("word ")
+    assert len(stream._tail) == 0
+    assert stream.finish() == 1000
+
+    import sqlite3
+
+    with sqlite3.connect(tmp_path / "usage.db") as conn:
+        row = conn.execute("SELECT event_id, provider, units FROM usage_events").fetchone()
+    assert row == ("s1", "local", 1000)
+
+
+def test_regex_count_matches_split(monkeypatch):
+    import random
+
+    monkeypatch.setattr(tc, "_COUNT_WINDOW", 5)
+    rng = random.Random(1)
+    alphabet = ["a", "b", "_", "7", "é", " ", "\n", ",", "!", "—", "averyveryverylongword"]
+    for _ in range(200):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        assert tc._regex_count(text) == len(tc._regex_split(text))
@@ -0,0 +1,116 @@
+import sys
+import pathlib
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+from token_tally import tracing
+from token_tally.token_counter import count_local_tokens, count_tokens_batch
+
+
+class _Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes or {})
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class _RecordingBackend:
+    def __init__(self):
+        self.spans = []
+
+    def get_tracer(self, name):
+        return self
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes=None):
+        span = _Span(name, attributes)
+        self.spans.append(span)
+        yield span
+
+
+@pytest.fixture
+def backend():
+    previous = (tracing._config.backend, tracing._config.sample_rate)
+    recorder = _RecordingBackend()
+    tracing.configure(sample_rate=1.0, backend=recorder)
+    yield recorder
+    tracing.configure(sample_rate=previous[1], backend=previous[0])
+
+
+def test_disabled_tracer_returns_shared_noop_span(backend):
+    tracing.configure(backend=None)
+    tracer = tracing.get_tracer("test")
+    assert tracer.span("a", x=1) is tracing.NOOP_SPAN
+    assert tracer.batch_span("b", 10) is tracing.NOOP_SPAN
+    with tracer.span("a") as span:
+        span.set_attribute("tokens", 3)
+    assert backend.spans == []
+
+
+def test_spans_record_attributes(backend):
+    count_local_tokens("a b c")
+    [span] = backend.spans
+    assert span.name == "count_local_tokens"
+    assert span.attributes == {"tokens": 3}
+
+
+def test_batch_span_suppresses_nested_spans(backend):
+    tracer = tracing.get_tracer("test")
+    with tracer.batch_span("bulk", 2):
+        for _ in range(2):
+            with tracer.span("item") as span:
+                span.set_attribute("ignored", True)
+    counts = count_tokens_batch("local", ["a b", "c"], processes=1)
+    assert list(counts) == [2, 1]
+    assert [(s.name, s.attributes) for s in backend.spans] == [
+        ("bulk", {"batch.size": 2}),
+        ("count_tokens_batch", {"batch.size": 2, "provider": "local", "tokens": 3}),
+    ]
+
+
+def test_head_sampling_decides_once_per_trace(backend, monkeypatch):
+    tracer = tracing.get_tracer("test")
+    tracing.configure(sample_rate=0.5)
+    rolls = iter([0.9, 0.1])
+    monkeypatch.setattr(tracing, "_random", lambda: next(rolls))
+    for _ in range(2):
+        with tracer.span("root"):
+            with tracer.span("child"):
+                pass
+    assert [s.name for s in backend.spans] == ["root", "child"]
+
+    tracing.configure(sample_rate=0.0)
+    assert not tracing.is_enabled()
+    with pytest.raises(ValueError):
+        tracing.configure(sample_rate=2)
+
+
+def test_unsampled_root_is_shared_and_suppresses_children(backend, monkeypatch):
+    tracer = tracing.get_tracer("test")
+    tracing.configure(sample_rate=0.5)
+    monkeypatch.setattr(tracing, "_random", lambda: 0.9)
+    first = tracer.span("root", x=1)
+    assert first is tracer.batch_span("bulk", 3)
+    assert not first.is_recording()
+    with first:
+        monkeypatch.setattr(tracing, "_random", lambda: 0.0)
+        assert tracer.span("child") is tracing.NOOP_SPAN
+    # Leaving the unsampled root starts the next trace afresh.
+    with tracer.span("next"):
+        pass
+    assert [s.name for s in backend.spans] == ["next"]
+
+
+@pytest.mark.parametrize("value", ["abc", "1.5", "nan"])
+def test_invalid_env_sample_rate_falls_back(backend, monkeypatch, caplog, value):
+    monkeypatch.setenv("TOKEN_TALLY_TRACE_SAMPLE_RATE", value)
+    with caplog.at_level("WARNING", logger="token_tally.tracing"):
+        assert tracing._sample_rate_from_env() is None
+    assert "TOKEN_TALLY_TRACE_SAMPLE_RATE" in caplog.text
+    monkeypatch.setenv("TOKEN_TALLY_TRACE_SAMPLE_RATE", "0.25")
+    assert tracing._sample_rate_from_env() == 0.25
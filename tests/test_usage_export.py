@@ -10,6 +10,8 @@ from token_tally.ledger import Ledger  # noqa: E402
 import token_tally.export.bigquery_export as bigquery_export  # noqa: E402
 import types
 
+import pytest
+
 
 def _dummy_snowflake(monkeypatch, rows):
     class _Cursor:
@@ -62,6 +64,25 @@ def test_export_usage_cli(tmp_path):
     assert "cust2" in lines[2]
 
 
+def test_export_usage_converts_currency(tmp_path):
+    from token_tally.export_usage import export_usage
+    from token_tally.fx_rates import store_rates
+
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    ledger.add_usage_event("e1", "cust1", "feat", 10, 0.125, "2024-05")
+    fx_db = str(tmp_path / "fx.db")
+    store_rates({"EUR": 1.0, "USD": 1.25}, fetch_date="2024-05-31", db_path=fx_db)
+    out_csv = tmp_path / "out.csv"
+    export_usage(
+        "2020-01-01", "2030-01-01", str(out_csv), ledger, currency="EUR", fx_db_path=fx_db
+    )
+    assert out_csv.read_text().splitlines()[1] == "cust1,feat,,,10,1.0"
+    with pytest.raises(ValueError):
+        export_usage(
+            "2020-01-01", "2030-01-01", str(out_csv), ledger, currency="JPY", fx_db_path=fx_db
+        )
+
+
 def test_snowflake_export_cli(tmp_path, monkeypatch):
     db_path = tmp_path / "ledger.db"
     ledger = Ledger(str(db_path))
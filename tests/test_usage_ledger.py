@@ -83,3 +83,205 @@ def test_usage_event_timestamp_timezone(tmp_path):
         ts = cur.fetchone()[0]
 
     assert "+00:00" in ts
+
+
+class _FakeProducer:
+    def __init__(self):
+        self.sent = []
+        self.flushes = 0
+
+    def send(self, topic, value):
+        self.sent.append((topic, value))
+
+    def flush(self, timeout=None):
+        self.flushes += 1
+
+
+def _event(i):
+    return UsageEvent(
+        event_id=f"evt{i}",
+        ts=datetime.now(UTC),
+        customer_id="cust",
+        provider="openai",
+        model="gpt-4",
+        metric_type="tokens",
+        units=1,
+        unit_cost_usd=0.01,
+    )
+
+
+def test_add_events_single_flush(tmp_path):
+    db_path = tmp_path / "ledger.db"
+    ledger = UsageLedger(db_path=str(db_path), producer=_FakeProducer())
+    assert ledger.add_events(_event(i) for i in range(5)) == 5
+    assert ledger.add_events([]) == 0
+    assert len(ledger.producer.sent) == 5
+    assert ledger.producer.flushes == 1
+
+    import sqlite3
+
+    with sqlite3.connect(db_path) as conn:
+        count = conn.execute("SELECT count(*) FROM usage_events").fetchone()[0]
+    assert count == 5
+
+
+def test_group_commit_writer(tmp_path):
+    from token_tally import GroupCommitWriter
+
+    db_path = tmp_path / "ledger.db"
+    ledger = UsageLedger(db_path=str(db_path), producer=_FakeProducer())
+    with GroupCommitWriter(ledger, max_batch=10, max_delay=1.0) as writer:
+        futures = [writer.submit(_event(i)) for i in range(9)]
+        writer.submit(_event(9), durable=True)
+        assert all(f.done() for f in futures)
+        writer.submit(_event(10))
+    assert ledger.producer.flushes == 2
+
+    import sqlite3
+
+    with sqlite3.connect(db_path) as conn:
+        count = conn.execute("SELECT count(*) FROM usage_events").fetchone()[0]
+    assert count == 11
+
+
+def test_group_commit_isolates_bad_events(tmp_path):
+    import sqlite3
+    import threading
+
+    import pytest
+
+    from token_tally import GroupCommitWriter
+
+    db_path = tmp_path / "ledger.db"
+    ledger = UsageLedger(db_path=str(db_path))
+    ledger.add_event(_event(0))
+    writer = GroupCommitWriter(ledger, max_batch=10, max_delay=1.0)
+    futures = [writer.submit(_event(i)) for i in range(3)]
+    writer.close()
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[0].result(timeout=5)
+    assert [f.result(timeout=5) for f in futures[1:]] == [None, None]
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT count(*) FROM usage_events").fetchone()[0] == 3
+
+    # Submits racing close either land before the stop marker or are refused.
+    writer = GroupCommitWriter(ledger, max_delay=0.001)
+    accepted = []
+
+    def produce(start):
+        for i in range(start, start + 50):
+            try:
+                accepted.append(writer.submit(_event(i)))
+            except RuntimeError:
+                return
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in (100, 200)]
+    for t in threads:
+        t.start()
+    writer.close()
+    for t in threads:
+        t.join()
+    assert all(f.result(timeout=5) is None for f in accepted)
+
+
+def test_hourly_rollup_and_rebuild(tmp_path):
+    from datetime import timedelta, timezone
+    import sqlite3
+    from token_tally.usage_ledger import main
+
+    db_path = tmp_path / "ledger.db"
+    ledger = UsageLedger(db_path=str(db_path))
+    hour = datetime.now(UTC).replace(minute=0, second=0, microsecond=0)
+    events = [_event(i) for i in range(3)]
+    events[0].ts = hour - timedelta(hours=2, minutes=-5)
+    events[1].ts = (hour - timedelta(hours=2, minutes=-30)).astimezone(
+        timezone(timedelta(hours=2))
+    )
+    events[2].ts = hour - timedelta(minutes=30)
+    ledger.add_events(events[:2])
+    ledger.add_event(events[2])
+
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT hour, events FROM usage_hourly").fetchall()
+    assert sorted(r[1] for r in rows) == [1, 2]
+    assert ledger.get_hourly_totals(3) == [0.0, 0.02, 0.01]
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM usage_hourly")
+    main(["rebuild-rollup", str(db_path)])
+    assert ledger.get_hourly_totals(3) == [0.0, 0.02, 0.01]
+
+
+def test_rollup_rebuild_matches_live_regions(tmp_path):
+    import sqlite3
+
+    def rollup(db_path):
+        with sqlite3.connect(db_path) as conn:
+            return sorted(conn.execute("SELECT * FROM usage_hourly").fetchall())
+
+    for with_column in (False, True):
+        db_path = tmp_path / f"ledger-{with_column}.db"
+        if with_column:
+            with sqlite3.connect(db_path) as conn:
+                conn.execute(
+                    "CREATE TABLE usage_events (event_id TEXT PRIMARY KEY, ts TEXT NOT NULL, "
+                    "customer_id TEXT NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL, "
+                    "metric_type TEXT NOT NULL, units REAL NOT NULL, "
+                    "unit_cost_usd REAL NOT NULL, region TEXT)"
+                )
+        ledger = UsageLedger(db_path=str(db_path))
+        events = [_event(i) for i in range(3)]
+        events[0].region = "eu"
+        events[1].region = "us"
+        ledger.add_events(events)
+        live = rollup(db_path)
+        ledger.rebuild_rollup()
+        assert rollup(db_path) == live
+        assert {row[4] for row in live} == ({"eu", "us", ""} if with_column else {""})
+
+
+class _FakeFuture:
+    def __init__(self, error=None):
+        self.error = error
+
+    def add_callback(self, fn, *args):
+        if self.error is None:
+            fn(*args, "metadata")
+
+    def add_errback(self, fn, *args):
+        if self.error is not None:
+            fn(*args, self.error)
+
+
+class _FakeAsyncProducer(_FakeProducer):
+    def send(self, topic, value):
+        super().send(topic, value)
+        if value.get("event_id") == "evt1":
+            return _FakeFuture(RuntimeError("broker down"))
+        return _FakeFuture()
+
+    def close(self, timeout=None):
+        self.closed = True
+
+
+def test_async_publish_dead_letters_failed_deliveries(tmp_path):
+    import sqlite3, json
+
+    db_path = tmp_path / "ledger.db"
+    producer = _FakeAsyncProducer()
+    ledger = UsageLedger(
+        db_path=str(db_path), producer=producer, kafka_async=True, max_in_flight=2
+    )
+    ledger.add_event(_event(0))
+    ledger.add_events([_event(1), _event(2), _event(3)])
+    assert len(producer.sent) == 4
+    assert producer.flushes == 0
+    ledger.close()
+    assert producer.flushes == 1
+    assert producer.closed
+
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT raw, error FROM dead_letter_events").fetchall()
+    assert len(rows) == 1
+    assert json.loads(rows[0][0])["event_id"] == "evt1"
+    assert "broker down" in rows[0][1]